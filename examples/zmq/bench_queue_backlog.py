@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+__author__    = 'Radical.Utils Development Team'
+__copyright__ = 'Copyright 2021, RADICAL@Rutgers'
+__license__   = 'MIT'
+
+
+import sys
+import time
+import tracemalloc
+
+from radical.utils.zmq.backlog import Backlog
+from radical.utils.zmq.utils   import pack_bulk, split_chunks
+
+
+# ------------------------------------------------------------------------------
+#
+# Measure the cost of the Queue bridge backlog: fill a backlog with `n_msgs`
+# messages (arriving in bulks of `put_bulk` messages), then drain it in bulks of
+# `get_bulk` messages.  We report the time per outgoing bulk and the memory used
+# per buffered message.  For comparison, the same is measured for a plain list
+# of messages which is drained via `del(buf[:get_bulk])` (as the bridge used to
+# do) - that is skipped for backlogs larger than 10^6 messages, as it takes
+# prohibitively long.
+#
+#   usage: bench_queue_backlog.py [put_bulk] [get_bulk] [n_msgs ...]
+#
+PUT_BULK = 100
+GET_BULK = 1024
+N_MSGS   = [10 ** 4, 10 ** 6, 10 ** 7]
+MAX_LIST = 10 ** 6
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_backlog(n_msgs, put_bulk, get_bulk):
+
+    template = pack_bulk([{'uid': 'task.%06d' % i} for i in range(put_bulk)])
+
+    tracemalloc.start()
+    buf = Backlog()
+    for _ in range(n_msgs // put_bulk):
+        # copy the frames so that no memory is shared between chunks
+        frames = [memoryview(f).tobytes() for f in template]
+        for chunk in split_chunks(frames):
+            buf.put(chunk)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    payload = buf.nbytes
+    n_bulks = 0
+    start   = time.time()
+    while len(buf):
+        buf.get(get_bulk)
+        n_bulks += 1
+    ttc = time.time() - start
+
+    return ttc / n_bulks, mem / n_msgs, payload / n_msgs
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_list(n_msgs, get_bulk):
+
+    msg = {'uid': 'task.000000'}
+
+    tracemalloc.start()
+    buf = [dict(msg) for _ in range(n_msgs)]
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    n_bulks = 0
+    start   = time.time()
+    while buf:
+        bulk = buf[:get_bulk]
+        del(buf[:get_bulk])
+        n_bulks += 1
+    ttc = time.time() - start
+
+    assert(bulk)
+
+    return ttc / n_bulks, mem / n_msgs
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    put_bulk = int(sys.argv[1]) if len(sys.argv) > 1 else PUT_BULK
+    get_bulk = int(sys.argv[2]) if len(sys.argv) > 2 else GET_BULK
+    sizes    = [int(n) for n in sys.argv[3:]] or N_MSGS
+
+    print('%10s  %14s  %14s  %14s  %14s  %14s'
+          % ('messages', 'deque us/bulk', 'deque B/msg', 'payload B/msg',
+             'list us/bulk', 'list B/msg'))
+
+    for n_msgs in sizes:
+
+        t_buf, m_buf, p_buf = bench_backlog(n_msgs, put_bulk, get_bulk)
+
+        if n_msgs <= MAX_LIST:
+            t_lst, m_lst = bench_list(n_msgs, get_bulk)
+            lst = '%14.1f  %14.1f' % (t_lst * 1e6, m_lst)
+        else:
+            lst = '%14s  %14s' % ('-', '-')
+
+        print('%10d  %14.1f  %14.1f  %14.1f  %s'
+              % (n_msgs, t_buf * 1e6, m_buf, p_buf, lst))
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+__author__    = 'Radical.Utils Development Team'
+__copyright__ = 'Copyright 2021, RADICAL@Rutgers'
+__license__   = 'MIT'
+
+
+import sys
+import time
+import random
+
+import threading     as mt
+
+import radical.utils as ru
+
+
+# ------------------------------------------------------------------------------
+#
+# Measure the forwarding latency of a `ru.zmq.Queue` under bursty load: a single
+# putter sends small bursts of messages, separated by random idle periods, and
+# a single getter records the time each message spent in flight.  We report the
+# latency distribution (in ms), the CPU time the process consumed while the
+# channel was mostly idle, and the CPU time consumed by a completely idle
+# channel.
+#
+#   usage: bench_queue_latency.py [n_bursts] [burst_size] [max_idle_ms]
+#
+N_BURSTS   = 200
+BURST_SIZE = 4
+MAX_IDLE   = 50    # ms
+IDLE_TIME  = 2.0   # s
+
+
+# ------------------------------------------------------------------------------
+#
+def main(n_bursts, burst_size, max_idle):
+
+    cfg = ru.Config(cfg={'uid'      : 'bench_latency',
+                         'channel'  : 'bench',
+                         'kind'     : 'queue',
+                         'path'     : '/tmp/',
+                         'bulk_size': 1024})
+
+    bridge = ru.zmq.Queue(cfg)
+    bridge.start()
+
+    putter = ru.zmq.Putter(cfg.channel, str(bridge.addr_put))
+    getter = ru.zmq.Getter(cfg.channel, str(bridge.addr_get))
+
+    n_total = n_bursts * burst_size
+    lat     = list()
+
+    def work_get():
+        while len(lat) < n_total:
+            for msg in getter.get():
+                lat.append(time.time() - msg['t'])
+
+    t_get = mt.Thread(target=work_get)
+    t_get.daemon = True
+    t_get.start()
+
+    # warm up the connections
+    time.sleep(0.5)
+
+    cpu_0 = time.process_time()
+    wall_0 = time.time()
+
+    for _ in range(n_bursts):
+        time.sleep(random.uniform(0, max_idle) / 1000)
+        for _ in range(burst_size):
+            putter.put({'t': time.time()})
+
+    t_get.join()
+
+    cpu  = time.process_time() - cpu_0
+    wall = time.time()         - wall_0
+
+    # let the channel idle for a bit to see what an idle bridge costs
+    idle_0 = time.process_time()
+    time.sleep(IDLE_TIME)
+    idle   = time.process_time() - idle_0
+
+    bridge.stop()
+
+    lat  = sorted([x * 1000 for x in lat])
+    pcts = [50, 90, 99, 99.9, 100]
+
+    print('messages : %d' % n_total)
+    print('wall time: %.2f s' % wall)
+    print('cpu  time: %.2f s (%.1f%%)' % (cpu, 100 * cpu / wall))
+    print('idle cpu : %.3f s in %.1f s' % (idle, IDLE_TIME))
+    print('latency  : %s' % '  '.join(
+          ['p%s=%.3fms' % (p, lat[min(len(lat) - 1, int(len(lat) * p / 100))])
+           for p in pcts]))
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    n_bursts   = int(sys.argv[1]) if len(sys.argv) > 1 else N_BURSTS
+    burst_size = int(sys.argv[2]) if len(sys.argv) > 2 else BURST_SIZE
+    max_idle   = int(sys.argv[3]) if len(sys.argv) > 3 else MAX_IDLE
+
+    main(n_bursts, burst_size, max_idle)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+__author__    = 'Radical.Utils Development Team'
+__copyright__ = 'Copyright 2021, RADICAL@Rutgers'
+__license__   = 'MIT'
+
+
+import sys
+import time
+
+import multiprocessing as mp
+
+import radical.utils   as ru
+
+
+# ------------------------------------------------------------------------------
+#
+# Measure the throughput of a `ru.zmq.Queue`: a putter process pushes `n_msgs`
+# messages with a payload of `msg_size` bytes in bulks of `put_bulk` messages,
+# and a getter process consumes them.  The bridge runs in the main process.  We
+# report messages/s and MB/s.
+#
+# With `batch` > 0, the putter coalesces up to that many messages per bulk
+# (which is mostly useful with `put_bulk=1`).
+#
+#   usage: bench_queue_throughput.py [n_msgs] [msg_size] [put_bulk] [prefetch]
+#                                    [batch]
+#
+N_MSGS   = 100000
+MSG_SIZE = 100
+PUT_BULK = 100
+PREFETCH = 4
+BATCH    = 0
+
+
+# ------------------------------------------------------------------------------
+#
+def work_put(cfg, url, n_msgs, msg_size, put_bulk):
+
+    putter  = ru.zmq.Putter(cfg.channel, url, cfg=cfg)
+    payload = 'x' * msg_size
+    bulk    = [{'uid': 'task.%06d' % i, 'data': payload}
+                                        for i in range(put_bulk)]
+    n_put   = 0
+    while n_put < n_msgs:
+        putter.put(bulk[:n_msgs - n_put])
+        n_put += len(bulk)
+
+    putter.flush()
+
+    # allow the socket to flush
+    time.sleep(1)
+
+
+# ------------------------------------------------------------------------------
+#
+def work_get(cfg, url, n_msgs, result):
+
+    getter = ru.zmq.Getter(cfg.channel, url, cfg=cfg)
+    n_recv = len(getter.get())
+    start  = time.time()
+
+    while n_recv < n_msgs:
+        n_recv += len(getter.get())
+
+    result.put([n_recv, time.time() - start])
+
+
+# ------------------------------------------------------------------------------
+#
+def main(n_msgs, msg_size, put_bulk, prefetch, batch):
+
+    cfg = ru.Config(cfg={'uid'       : 'bench_throughput',
+                         'channel'   : 'bench',
+                         'kind'      : 'queue',
+                         'path'      : '/tmp/',
+                         'bulk_size' : 1024,
+                         'prefetch'  : prefetch,
+                         'batch_msgs': batch})
+
+    bridge = ru.zmq.Queue(cfg)
+    bridge.start()
+
+    result = mp.Queue()
+    p_get  = mp.Process(target=work_get, args=[cfg, str(bridge.addr_get),
+                                               n_msgs, result])
+    p_put  = mp.Process(target=work_put, args=[cfg, str(bridge.addr_put),
+                                               n_msgs, msg_size, put_bulk])
+    p_get.start()
+    p_put.start()
+
+    n_recv, ttc = result.get()
+
+    p_put.join()
+    p_get.join()
+    bridge.stop()
+
+    print('messages : %d x %d bytes' % (n_recv, msg_size))
+    print('time     : %.2f s' % ttc)
+    print('rate     : %.0f msg/s  %.1f MB/s'
+          % (n_recv / ttc, n_recv * msg_size / ttc / 1024 / 1024))
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    n_msgs   = int(sys.argv[1]) if len(sys.argv) > 1 else N_MSGS
+    msg_size = int(sys.argv[2]) if len(sys.argv) > 2 else MSG_SIZE
+    put_bulk = int(sys.argv[3]) if len(sys.argv) > 3 else PUT_BULK
+    prefetch = int(sys.argv[4]) if len(sys.argv) > 4 else PREFETCH
+    batch    = int(sys.argv[5]) if len(sys.argv) > 5 else BATCH
+
+    main(n_msgs, msg_size, put_bulk, prefetch, batch)
+
+
+# ------------------------------------------------------------------------------
+
@@ -4,9 +4,15 @@ __copyright__ = "Copyright 2018"
 __license__   = "GPL"
 
 
-from .bridge import Bridge
-from .queue  import Queue,  Putter,    Getter
-from .pubsub import PubSub, Publisher, Subscriber
+from .bridge   import Bridge
+from .queue    import Queue,  Putter,    Getter
+from .shard    import ShardedQueue
+from .pubsub   import PubSub, Publisher, Subscriber
+from .rpc      import Server, Client
+from .codec    import Codec,  register_codec
+from .executor import Executor, InlineExecutor, ThreadExecutor, ProcessExecutor
+from .executor import ConflatingExecutor
+from .aio      import AsyncPutter, AsyncGetter, AsyncPublisher, AsyncSubscriber
 
 
 # ------------------------------------------------------------------------------
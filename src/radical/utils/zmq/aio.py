@@ -0,0 +1,485 @@
+
+import zmq
+import queue
+import asyncio
+import msgpack
+
+import zmq.asyncio
+
+from ..atfork  import atfork
+from ..ids     import generate_id, ID_CUSTOM
+from ..misc    import as_string, as_bytes, as_list, noop
+from ..logger  import Logger
+
+from .codec    import get_codec, get_decoders
+from .context  import get_context
+from .transport import select_url, split_url
+from .utils    import pack_bulk, unpack_bulk
+from .queue    import _bounded, _LINGER_TIMEOUT, _HIGH_WATER_MARK, _BOUNDED_HWM
+from .queue    import _PRIO_QUERY
+from .pubsub   import _unpack, _split_snapshot, _SNAP_QUERY, _SNAP_TIMEOUT
+
+
+# ------------------------------------------------------------------------------
+#
+# The classes in this module are asyncio variants of `Putter`, `Getter`,
+# `Publisher` and `Subscriber`.  They speak the same protocols as their blocking
+# counterparts (and can thus be mixed with them on the same channel), but all
+# socket operations are coroutines which run in the event loop of the calling
+# coroutine.  No threads are created per endpoint: instead of registering
+# callbacks, consumers iterate over incoming messages:
+#
+#     getter = ru.zmq.AsyncGetter(channel, url)
+#     async for msg in getter:
+#         ...
+#
+# All endpoints use a `zmq.asyncio.Context` which shadows the process wide zmq
+# context (see `context.py`), and thus share its I/O threads, so that an asyncio
+# service can connect to many channels at little cost.  An endpoint must only be
+# used from a single event loop.
+#
+_ctx = None
+
+
+def _get_ctx():
+
+    global _ctx                                          # pylint: disable=W0603
+
+    if _ctx is None:
+        _ctx = zmq.asyncio.Context.shadow(get_context())
+
+    return _ctx
+
+
+def _atfork_child():
+
+    global _ctx                                          # pylint: disable=W0603
+    _ctx = None
+
+
+atfork(noop, noop, _atfork_child)
+
+
+# ------------------------------------------------------------------------------
+#
+class _AsyncEndpoint(object):
+    '''
+    common setup for all async endpoints
+    '''
+
+    _kind = None
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, channel, url, log=None, cfg=None):
+
+        self._channel = channel
+        self._url     = as_string(url)
+        self._cfg     = cfg or dict()
+        self._log     = log
+        self._lock    = None             # created in the event loop
+        self._uid     = generate_id('%s.%s.%%(counter)04d'
+                                    % (self._channel, self._kind), ID_CUSTOM)
+
+        if not self._log:
+            self._log = Logger(name=self._uid, ns='radical.utils.zmq')
+
+        self._log.info('connect %s to %s: %s', self._kind, self._channel,
+                                               self._url)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _socket(self, stype, hwm=_HIGH_WATER_MARK, url=None):
+
+        sock        = _get_ctx().socket(stype)
+        sock.linger = _LINGER_TIMEOUT
+        sock.hwm    = hwm
+        sock.connect(select_url(url or self._url))
+
+        return sock
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _get_lock(self):
+        '''
+        The lock serializes concurrent coroutines on the same endpoint.  It is
+        created lazily, so that it is bound to the loop the endpoint is used in
+        (not to the loop which may or may not run when it is constructed).
+        '''
+
+        if not self._lock:
+            self._lock = asyncio.Lock()
+
+        return self._lock
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __str__(self):
+        return '%s(%s @ %s)' % (type(self).__name__, self._channel, self._url)
+
+    @property
+    def name(self):
+        return self._uid
+
+    @property
+    def uid(self):
+        return self._uid
+
+    @property
+    def channel(self):
+        return self._channel
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self):
+
+        self._sock.close()
+
+
+# ------------------------------------------------------------------------------
+#
+class AsyncPutter(_AsyncEndpoint):
+
+    _kind = 'put'
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, channel, url, log=None, cfg=None):
+        '''
+        The channel config `cfg` is interpreted as for `Putter` (codec and
+        buffer limits), but coalescing is not supported.
+        '''
+
+        super(AsyncPutter, self).__init__(channel, url, log, cfg)
+
+        self._hwm = _HIGH_WATER_MARK
+        if _bounded(self._cfg):
+            self._hwm = _BOUNDED_HWM
+
+        # priority messages use a separate socket (see `Queue`)
+        self._url, self._url_prio = split_url(self._url, _PRIO_QUERY)
+
+        self._codec = get_codec(cfg=self._cfg)
+        self._sock  = self._socket(zmq.PUSH, self._hwm)
+        self._prio  = None
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def put(self, msgs, block=True, timeout=None, priority=0):
+        '''
+        Send a message or a list of messages.  On a bounded channel, this waits
+        (without blocking the event loop) until the bridge accepts the messages,
+        or raises `queue.Full` if it does not do so within `timeout` ms (or
+        immediately if `block` is `False`).  See `Putter.put()` for `priority`.
+        '''
+
+        frames = pack_bulk(msgs, self._codec, priority=priority)
+
+        if not frames:
+            return
+
+        async with self._get_lock():
+
+            sock = self._sock
+            if priority > 0 and self._url_prio:
+                if not self._prio:
+                    self._prio = self._socket(zmq.PUSH, self._hwm,
+                                              self._url_prio)
+                sock = self._prio
+
+            if not block:
+                timeout = 0
+
+            if timeout is not None:
+                if not await sock.poll(timeout, zmq.POLLOUT):
+                    raise queue.Full('channel %s is full' % self._channel)
+
+            await sock.send_multipart(frames, copy=False)
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def put_nowait(self, msgs, priority=0):
+
+        await self.put(msgs, block=False, priority=priority)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self):
+
+        if self._prio:
+            self._prio.close()
+
+        super(AsyncPutter, self).stop()
+
+
+# ------------------------------------------------------------------------------
+#
+class AsyncGetter(_AsyncEndpoint):
+
+    _kind = 'get'
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, channel, url, log=None, cfg=None):
+        '''
+        The channel config `cfg` can specify `prefetch`, `bulk_size` and the
+        codecs to decode (`codec`, `codecs`) as for `Getter`.
+        '''
+
+        super(AsyncGetter, self).__init__(channel, url, log, cfg)
+
+        self._prefetch  = int(self._cfg.get('prefetch')  or 0)
+        self._size      = int(self._cfg.get('bulk_size') or 0)
+        self._codecs    = get_decoders(self._cfg)
+        self._requested = 0              # number of credits granted
+
+        if self._prefetch: self._sock = self._socket(zmq.DEALER)
+        else             : self._sock = self._socket(zmq.REQ)
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def _request(self, credit):
+
+        req = msgpack.packb({'uid'   : self._uid,
+                             'credit': credit,
+                             'size'  : self._size})
+
+        if self._prefetch: await self._sock.send_multipart([b'', req])
+        else             : await self._sock.send(req)
+
+        self._requested += credit
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def get_nowait(self, timeout=None):  # timeout in ms
+        '''
+        Receive the next bulk of messages and return them as list, or return
+        `None` if no messages arrive within `timeout` ms (`None`: wait forever).
+        '''
+
+        async with self._get_lock():
+
+            # keep `prefetch` bulks (or one bulk) requested from the bridge
+            credit = max(1, self._prefetch) - self._requested
+            if credit > 0:
+                await self._request(credit)
+
+            if not await self._sock.poll(timeout, zmq.POLLIN):
+                return None
+
+            frames = await self._sock.recv_multipart(copy=False)
+            self._requested -= 1
+
+        if self._prefetch:
+            frames = frames[1:]  # strip the delimiter frame
+
+        return unpack_bulk(frames, codecs=self._codecs)
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def get(self):
+
+        return await self.get_nowait()
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def __aiter__(self):
+        '''
+        iterate over individual messages
+        '''
+
+        while True:
+            for msg in await self.get():
+                yield msg
+
+
+# ------------------------------------------------------------------------------
+#
+class AsyncPublisher(_AsyncEndpoint):
+
+    _kind = 'pub'
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, channel, url, log=None, cfg=None):
+        '''
+        The optional channel config `cfg` can specify the `codec` to use for
+        message serialization (see `codec.py`).
+        '''
+
+        super(AsyncPublisher, self).__init__(channel, url, log, cfg)
+
+        self._codec = get_codec(cfg=self._cfg)
+        self._sock  = self._socket(zmq.PUB)
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def put(self, topic, msg):
+
+        assert(isinstance(topic, str )), 'invalid topic type'
+        assert(isinstance(msg,   dict)), 'invalid message type'
+
+        await self._publish(topic, [msg], bulk=False)
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def put_bulk(self, topic, msgs):
+        '''
+        publish a list of messages as a single publication (see
+        `Publisher.put_bulk()`)
+        '''
+
+        if topic is None:
+            assert(isinstance(msgs, dict)), 'invalid message type'
+            for t, tmsgs in msgs.items():
+                await self.put_bulk(t, tmsgs)
+            return
+
+        msgs = as_list(msgs)
+
+        assert(isinstance(topic, str)), 'invalid topic type'
+        assert(all([isinstance(msg, dict) for msg in msgs])), \
+                                                       'invalid message type'
+        if msgs:
+            await self._publish(topic, msgs, bulk=True)
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def _publish(self, topic, msgs, bulk):
+
+        btopic    = as_bytes(topic.replace(' ', '_'))
+        frames    = pack_bulk(msgs, self._codec, bulk=bulk)
+        frames[0] = btopic + b' ' + frames[0]
+
+        async with self._get_lock():
+            await self._sock.send_multipart(frames, copy=False)
+
+
+# ------------------------------------------------------------------------------
+#
+class AsyncSubscriber(_AsyncEndpoint):
+
+    _kind = 'sub'
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, channel, url, topic=None, log=None, cfg=None):
+        '''
+        If a `topic` (or list of topics) is given, the channel will subscribe to
+        it immediately.  The channel config `cfg` can specify the codecs to
+        decode (`codec`, `codecs`) as for `Subscriber`.
+
+        As for `Subscriber`, the cache snapshot of a subscribed topic (if the
+        bridge keeps a cache) is returned before any live message.  It is
+        requested by the next `get()` call after subscribing.
+        '''
+
+        super(AsyncSubscriber, self).__init__(channel, url, log, cfg)
+
+        self._url, self._url_snap = split_url(self._url, _SNAP_QUERY)
+
+        self._codecs  = get_decoders(self._cfg)
+        self._sock    = self._socket(zmq.SUB)
+        self._snaps   = list()         # topics to fetch the snapshot for
+        self._pending = list()         # snapshot publications not yet returned
+
+        for t in as_list(topic):
+            self.subscribe(t)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def subscribe(self, topic):
+
+        topic = topic.replace(' ', '_')
+        self._log.debug('~~ %s: %s', self._channel, topic)
+        self._sock.setsockopt(zmq.SUBSCRIBE, as_bytes(topic))
+
+        if self._url_snap:
+            self._snaps.append(topic)
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def _snapshot(self, topic):
+
+        sock        = self._socket(zmq.REQ, url=self._url_snap)
+        sock.linger = 0
+
+        try:
+            await sock.send(as_bytes(topic))
+
+            if not await sock.poll(_SNAP_TIMEOUT, zmq.POLLIN):
+                self._log.warn('no cache snapshot from %s', self._url_snap)
+                return list()
+
+            frames = await sock.recv_multipart(copy=False)
+
+        finally:
+            sock.close()
+
+        return _split_snapshot(frames)
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def get_nowait(self, timeout=None):  # timeout in ms
+        '''
+        Receive the next published message and return `[topic, msg]`, or
+        `[None, None]` if nothing arrives within `timeout` ms (`None`: wait
+        forever).
+        '''
+
+        async with self._get_lock():
+
+            while self._snaps:
+                self._pending.extend(await self._snapshot(self._snaps.pop(0)))
+
+            if self._pending:
+                frames = self._pending.pop(0)
+
+            else:
+                if not await self._sock.poll(timeout, zmq.POLLIN):
+                    return [None, None]
+
+                frames = await self._sock.recv_multipart(copy=False)
+
+        return _unpack(frames, self._codecs)
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def get(self):
+
+        return await self.get_nowait()
+
+
+    # --------------------------------------------------------------------------
+    #
+    async def __aiter__(self):
+        '''
+        iterate over individual messages as `[topic, msg]` pairs
+        '''
+
+        while True:
+            topic, msgs = await self.get()
+            for msg in as_list(msgs):
+                yield [topic, msg]
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,705 @@
+
+import os
+import bisect
+import struct
+import itertools
+
+import collections as mc
+
+from .utils import split_chunks, join_chunks, chunk_priority
+
+
+# ------------------------------------------------------------------------------
+#
+def chunk_size(chunk):
+    '''
+    number of payload bytes in a chunk (including out-of-band frames, but
+    excluding the chunk header)
+    '''
+
+    if chunk[0][2]:
+        return sum([len(frame) for frame in chunk[2][1:]])
+    else:
+        return len(chunk[1])
+
+
+# ------------------------------------------------------------------------------
+#
+class Backlog(object):
+    '''
+    FIFO buffer for the messages held by a bridge.  Messages are stored as
+    chunks `[hdr, payload, frames]` (see `utils.split_chunks()`) in a deque, so
+    that adding and removing chunks is O(1), independent of the size of the
+    backlog.  When a bulk ends within a chunk, the consumed part of the first
+    chunk is tracked by a message index and a byte offset instead of slicing the
+    chunk, so that taking a bulk of `n` messages is O(n), independent of the
+    size of the chunk.  Messages are never decoded or copied.  Any elements
+    which follow `frames` in a chunk (like the arrival time a bridge appends)
+    are kept when a chunk is split.
+    '''
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self):
+
+        self._chunks = mc.deque()
+        self._idx    = 0      # number of messages taken from first chunk
+        self._off    = 0      # number of bytes    taken from first chunk
+        self._msgs   = 0      # number of buffered messages
+        self._bytes  = 0      # number of buffered payload bytes
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __len__(self):
+        return self._msgs
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    @property
+    def nchunks(self):
+        return len(self._chunks)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def put(self, chunk):
+        '''
+        append a chunk to the backlog, return the number of messages it holds
+        '''
+
+        n = len(chunk[0][0])
+
+        self._chunks.append(chunk)
+        self._msgs  += n
+        self._bytes += chunk_size(chunk)
+
+        return n
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get(self, size, max_bytes=0):
+        '''
+        Remove up to `size` messages from the front of the backlog and return
+        them as list of chunks.  If `max_bytes` is given, the returned messages
+        will not exceed that many bytes (but at least one message is returned
+        if the backlog is not empty).  The first chunk is split if needed.
+        '''
+
+        chunks = list()
+        n      = 0
+        nbytes = 0
+
+        while self._chunks and n < size:
+
+            chunk = self._chunks[0]
+            hdr   = chunk[0]
+            lens  = hdr[0]
+            avail = len(lens) - self._idx
+            room  = max_bytes - nbytes
+
+            if not self._idx and avail <= size - n:
+
+                csize = chunk_size(chunk)
+                if not max_bytes or csize <= room or (hdr[2] and not n):
+                    # take the complete chunk
+                    self._chunks.popleft()
+                    chunks.append(chunk)
+                    self._msgs  -= avail
+                    self._bytes -= csize
+                    n           += avail
+                    nbytes      += csize
+                    continue
+
+            if hdr[2]:
+                # large message which does not fit into this bulk anymore
+                break
+
+            # take (the rest of) an inline chunk, as a new chunk referring to
+            # the respective slice of the payload
+            k    = min(avail, size - n)
+            sub  = lens[self._idx:self._idx + k]
+
+            if max_bytes:
+                acc = list(itertools.accumulate(sub))
+                k   = bisect.bisect_right(acc, room)
+                if not k:
+                    if n:
+                        break
+                    k = 1
+                sub = sub[:k]
+                nb  = acc[k - 1]
+            else:
+                nb  = sum(sub)
+
+            data = memoryview(chunk[1])[self._off:self._off + nb]
+
+            chunks.append([[sub] + hdr[1:], data, None] + chunk[3:])
+
+            self._idx   += k
+            self._off   += nb
+            self._msgs  -= k
+            self._bytes -= nb
+            n           += k
+            nbytes      += nb
+
+            if self._idx == len(lens):
+                self._chunks.popleft()
+                self._idx = 0
+                self._off = 0
+
+        return chunks
+
+
+    # --------------------------------------------------------------------------
+    #
+    def unget(self, chunks):
+        '''
+        return chunks obtained by `get()` to the front of the backlog
+        '''
+
+        if not chunks:
+            return
+
+        if self._idx:
+            # the first chunk was partially consumed - replace it by its rest
+            chunk = self._chunks.popleft()
+            hdr   = chunk[0]
+            rest  = [[hdr[0][self._idx:]] + hdr[1:],
+                     memoryview(chunk[1])[self._off:], None] + chunk[3:]
+            self._chunks.appendleft(rest)
+            self._idx = 0
+            self._off = 0
+
+        for chunk in reversed(chunks):
+            self._chunks.appendleft(chunk)
+            self._msgs  += len(chunk[0][0])
+            self._bytes += chunk_size(chunk)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def ack(self):
+        '''
+        confirm the delivery of all messages obtained by `get()` so far
+        '''
+
+        pass
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+
+        pass
+
+
+# ------------------------------------------------------------------------------
+#
+# A `DurableBacklog` appends all incoming chunks to a write-ahead log on disk.
+# The log is split into segment files `<seq>.wal` of about `segment_bytes`
+# each, where `seq` is the sequence number of the first record in the segment.
+# Each record holds one chunk, and is written as:
+#
+#   - a `_RECORD` header: number of frames, messages and payload bytes
+#   - the size of each frame (`_FRAME`)
+#   - the frames of the chunk (as created by `join_chunks()`)
+#
+# The position of the first message which was not yet delivered (record
+# sequence number and message index in that record) is kept in the file `ack`.
+# Segments which only hold delivered messages are removed.  A backlog which is
+# created on an existing log replays all messages from that position on.  A
+# record which was only partially written (the bridge died while writing it) is
+# discarded.
+#
+# Only the first `spill_bytes` of the backlog are held in memory, all further
+# messages are only on disk and are loaded as the backlog drains.
+#
+# Records are written without buffering in the process, so that a crashed
+# bridge loses no messages.  With `sync=True`, writes are also synced to disk,
+# so that messages survive a system crash (at a significant performance cost).
+#
+_RECORD        = struct.Struct('<III')
+_FRAME         = struct.Struct('<Q')
+_ACK           = struct.Struct('<QQ')
+_SEGMENT_BYTES = 64 * 1024 * 1024
+_SPILL_BYTES   = 64 * 1024 * 1024
+
+
+class DurableBacklog(Backlog):
+    '''
+    Backlog which is backed by a write-ahead log in the directory `path` (see
+    above).
+    '''
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, path, spill_bytes=None, segment_bytes=None, sync=False):
+
+        super(DurableBacklog, self).__init__()
+
+        self._path     = path
+        self._spill    = spill_bytes   or _SPILL_BYTES
+        self._seg_size = segment_bytes or _SEGMENT_BYTES
+        self._sync     = sync
+
+        self._all_msgs  = 0         # messages in memory and on disk
+        self._all_bytes = 0         # bytes    in memory and on disk
+        self._rfile     = None      # segment we load records from
+        self._rfseq     = None      # next record in that file
+
+        os.makedirs(self._path, exist_ok=True)
+
+        self._ack_fd = os.open(os.path.join(self._path, 'ack'),
+                               os.O_RDWR | os.O_CREAT)
+        data = os.pread(self._ack_fd, _ACK.size, 0)
+
+        if len(data) == _ACK.size: self._aseq, self._aidx = _ACK.unpack(data)
+        else                     : self._aseq, self._aidx = 0, 0
+
+        self._segments = sorted([int(fname[:-4])
+                                 for fname in os.listdir(self._path)
+                                 if  fname.endswith('.wal')])
+
+        # remove delivered segments, count the remaining records
+        while len(self._segments) > 1 and self._segments[1] <= self._aseq:
+            os.unlink(self._segment(self._segments.pop(0)))
+
+        self._wseq = self._aseq
+        for start in self._segments:
+            self._wseq = self._scan(start)
+
+        if self._segments: start = self._segments[-1]
+        else             : start = self._wseq
+
+        self._open_segment(start)
+
+        # load the first records (which may have been partially delivered)
+        self._rseq = self._aseq
+        self._load()
+
+        n, size = self._skip(self._aidx)
+        self._all_msgs  -= n
+        self._all_bytes -= size
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __len__(self):
+        return self._all_msgs
+
+    @property
+    def nbytes(self):
+        return self._all_bytes
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _segment(self, start):
+
+        return os.path.join(self._path, '%016d.wal' % start)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _scan(self, start):
+        '''
+        Count the records in the segment starting at sequence number `start`,
+        and the messages and bytes in records not yet delivered.  A trailing
+        partial record is truncated.  Return the sequence number after the
+        last record.
+        '''
+
+        seq = start
+        off = 0
+
+        with open(self._segment(start), 'rb+') as fin:
+
+            while True:
+
+                hdr = fin.read(_RECORD.size)
+                if len(hdr) < _RECORD.size:
+                    break
+
+                n_frames, n_msgs, n_bytes = _RECORD.unpack(hdr)
+                sizes = fin.read(_FRAME.size * n_frames)
+                if len(sizes) < _FRAME.size * n_frames:
+                    break
+
+                end = fin.seek(sum(struct.unpack('<%dQ' % n_frames, sizes)),
+                               os.SEEK_CUR)
+                if end > os.fstat(fin.fileno()).st_size:
+                    break
+
+                if seq >= self._aseq:
+                    self._all_msgs  += n_msgs
+                    self._all_bytes += n_bytes
+
+                seq += 1
+                off  = end
+
+            fin.truncate(off)
+
+        return seq
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _open_segment(self, start):
+
+        if start not in self._segments:
+            self._segments.append(start)
+
+        self._wfd   = os.open(self._segment(start),
+                              os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        self._wsize = os.fstat(self._wfd).st_size
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _seek(self, seq):
+        '''
+        position the reader before the record `seq`
+        '''
+
+        start = max([s for s in self._segments if s <= seq])
+
+        if self._rfile:
+            self._rfile.close()
+
+        self._rfile = open(self._segment(start), 'rb')
+        self._rfseq = seq
+
+        for _ in range(seq - start):
+            n_frames = _RECORD.unpack(self._rfile.read(_RECORD.size))[0]
+            sizes    = self._rfile.read(_FRAME.size * n_frames)
+            self._rfile.seek(sum(struct.unpack('<%dQ' % n_frames, sizes)),
+                             os.SEEK_CUR)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _read(self):
+        '''
+        read the record `self._rseq` and return it as chunk
+        '''
+
+        # records kept in memory on `put()` are not read, so the reader may
+        # lag behind
+        if self._rfseq != self._rseq:
+            self._seek(self._rseq)
+
+        hdr = self._rfile.read(_RECORD.size)
+
+        if not hdr:
+            # end of segment - continue with the next one
+            self._seek(self._rseq)
+            hdr = self._rfile.read(_RECORD.size)
+
+        self._rfseq += 1
+
+        n_frames = _RECORD.unpack(hdr)[0]
+        sizes    = struct.unpack('<%dQ' % n_frames,
+                                 self._rfile.read(_FRAME.size * n_frames))
+        frames   = [self._rfile.read(size) for size in sizes]
+
+        return split_chunks(frames)[0]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _load(self):
+        '''
+        load records from disk until the in-memory part of the backlog reaches
+        `spill_bytes`
+        '''
+
+        while self._rseq < self._wseq:
+
+            if self._chunks and self._bytes >= self._spill:
+                break
+
+            Backlog.put(self, self._read())
+            self._rseq += 1
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _skip(self, n):
+        '''
+        skip the first `n` messages of the first chunk in memory, return the
+        number of skipped messages and bytes
+        '''
+
+        if not n or not self._chunks:
+            return 0, 0
+
+        size = sum(self._chunks[0][0][0][:n])
+
+        self._idx    = n
+        self._off    = size
+        self._msgs  -= n
+        self._bytes -= size
+
+        return n, size
+
+
+    # --------------------------------------------------------------------------
+    #
+    def put(self, chunk):
+
+        frames = chunk[2] or join_chunks([chunk])
+        n      = len(chunk[0][0])
+        size   = chunk_size(chunk)
+        sizes  = [len(frame) for frame in frames]
+        hdr    = _RECORD.pack(len(frames), n, size) \
+               + struct.pack('<%dQ' % len(frames), *sizes)
+
+        if self._wsize >= self._seg_size:
+            os.close(self._wfd)
+            self._open_segment(self._wseq)
+
+        written = os.writev(self._wfd, [hdr] + frames)
+        if written != len(hdr) + sum(sizes):
+            raise RuntimeError('incomplete write to %s' % self._path)
+
+        if self._sync:
+            os.fsync(self._wfd)
+
+        self._wsize     += written
+        self._all_msgs  += n
+        self._all_bytes += size
+
+        # keep the chunk in memory unless we are spilling to disk already
+        if self._rseq == self._wseq and \
+           (not self._chunks or self._bytes < self._spill):
+            Backlog.put(self, chunk)
+            self._rseq += 1
+
+        self._wseq += 1
+
+        return n
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get(self, size, max_bytes=0):
+
+        chunks = list()
+        n      = 0
+        nbytes = 0
+
+        while n < size:
+
+            if max_bytes and nbytes >= max_bytes:
+                break
+
+            self._load()
+
+            if max_bytes: more = Backlog.get(self, size - n, max_bytes - nbytes)
+            else        : more = Backlog.get(self, size - n)
+
+            if not more:
+                break
+
+            chunks += more
+            n      += sum([len(chunk[0][0]) for chunk in more])
+            nbytes += sum([chunk_size(chunk) for chunk in more])
+
+            if self._chunks:
+                # the bulk is complete - we only continue if we ran out of
+                # messages in memory (in which case the byte limit can be
+                # exceeded by one message)
+                break
+
+        self._all_msgs  -= n
+        self._all_bytes -= nbytes
+
+        return chunks
+
+
+    # --------------------------------------------------------------------------
+    #
+    def unget(self, chunks):
+        '''
+        Chunks which are returned were not delivered: reload the backlog from
+        the last delivered message on.
+        '''
+
+        if not chunks:
+            return
+
+        self._all_msgs  += sum([len(chunk[0][0]) for chunk in chunks])
+        self._all_bytes += sum([chunk_size(chunk) for chunk in chunks])
+
+        self._chunks.clear()
+        self._idx   = 0
+        self._off   = 0
+        self._msgs  = 0
+        self._bytes = 0
+
+        self._rseq = self._aseq
+        self._load()
+        self._skip(self._aidx)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def ack(self):
+
+        if self._chunks: pos = [self._rseq - len(self._chunks), self._idx]
+        else           : pos = [self._rseq, 0]
+
+        if pos == [self._aseq, self._aidx]:
+            return
+
+        self._aseq, self._aidx = pos
+
+        os.pwrite(self._ack_fd, _ACK.pack(self._aseq, self._aidx), 0)
+        if self._sync:
+            os.fsync(self._ack_fd)
+
+        # remove delivered segments
+        while len(self._segments) > 1 and self._segments[1] <= self._aseq:
+            os.unlink(self._segment(self._segments.pop(0)))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+
+        if self._rfile:
+            self._rfile.close()
+            self._rfile = None
+
+        os.close(self._wfd)
+        os.close(self._ack_fd)
+
+
+# ------------------------------------------------------------------------------
+#
+# A `Lanes` backlog holds one backlog per message priority (*lane*), and serves
+# bulks from the lane with the highest priority.  Lanes are created when the
+# first chunk of that priority arrives, by calling `factory(priority)`.  With
+# `max_skip`, a non-empty lane which was passed over `max_skip` times in a row
+# is served next, so that lower lanes are not starved by a steady stream of
+# higher priority messages.
+#
+class Lanes(object):
+    '''
+    Backlog of backlogs, one per priority (see above).  `Lanes` implements the
+    `Backlog` interface.  Each bulk returned by `get()` is taken from a single
+    lane.
+    '''
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, factory, max_skip=0, priorities=None):
+
+        self._factory  = factory
+        self._max_skip = max_skip
+        self._lanes    = dict()       # priority: backlog
+        self._skipped  = dict()       # priority: number of times passed over
+        self._prios    = list()       # priorities, highest first
+        self._last     = 0            # lane of the last `get()`
+
+        for prio in [0] + list(priorities or []):
+            self._lane(prio)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __len__(self):
+        return sum([len(lane) for lane in self._lanes.values()])
+
+    @property
+    def nbytes(self):
+        return sum([lane.nbytes for lane in self._lanes.values()])
+
+    @property
+    def lanes(self):
+        return {prio: len(lane) for prio, lane in self._lanes.items()}
+
+    def usage(self, prio):
+        '''
+        return the number of messages and bytes in the lanes with a priority
+        higher than `prio`
+        '''
+
+        lanes = [lane for p, lane in self._lanes.items() if p > prio]
+
+        return [sum([len(lane)    for lane in lanes]),
+                sum([lane.nbytes  for lane in lanes])]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _lane(self, prio):
+
+        if prio not in self._lanes:
+            self._lanes[prio]   = self._factory(prio)
+            self._skipped[prio] = 0
+            self._prios = sorted(self._lanes, reverse=True)
+
+        return self._lanes[prio]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def put(self, chunk):
+
+        return self._lane(chunk_priority(chunk[0])).put(chunk)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get(self, size, max_bytes=0):
+
+        ready = [prio for prio in self._prios if len(self._lanes[prio])]
+
+        if not ready:
+            return list()
+
+        prio = ready[0]
+
+        if self._max_skip:
+            # serve the lowest starving lane, if any
+            for p in reversed(ready):
+                if self._skipped[p] >= self._max_skip:
+                    prio = p
+                    break
+
+        for p in ready:
+            self._skipped[p] += 1
+        self._skipped[prio] = 0
+
+        self._last = prio
+        return self._lanes[prio].get(size, max_bytes)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def unget(self, chunks):
+
+        self._lanes[self._last].unget(chunks)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def ack(self):
+
+        self._lanes[self._last].ack()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+
+        for lane in self._lanes.values():
+            lane.close()
+
+
+# ------------------------------------------------------------------------------
@@ -5,6 +5,9 @@ import threading as mt
 from ..logger    import Logger
 from ..profile   import Profiler
 
+from .stats      import BridgeStats
+from .transport  import unbind_local
+
 
 # ------------------------------------------------------------------------------
 #
@@ -13,6 +16,9 @@ class Bridge(object):
 
     A bridge can be configured to have a finite lifetime: when no messages are
     received in `timeout` seconds, the bridge process will terminate.
+
+    All bridges count the messages they forward, and can report those counters
+    periodically (see `stats.py` and the `stats` property).
     '''
 
     # --------------------------------------------------------------------------
@@ -25,6 +31,7 @@ class Bridge(object):
         self._log     = Logger(name=self._uid, ns='radical.utils',
                                level='DEBUG', path=self._cfg.path)
         self._prof    = Profiler(name=self._uid, path=self._cfg.path)
+        self._stats   = BridgeStats(self._uid, self._cfg, self._log)
 
         if 'hb' in self._uid or 'heartbeat' in self._uid:
             self._prof.disable()
@@ -44,6 +51,18 @@ class Bridge(object):
         return self._channel
 
 
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def stats(self):
+        '''
+        Return a snapshot of the bridge counters: messages and bytes received
+        and sent (and their rates since the last report), the backlog depth,
+        the number of consumers, and a histogram of the forwarding latency.
+        '''
+        return self._stats.as_dict()
+
+
     # --------------------------------------------------------------------------
     #
     def start(self):
@@ -72,12 +91,17 @@ class Bridge(object):
         #       components.
         from .pubsub import PubSub
         from .queue  import Queue
+        from .shard  import ShardedQueue
 
         _btypemap = {'pubsub' : PubSub,
                      'queue'  : Queue}
 
         kind = cfg['kind']
 
+        # queues with more than one shard are served by a sharded bridge
+        if kind == 'queue' and int(cfg.get('shards') or 1) > 1:
+            return ShardedQueue(cfg)
+
         if kind not in _btypemap:
             raise ValueError('unknown bridge type (%s)' % kind)
 
@@ -92,6 +116,7 @@ class Bridge(object):
     def stop(self, timeout=None):
 
         self._term.set()
+        unbind_local(self._uid)
       # self._bridge_thread.join(timeout=timeout)
         self._prof.prof('term', uid=self._uid)
 
@@ -0,0 +1,346 @@
+
+import zlib
+import pickle
+import msgpack
+
+import threading as mt
+
+from ..misc import as_list
+
+
+# ------------------------------------------------------------------------------
+#
+# Messages sent over zmq channels are serialized by a *codec*.  The codec is
+# selected per channel via the `codec` setting of the channel config (default:
+# `msgpack`), and its name is sent along with each chunk of messages (see
+# `utils.pack_bulk()`), so that the receiving end decodes messages with the
+# same codec the sending end used.
+#
+# Anybody who can connect to a channel can send chunks with any codec name.
+# Receiving ends thus only decode chunks of codecs which are safe for untrusted
+# data (`msgpack`, `zlib` and `raw`), and of the codecs enabled in their own
+# channel config, via the `codec` and `codecs` (a list of names) settings (see
+# `get_decoders()`).  Chunks of any other codec are rejected.  Specifically,
+# `pickle` (which can execute arbitrary code on decoding) needs to be enabled
+# on both ends of a channel.
+#
+# Codecs encode a single message into a list of buffers: the first buffer is the
+# main payload, any further buffers are out-of-band data which are sent as
+# separate zmq frames without copying (used for large binary data, like numpy
+# arrays).
+#
+# Additional codecs can be registered via `register_codec()`.
+#
+_DEFAULT_CODEC      = 'msgpack'
+_COMPRESS_THRESHOLD = 4 * 1024  # compress messages larger than this (bytes)
+_COMPRESS_LEVEL     = 1         # favor speed over compression ratio
+
+
+# ------------------------------------------------------------------------------
+#
+class Codec(object):
+    '''
+    Base class for all codecs.  A codec is instantiated with the channel config
+    (which can be empty), and must implement `encode()` and `decode()`.
+    Codecs which cannot execute code when decoding untrusted data can set
+    `safe`, so that receivers accept them without enabling them.
+    '''
+
+    name = None
+    safe = False
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, cfg=None):
+
+        self._cfg = cfg or dict()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def encode(self, msg):
+        '''
+        return a list of buffers which represent the message - see above.
+        '''
+
+        raise NotImplementedError('encode() not implemented for %s' % self.name)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def decode(self, data, bufs=None):
+        '''
+        reconstruct a message from the given main payload and out-of-band
+        buffers.
+        '''
+
+        raise NotImplementedError('decode() not implemented for %s' % self.name)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def decode_all(self, payload, lens):
+        '''
+        decode the concatenation of several encoded messages (without
+        out-of-band buffers) of the given sizes.  Codecs can overload this
+        method if they can decode message streams more efficiently.
+        '''
+
+        msgs = list()
+        view = memoryview(payload)
+        off  = 0
+
+        for size in lens:
+            msgs.append(self.decode(view[off:off + size]))
+            off += size
+
+        return msgs
+
+
+# ------------------------------------------------------------------------------
+#
+class MsgpackCodec(Codec):
+    '''
+    Default codec.  Packer and unpacker instances are reused (per thread), as
+    creating them dominates the cost of serializing small messages.
+
+    Messages are decoded with `raw=False`, i.e., strings are received as `str`
+    without any further traversal of the message.  By default, `bytes` are
+    encoded as msgpack strings and thus are also received as `str` (which is
+    what most of our components expect).  With the `strict` setting of the
+    channel config, `bytes` are received as `bytes`, and only exact `dict`,
+    `list`, `str` etc. types are accepted (tuples or subclasses like
+    `ru.Config` raise a `TypeError` on `put()`).
+    '''
+
+    name = 'msgpack'
+    safe = True
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, cfg=None):
+
+        super(MsgpackCodec, self).__init__(cfg)
+
+        self._strict = bool(self._cfg.get('strict'))
+        self._tls    = mt.local()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _packer(self):
+
+        packer = getattr(self._tls, 'packer', None)
+        if not packer:
+            packer = self._tls.packer = msgpack.Packer(
+                                                use_bin_type=self._strict,
+                                                strict_types=self._strict)
+        return packer
+
+
+    def _unpacker(self):
+
+        unpacker = getattr(self._tls, 'unpacker', None)
+        if not unpacker:
+            unpacker = self._tls.unpacker = msgpack.Unpacker(raw=False,
+                                                             max_buffer_size=0)
+        return unpacker
+
+
+    # --------------------------------------------------------------------------
+    #
+    def encode(self, msg):
+
+        return [self._packer().pack(msg)]
+
+
+    def decode(self, data, bufs=None):
+
+        return msgpack.unpackb(data, raw=False)
+
+
+    def decode_all(self, payload, lens):
+
+        if len(lens) == 1:
+            return [msgpack.unpackb(payload, raw=False)]
+
+        unpacker = self._unpacker()
+        unpacker.feed(payload)
+        return list(unpacker)
+
+
+# ------------------------------------------------------------------------------
+#
+class ZlibCodec(MsgpackCodec):
+    '''
+    msgpack codec which compresses messages larger than the `compress_threshold`
+    setting of the channel config.  A one byte prefix signals if a message is
+    compressed.
+    '''
+
+    name = 'zlib'
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, cfg=None):
+
+        super(ZlibCodec, self).__init__(cfg)
+
+        self._threshold = self._cfg.get('compress_threshold',
+                                        _COMPRESS_THRESHOLD)
+        self._level     = self._cfg.get('compress_level', _COMPRESS_LEVEL)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def encode(self, msg):
+
+        data = self._packer().pack(msg)
+
+        if len(data) > self._threshold:
+            return [b'\x01' + zlib.compress(data, self._level)]
+        else:
+            return [b'\x00' + data]
+
+
+    def decode(self, data, bufs=None):
+
+        view = memoryview(data)
+
+        if view[0]: data = zlib.decompress(view[1:])
+        else      : data = view[1:]
+
+        return msgpack.unpackb(data, raw=False)
+
+
+    def decode_all(self, payload, lens):
+
+        return Codec.decode_all(self, payload, lens)
+
+
+# ------------------------------------------------------------------------------
+#
+class PickleCodec(Codec):
+    '''
+    Pickle codec which supports arbitrary Python objects.  Where available
+    (Python 3.8+), pickle protocol 5 is used, and large binary buffers (like the
+    data of numpy arrays) are sent out-of-band, i.e., without copying them.
+    Receivers only decode pickled messages if they enable this codec (see
+    above).
+    '''
+
+    name = 'pickle'
+
+    # --------------------------------------------------------------------------
+    #
+    def encode(self, msg):
+
+        if pickle.HIGHEST_PROTOCOL < 5:
+            return [pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL)]
+
+        bufs = list()
+        data = pickle.dumps(msg, protocol=5, buffer_callback=bufs.append)
+
+        return [data] + [buf.raw() for buf in bufs]
+
+
+    def decode(self, data, bufs=None):
+
+        if bufs: return pickle.loads(data, buffers=bufs)
+        else   : return pickle.loads(data)
+
+
+# ------------------------------------------------------------------------------
+#
+class RawCodec(Codec):
+    '''
+    Pass-through codec for messages which are already serialized: messages
+    must be `bytes` (or support the buffer protocol), and are received as
+    `bytes`.
+    '''
+
+    name = 'raw'
+    safe = True
+
+    # --------------------------------------------------------------------------
+    #
+    def encode(self, msg):
+
+        if isinstance(msg, str):
+            raise TypeError('raw codec needs bytes, not str')
+
+        return [memoryview(msg)]
+
+
+    def decode(self, data, bufs=None):
+
+        return bytes(data)
+
+
+# ------------------------------------------------------------------------------
+#
+_codecs    = dict()   # name: codec class
+_instances = dict()   # name: codec instance with default config
+
+
+def register_codec(ctype):
+    '''
+    make a codec class available under its `name`.
+    '''
+
+    if not ctype.name:
+        raise ValueError('codec %s has no name' % ctype)
+
+    _codecs[ctype.name] = ctype
+    _instances.pop(ctype.name, None)
+
+
+def get_codec(name=None, cfg=None):
+    '''
+    Return a codec instance for the given name.  If a channel config is given,
+    the codec name is taken from its `codec` setting, and the codec is
+    configured by that config.  Codecs for decoding are looked up by name only,
+    as decoding does not depend on any settings.
+    '''
+
+    if cfg:
+        name = cfg.get('codec') or _DEFAULT_CODEC
+        if name not in _codecs:
+            raise ValueError('unknown codec %s' % name)
+        return _codecs[name](cfg)
+
+    if not name:
+        name = _DEFAULT_CODEC
+
+    if name not in _instances:
+        if name not in _codecs:
+            raise ValueError('unknown codec %s' % name)
+        _instances[name] = _codecs[name]()
+
+    return _instances[name]
+
+
+def get_decoders(cfg=None):
+    '''
+    Return the names of the codecs a receiving end decodes: all safe codecs,
+    and the codecs enabled by the `codec` and `codecs` settings of the given
+    channel config.
+    '''
+
+    names = set([name for name, ctype in _codecs.items() if ctype.safe])
+
+    if cfg:
+        for name in as_list(cfg.get('codec')) + as_list(cfg.get('codecs')):
+            if name not in _codecs:
+                raise ValueError('unknown codec %s' % name)
+            names.add(name)
+
+    return names
+
+
+for _ctype in [MsgpackCodec, ZlibCodec, PickleCodec, RawCodec]:
+    register_codec(_ctype)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,110 @@
+
+import os
+import zmq
+
+import threading as mt
+
+from ..atfork        import atfork
+from ..misc          import noop
+from ..lease_manager import LeaseManager
+
+from .transport      import select_url
+
+
+# ------------------------------------------------------------------------------
+#
+# All zmq endpoints and bridges of a process share one `zmq.Context`, and thus
+# one set of zmq I/O threads.  The number of I/O threads can be set via the
+# environment variable `RADICAL_ZMQ_IO_THREADS` (default: 1), which should be
+# increased for processes which move more than about a gigabyte per second
+# through zmq.  The context is recreated in a forked child, as zmq contexts
+# must not be used across `fork()`.
+#
+# Sending endpoints (`Putter`, `Publisher`) can also *lease* their sockets from
+# a process wide pool (see `LeaseManager`), so that endpoints which are created
+# repeatedly for the same URL reuse an already connected socket instead of
+# opening a new connection each time.  A leased socket is used by only one
+# endpoint at any time, and is returned to the pool when that endpoint is
+# closed.
+#
+_IO_THREADS = int(os.environ.get('RADICAL_ZMQ_IO_THREADS', 1))
+
+_lock = mt.Lock()
+_ctx  = None
+_pool = None
+
+
+# ------------------------------------------------------------------------------
+#
+def get_context():
+    '''
+    return the zmq context of this process
+    '''
+
+    global _ctx                                          # pylint: disable=W0603
+
+    if _ctx is None:
+        with _lock:
+            if _ctx is None:
+                _ctx = zmq.Context(io_threads=_IO_THREADS)
+
+    return _ctx
+
+
+# ------------------------------------------------------------------------------
+#
+def _create_socket(stype, url, linger, hwm):
+
+    sock        = get_context().socket(stype)
+    sock.linger = linger
+    sock.hwm    = hwm
+    sock.connect(select_url(url))
+
+    return sock
+
+
+def lease_socket(stype, url, linger, hwm):
+    '''
+    Lease a socket of the given type, connected to the given URL, from the
+    socket pool.  The socket is available as `lease.obj`, and the lease must be
+    returned via `release_socket(lease)`.
+    '''
+
+    global _pool                                         # pylint: disable=W0603
+
+    with _lock:
+        if _pool is None:
+            # unlimited pool size, and sockets never expire
+            _pool = LeaseManager(max_pool_size=0, max_obj_age=float('inf'))
+
+    pool_id = '%s %s %s %s' % (stype, url, linger, hwm)
+
+    return _pool.lease(pool_id, _create_socket, [stype, url, linger, hwm])
+
+
+def release_socket(lease):
+    '''
+    return a leased socket to the pool
+    '''
+
+    if _pool:
+        _pool.release(lease)
+
+
+# ------------------------------------------------------------------------------
+#
+def _atfork_child():
+
+    global _ctx, _pool, _lock                            # pylint: disable=W0603
+
+    # do not terminate the parent's context (that would hang), just forget it
+    _ctx  = None
+    _pool = None
+    _lock = mt.Lock()
+
+
+atfork(noop, noop, _atfork_child)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,441 @@
+
+import queue
+
+import threading          as mt
+import collections        as mc
+import concurrent.futures as cf
+
+
+# ------------------------------------------------------------------------------
+#
+# Callbacks registered with a `Getter` or `Subscriber` are invoked by an
+# *executor*, which is selected per callback on `subscribe()`:
+#
+#   - `inline` : the callback is called in the poller thread (default).  A slow
+#                callback delays all channels served by that poller.
+#   - `thread` : the callback is called by a pool of `threads` worker threads.
+#   - `process`: the callback is called by a pool of `procs` worker processes.
+#                Callbacks and messages must be picklable, and callback locks
+#                are not supported.
+#   - `conflate`: the callback is called by a worker thread.  While messages
+#                wait for that thread, a new message replaces the waiting
+#                message with the same `key` entry (default: `uid`) and topic,
+#                so that slow callbacks only see the latest message per key.
+#                Messages without that entry are never replaced.
+#
+# Pool executors buffer at most `max_depth` messages per worker.  When those
+# buffers are full, the poller blocks, i.e., the channel stops consuming
+# messages until the workers catch up.
+#
+# Pool executors do not preserve message order, unless `order_by` is set: all
+# messages with the same key are then handled by the same worker, in the order
+# they were received.  The key is the message topic if `order_by` is `topic`
+# (for subscribers), and otherwise the `order_by` entry of the message (e.g.,
+# `uid`).
+#
+# All executors count the messages they are handling (`depth`), the largest
+# depth seen (`peak`), and the number of completed callback invocations
+# (`calls`) - see `Executor.stats`.  The conflating executor also counts the
+# messages it replaced (`conflated`).
+#
+# Executors are specified as an `Executor` instance, as one of the names above,
+# or as a dict with a `kind` entry (the name) and further settings, e.g.,
+# `{'kind': 'thread', 'threads': 8, 'order_by': 'uid'}`.
+#
+_THREADS   =    4   # number of worker threads
+_PROCS     =    4   # number of worker processes
+_MAX_DEPTH = 1024   # number of messages to buffer per worker
+
+
+# ------------------------------------------------------------------------------
+#
+class Executor(object):
+    '''
+    Base class for all executors.  Executors are instantiated with their
+    settings (which can be empty), and a logger to report callback failures.
+    '''
+
+    name          = None
+    support_locks = True
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, cfg=None, log=None):
+
+        self._cfg    = cfg or dict()
+        self._log    = log
+        self._lock   = mt.Lock()
+        self._depth  = 0
+        self._peak   = 0
+        self._calls  = 0
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def stats(self):
+
+        return {'depth': self._depth,
+                'peak' : self._peak,
+                'calls': self._calls}
+
+
+    # --------------------------------------------------------------------------
+    #
+    def submit(self, cb, args, lock=None):
+        '''
+        invoke `cb(*args)`, shielded by `lock` (if given)
+        '''
+
+        raise NotImplementedError('submit() not implemented for %s' % self.name)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self):
+
+        pass
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _enter(self):
+
+        with self._lock:
+            self._depth += 1
+            if self._depth > self._peak:
+                self._peak = self._depth
+
+
+    def _leave(self):
+
+        with self._lock:
+            self._depth -= 1
+            self._calls += 1
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _key(self, args):
+
+        order_by = self._cfg.get('order_by')
+
+        if order_by == 'topic' and len(args) > 1:
+            return args[0]
+
+        if isinstance(args[-1], dict):
+            return args[-1].get(order_by)
+
+
+# ------------------------------------------------------------------------------
+#
+def _call(cb, args, lock):
+
+    if lock:
+        with lock:
+            cb(*args)
+    else:
+        cb(*args)
+
+
+# ------------------------------------------------------------------------------
+#
+class InlineExecutor(Executor):
+    '''
+    Call callbacks in the calling thread.  Exceptions are raised to the caller.
+    '''
+
+    name = 'inline'
+
+    def submit(self, cb, args, lock=None):
+
+        # only called from the poller thread: no need to lock the counters
+        self._depth  = 1
+        self._peak   = 1
+        _call(cb, args, lock)
+        self._depth  = 0
+        self._calls += 1
+
+
+# ------------------------------------------------------------------------------
+#
+class ThreadExecutor(Executor):
+    '''
+    Call callbacks in a pool of worker threads.  Exceptions are logged.
+    '''
+
+    name = 'thread'
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, cfg=None, log=None):
+
+        super(ThreadExecutor, self).__init__(cfg, log)
+
+        n_threads  = self._cfg.get('threads')   or _THREADS
+        max_depth  = self._cfg.get('max_depth') or _MAX_DEPTH
+
+        self._idx     = 0
+        self._queues  = list()
+        self._threads = list()
+
+        for _ in range(n_threads):
+            q = queue.Queue(maxsize=max_depth)
+            t = mt.Thread(target=self._work, args=[q])
+            t.daemon = True
+            t.start()
+            self._queues.append(q)
+            self._threads.append(t)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def submit(self, cb, args, lock=None):
+
+        if self._cfg.get('order_by'):
+            idx = hash(self._key(args)) % len(self._queues)
+        else:
+            idx = self._idx = (self._idx + 1) % len(self._queues)
+
+        self._enter()
+        self._queues[idx].put([cb, args, lock])
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _work(self, q):
+
+        while True:
+
+            item = q.get()
+            if item is None:
+                break
+
+            cb, args, lock = item
+
+            try:
+                _call(cb, args, lock)
+
+            except Exception:
+                self._log.exception('callback %s failed', cb)
+
+            finally:
+                self._leave()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self):
+
+        # workers terminate once they handled all pending messages
+        for q in self._queues:
+            q.put(None)
+
+
+# ------------------------------------------------------------------------------
+#
+class ProcessExecutor(Executor):
+    '''
+    Call callbacks in a pool of worker processes.  Exceptions are logged.
+    Each worker is a single process pool, so that messages submitted to the
+    same worker are handled in order.
+    '''
+
+    name          = 'process'
+    support_locks = False
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, cfg=None, log=None):
+
+        super(ProcessExecutor, self).__init__(cfg, log)
+
+        n_procs    = self._cfg.get('procs')     or _PROCS
+        max_depth  = self._cfg.get('max_depth') or _MAX_DEPTH
+
+        self._idx   = 0
+        self._pools = [cf.ProcessPoolExecutor(max_workers=1)
+                                                    for _ in range(n_procs)]
+        self._slots = mt.BoundedSemaphore(max_depth * n_procs)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def submit(self, cb, args, lock=None):
+
+        if lock:
+            raise ValueError('process executor does not support locks')
+
+        if self._cfg.get('order_by'):
+            idx = hash(self._key(args)) % len(self._pools)
+        else:
+            idx = self._idx = (self._idx + 1) % len(self._pools)
+
+        self._slots.acquire()
+        self._enter()
+
+        future = self._pools[idx].submit(cb, *args)
+        future.add_done_callback(lambda f: self._done(cb, f))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _done(self, cb, future):
+
+        self._leave()
+        self._slots.release()
+
+        if future.exception():
+            self._log.error('callback %s failed: %s', cb, future.exception())
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self):
+
+        for pool in self._pools:
+            pool.shutdown(wait=False)
+
+
+# ------------------------------------------------------------------------------
+#
+class ConflatingExecutor(Executor):
+    '''
+    Call callbacks in a worker thread, and replace messages which wait for
+    that thread by newer messages with the same key (see above).  The number
+    of waiting messages is thus bounded by the number of keys, and the caller
+    never blocks.  Exceptions are logged.
+    '''
+
+    name = 'conflate'
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, cfg=None, log=None):
+
+        super(ConflatingExecutor, self).__init__(cfg, log)
+
+        self._by        = self._cfg.get('key') or 'uid'
+        self._cond      = mt.Condition()
+        self._pending   = mc.OrderedDict()    # key: [cb, args, lock]
+        self._seq       = 0                   # key for messages without key
+        self._conflated = 0
+        self._term      = False
+
+        self._thread = mt.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def stats(self):
+
+        stats = super(ConflatingExecutor, self).stats
+        stats['conflated'] = self._conflated
+
+        return stats
+
+
+    # --------------------------------------------------------------------------
+    #
+    def submit(self, cb, args, lock=None):
+
+        msg   = args[-1]
+        topic = args[0] if len(args) > 1 else None
+        key   = msg.get(self._by) if isinstance(msg, dict) else None
+
+        with self._cond:
+
+            if key is None:
+                # never replaced
+                self._seq += 1
+                key = self._seq
+
+            else:
+                try:
+                    hash(key)
+                except TypeError:
+                    key = str(key)
+                key = (id(cb), topic, key)
+
+            if key in self._pending:
+                # replace the waiting message, but keep its place in line
+                self._conflated += 1
+            else:
+                self._enter()
+
+            self._pending[key] = [cb, args, lock]
+            self._cond.notify()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _work(self):
+
+        while True:
+
+            with self._cond:
+
+                while not self._pending and not self._term:
+                    self._cond.wait()
+
+                if not self._pending:
+                    break
+
+                _, [cb, args, lock] = self._pending.popitem(last=False)
+
+            try:
+                _call(cb, args, lock)
+
+            except Exception:
+                self._log.exception('callback %s failed', cb)
+
+            finally:
+                self._leave()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self):
+
+        # the worker terminates once it handled all pending messages
+        with self._cond:
+            self._term = True
+            self._cond.notify()
+
+
+# ------------------------------------------------------------------------------
+#
+_executors = {InlineExecutor    .name: InlineExecutor,
+              ThreadExecutor    .name: ThreadExecutor,
+              ProcessExecutor   .name: ProcessExecutor,
+              ConflatingExecutor.name: ConflatingExecutor}
+
+
+def get_executor(spec, log):
+    '''
+    Return an executor instance for the given specification (see above), and
+    a flag which is `True` if the executor was created for this call (and
+    should thus be stopped by the caller once it is not needed anymore).
+    '''
+
+    if isinstance(spec, Executor):
+        return spec, False
+
+    if not spec:
+        spec = {'kind': InlineExecutor.name}
+
+    elif not isinstance(spec, dict):
+        spec = {'kind': spec}
+
+    kind = spec.get('kind')
+    if kind not in _executors:
+        raise ValueError('unknown executor %s' % kind)
+
+    return _executors[kind](spec, log), True
+
+
+# ------------------------------------------------------------------------------
+
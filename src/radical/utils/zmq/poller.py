@@ -0,0 +1,170 @@
+
+import os
+import zmq
+
+import threading as mt
+
+from ..atfork  import atfork
+from ..misc    import noop
+
+from .utils    import no_intr
+
+
+# ------------------------------------------------------------------------------
+#
+# Getters and Subscribers with callbacks do not run a listener thread per
+# endpoint.  Instead, their sockets are registered with a `Poller`: a thread
+# which watches any number of sockets in a single blocking poll, and calls the
+# socket's handler whenever the socket has incoming messages.  By default, one
+# poller thread serves all endpoints of a process.  The environment variable
+# `RADICAL_ZMQ_POLLERS` can specify a larger number of poller threads, and
+# sockets are then distributed round-robin over those threads.
+#
+# Handlers are called in the poller thread, and they should thus return
+# quickly: a slow handler delays all other sockets served by that thread.
+#
+_N_POLLERS = int(os.environ.get('RADICAL_ZMQ_POLLERS', 1))
+
+
+# ------------------------------------------------------------------------------
+#
+class Poller(object):
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, name='zmq.poller'):
+
+        self._lock     = mt.Lock()
+        self._handlers = dict()      # socket: [handler, log]
+        self._synced   = list()      # events to set on the next sync
+
+        # the poller thread is woken up via this pipe when registrations change
+        self._rpipe, self._wpipe = os.pipe()
+
+        self._thread = mt.Thread(target=self._work, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def register(self, socket, handler, log):
+        '''
+        Call `handler()` whenever `socket` has incoming messages.  Exceptions
+        raised by the handler are logged to `log`, and the socket is then
+        unregistered.
+        '''
+
+        with self._lock:
+            self._handlers[socket] = [handler, log]
+            os.write(self._wpipe, b'x')
+
+
+    # --------------------------------------------------------------------------
+    #
+    def unregister(self, socket):
+        '''
+        Stop watching `socket`.  When called from a thread other than the poller
+        thread, this waits until the poller picked up the change, so that the
+        socket's handler is not called anymore once this method returns.
+        '''
+
+        synced = mt.Event()
+
+        with self._lock:
+            if socket not in self._handlers:
+                return
+            del(self._handlers[socket])
+            self._synced.append(synced)
+            os.write(self._wpipe, b'x')
+
+        if mt.current_thread() != self._thread:
+            synced.wait()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _work(self):
+
+        poller = zmq.Poller()
+        poller.register(self._rpipe, zmq.POLLIN)
+
+        active = dict()
+
+        while True:
+
+            events = dict(no_intr(poller.poll))
+
+            if self._rpipe in events:
+
+                # registrations changed - update the poller
+                os.read(self._rpipe, 4096)
+
+                with self._lock:
+                    handlers = dict(self._handlers)
+                    synced   = self._synced
+                    self._synced = list()
+
+                for socket in active:
+                    if socket not in handlers:
+                        poller.unregister(socket)
+
+                for socket in handlers:
+                    if socket not in active:
+                        poller.register(socket, zmq.POLLIN)
+
+                active = handlers
+
+                for event in synced:
+                    event.set()
+
+            for socket in events:
+
+                if socket not in active:
+                    continue
+
+                handler, log = active[socket]
+
+                try:
+                    handler()
+
+                except Exception:
+                    log.exception('handler failed - unregister socket')
+                    self.unregister(socket)
+
+
+# ------------------------------------------------------------------------------
+#
+_pollers = list()
+_lock    = mt.Lock()
+_idx     = 0
+
+
+def get_poller():
+    '''
+    return the next poller thread for this process (see above)
+    '''
+
+    global _idx                                          # pylint: disable=W0603
+
+    with _lock:
+
+        if not _pollers:
+            for i in range(max(1, _N_POLLERS)):
+                _pollers.append(Poller(name='zmq.poller.%d' % i))
+
+        _idx = (_idx + 1) % len(_pollers)
+        return _pollers[_idx]
+
+
+def _atfork_child():
+
+    # poller threads do not survive a fork
+    del(_pollers[:])
+
+
+atfork(noop, noop, _atfork_child)
+
+
+# ------------------------------------------------------------------------------
+
@@ -1,8 +1,10 @@
 
 import zmq
+import time
 import msgpack
 
-import threading as mt
+import threading   as mt
+import collections as mc
 
 from ..atfork  import atfork
 from ..config  import Config
@@ -13,7 +15,15 @@ from ..logger  import Logger
 from ..profile import Profiler
 
 from .bridge   import Bridge
-from .utils    import no_intr, log_bulk
+from .backlog  import chunk_size
+from .codec    import get_codec, get_decoders
+from .context  import get_context, lease_socket, release_socket
+from .transport import bind_local, local_query, select_url, split_url
+from .executor import get_executor
+from .poller   import get_poller
+from .utils    import no_intr, log_bulk, send_frames, recv_frames
+from .utils    import pack_bulk, unpack_bulk, split_chunks, join_chunks
+from .utils    import pack_encoded, chunk_header, chunk_bulk
 
 
 # ------------------------------------------------------------------------------
@@ -21,6 +31,11 @@ from .utils    import no_intr, log_bulk
 _LINGER_TIMEOUT  =   250  # ms to linger after close
 _HIGH_WATER_MARK =     0  # number of messages to buffer before dropping
                           # 0:  infinite
+_CACHE_MSGS      = 10000  # number of messages in the last-value cache
+_CACHE_BYTES     =    64  # MB in the last-value cache
+_SNAP_TIMEOUT    =  3000  # ms to wait for a cache snapshot
+
+_SNAP_QUERY = 'snap'      # sub address query key for the snapshot port
 
 
 # ------------------------------------------------------------------------------
@@ -32,12 +47,207 @@ def _atfork_child():
 atfork(noop, noop, _atfork_child)
 
 
+# ------------------------------------------------------------------------------
+#
+def _unpack(frames, codecs):
+    '''
+    A publication is sent as the message topic, followed by a space, followed
+    by the messages encoded by `utils.pack_bulk()`.  Split the topic off and
+    decode the messages with one of the given `codecs`.  The messages of a bulk
+    publication (see `Publisher.put_bulk()`) are returned as list (even if it
+    holds a single message), any other message is returned as is.
+    '''
+
+    topic, data = frames[0].bytes.split(b' ', 1)
+    msgs        = unpack_bulk([data] + frames[1:], codecs=codecs)
+
+    if len(msgs) == 1 and not chunk_bulk(chunk_header(data)):
+        msgs = msgs[0]
+
+    return [topic.decode(), msgs]
+
+
+# ------------------------------------------------------------------------------
+#
+def _snapshot(url, topic, log):
+    '''
+    Request the cached messages of all topics starting with `topic` from the
+    snapshot socket at `url`, and return them as list of publications (lists
+    of frames).  The reply holds the number of frames of each publication,
+    followed by the frames of all publications.
+    '''
+
+    sock        = get_context().socket(zmq.REQ)
+    sock.linger = 0
+
+    try:
+        sock.connect(select_url(url))
+        no_intr(sock.send, as_bytes(topic))
+
+        if not no_intr(sock.poll, flags=zmq.POLLIN, timeout=_SNAP_TIMEOUT):
+            log.warn('no cache snapshot from %s', url)
+            return list()
+
+        frames = no_intr(recv_frames, sock)
+
+    finally:
+        sock.close()
+
+    return _split_snapshot(frames)
+
+
+def _split_snapshot(frames):
+
+    pubs = list()
+    idx  = 1
+    for size in msgpack.unpackb(frames[0].bytes):
+        pubs.append(frames[idx:idx + size])
+        idx += size
+
+    return pubs
+
+
+# ------------------------------------------------------------------------------
+#
+class _LastValueCache(object):
+    '''
+    Keep the last message published for each topic and message key (the
+    `key` entry of the message, e.g., its `uid`).  Messages are kept encoded,
+    as chunks (see `utils.split_chunks()`).  The cache holds at most `max_msgs`
+    messages and `max_bytes` bytes, and evicts the least recently updated
+    messages first.  Messages are decoded to find their key, so only messages
+    of the given `codecs` are cached.
+    '''
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, key, max_msgs, max_bytes, codecs):
+
+        self._key       = key
+        self._codecs    = codecs
+        self._max_msgs  = max_msgs
+        self._max_bytes = max_bytes
+        self._entries   = mc.OrderedDict()  # (topic, key): [topic, chunk, size]
+        self._bytes     = 0
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+
+    # --------------------------------------------------------------------------
+    #
+    def update(self, frames):
+        '''
+        add the messages of a publication (as received by the bridge)
+        '''
+
+        topic, data = frames[0].bytes.split(b' ', 1)
+
+        for hdr, payload, parts in split_chunks([data] + frames[1:]):
+
+            # other codecs are forwarded (and rejected by subscribers), but
+            # never decoded by the bridge
+            if hdr[1] not in self._codecs:
+                continue
+
+            codec = get_codec(hdr[1])
+
+            if hdr[2]:
+                msgs   = [codec.decode(payload, parts[2:])]
+                if chunk_bulk(hdr):
+                    # cached messages are replayed individually
+                    parts = pack_encoded([parts[1:]], hdr[1])
+                chunks = [[hdr[:3], payload, parts]]
+
+            else:
+                msgs   = codec.decode_all(payload, hdr[0])
+                chunks = list()
+                off    = 0
+                for size in hdr[0]:
+                    chunks.append([[[size]] + hdr[1:3],
+                                   bytes(payload[off:off + size]), None])
+                    off += size
+
+            for msg, chunk in zip(msgs, chunks):
+
+                mkey = msg.get(self._key) if isinstance(msg, dict) else None
+                try:
+                    hash(mkey)
+                except TypeError:
+                    mkey = str(mkey)
+
+                ckey = (topic, mkey)
+                if ckey in self._entries:
+                    self._bytes -= self._entries.pop(ckey)[2]
+
+                size = chunk_size(chunk)
+                self._entries[ckey] = [topic, chunk, size]
+                self._bytes += size
+
+        while len(self._entries) > self._max_msgs or \
+              self._bytes        > self._max_bytes:
+            self._bytes -= self._entries.popitem(last=False)[1][2]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def snapshot(self, prefix):
+        '''
+        return the cached messages of all topics which start with `prefix`, as
+        one publication (list of frames) per message
+        '''
+
+        pubs = list()
+        for topic, chunk, _ in self._entries.values():
+
+            if not topic.startswith(prefix):
+                continue
+
+            frames = join_chunks([chunk])
+            first  = frames[0]
+            if isinstance(first, zmq.Frame):
+                first = first.bytes
+            frames[0] = topic + b' ' + bytes(first)
+            pubs.append(frames)
+
+        return pubs
+
+
 # ------------------------------------------------------------------------------
 #
 # Notifications between components are based on pubsub channels.  Those channels
 # have different scope (bound to the channel name).  Only one specific topic is
 # predefined: 'state' will be used for unit state updates.
 #
+# With the config setting `cache`, the bridge keeps a *last-value cache*: the
+# last message published for each topic and message key (the message entry
+# named by `cache_key`, default `uid`), bounded by `cache_msgs` messages and
+# `cache_bytes` bytes (least recently updated messages are evicted first).
+# The cache is served on a separate snapshot socket (a ROUTER), whose port is
+# part of the sub address (`?snap=<port>`).  Whenever a subscriber subscribes
+# to a topic, it first subscribes to live messages, then requests the cached
+# messages of all matching topics from the snapshot socket (one publication
+# per message), and delivers them before any live message, so that late
+# subscribers start with the current state.  Other subscribers do not see that
+# snapshot.  Live messages published while the snapshot is taken can be
+# delivered after the snapshot even if the snapshot already holds them, but the
+# latest message per key is always delivered last.  The cache requires the
+# bridge to decode all published messages.
+#
+# By default, the bridge queues any number of messages for subscribers which
+# fall behind.  The config setting `hwm` limits that queue to `hwm` messages per
+# subscriber, and further messages for that subscriber are dropped.  Slow
+# subscribers should rather keep up by using a conflating executor for their
+# callbacks (see `executor.py`), which only delivers the latest message per key
+# (e.g., per `uid`).
+#
 class PubSub(Bridge):
 
     # --------------------------------------------------------------------------
@@ -99,6 +309,16 @@ class PubSub(Bridge):
     def addr_sub(self):
         return self._addr_sub
 
+    @property
+    def addrs_in(self):
+        # all addresses, including local transports
+        return self._addrs_pub
+
+    @property
+    def addrs_out(self):
+        # all addresses, including local transports
+        return self._addrs_sub
+
     def addr(self, spec):
         if spec.lower() == self.type_in : return self.addr_put
         if spec.lower() == self.type_out: return self.addr_get
@@ -113,7 +333,7 @@ class PubSub(Bridge):
         self._url        = 'tcp://*:*'
         self._lock       = mt.Lock()
 
-        self._ctx        = zmq.Context()  # rely on GC for destruction
+        self._ctx        = get_context()
         self._pub        = self._ctx.socket(zmq.XSUB)
         self._pub.linger = _LINGER_TIMEOUT
         self._pub.hwm    = _HIGH_WATER_MARK
@@ -121,9 +341,23 @@ class PubSub(Bridge):
 
         self._sub        = self._ctx.socket(zmq.XPUB)
         self._sub.linger = _LINGER_TIMEOUT
-        self._sub.hwm    = _HIGH_WATER_MARK
+        self._sub.hwm    = self._cfg.get('hwm') or _HIGH_WATER_MARK
         self._sub.bind(self._url)
 
+        self._cache = None
+        self._snap  = None
+        if self._cfg.get('cache'):
+            self._cache = _LastValueCache(
+                    key=self._cfg.get('cache_key') or 'uid',
+                    max_msgs=self._cfg.get('cache_msgs') or _CACHE_MSGS,
+                    max_bytes=self._cfg.get('cache_bytes') or
+                              _CACHE_BYTES * 1024 * 1024,
+                    codecs=get_decoders(self._cfg))
+
+            self._snap        = self._ctx.socket(zmq.ROUTER)
+            self._snap.linger = _LINGER_TIMEOUT
+            self._snap.bind(self._url)
+
         # communicate the bridge ports to the parent process
         _addr_pub = as_string(self._pub.getsockopt(zmq.LAST_ENDPOINT))
         _addr_sub = as_string(self._sub.getsockopt(zmq.LAST_ENDPOINT))
@@ -136,13 +370,37 @@ class PubSub(Bridge):
         self._addr_pub.host = get_hostip()
         self._addr_sub.host = get_hostip()
 
-        self._log.info('bridge pub on  %s: %s'  % (self._uid, self._addr_pub))
-        self._log.info('       sub on  %s: %s'  % (self._uid, self._addr_sub))
+        # also bind to the local transports (see `transport.py`)
+        local_pub = bind_local(self._pub, self._uid, self._addr_pub.port,
+                               self._log)
+        local_sub = bind_local(self._sub, self._uid, self._addr_sub.port,
+                               self._log)
+
+        # subscribers find the snapshot socket via the sub address, and
+        # endpoints on this node find the ipc transport via both addresses
+        query = list()
+        if self._snap:
+            _addr_snap = Url(as_string(self._snap.getsockopt(
+                                                         zmq.LAST_ENDPOINT)))
+            query.append('%s=%d' % (_SNAP_QUERY, _addr_snap.port))
+            bind_local(self._snap, self._uid, _addr_snap.port, self._log)
+
+        local = local_query(self._uid)
+        self._addr_pub.query = '&'.join(local)
+        self._addr_sub.query = '&'.join(query + local)
+
+        self._addrs_pub = [str(self._addr_pub)] + local_pub
+        self._addrs_sub = [str(self._addr_sub)] + local_sub
+
+        self._log.info('bridge pub on  %s: %s'  % (self._uid, self._addrs_pub))
+        self._log.info('       sub on  %s: %s'  % (self._uid, self._addrs_sub))
 
         # start polling for messages
         self._poll = zmq.Poller()
         self._poll.register(self._pub, zmq.POLLIN)
         self._poll.register(self._sub, zmq.POLLIN)
+        if self._snap:
+            self._poll.register(self._snap, zmq.POLLIN)
 
 
     # --------------------------------------------------------------------------
@@ -155,6 +413,13 @@ class PubSub(Bridge):
         #     zmq.proxy(socket_pub, socket_sub)
         #
         # That's the equivalent of the code below.
+        #
+        # All traffic is counted in `self._stats` (see `stats.py`).  Published
+        # messages are not decoded: each forwarded publication counts as one
+        # message, and the number of consumers is the number of topics with
+        # subscribers.
+
+        stats = self._stats
 
         while not self._term.is_set():
 
@@ -167,23 +432,54 @@ class PubSub(Bridge):
                 # a topic subscription.  Forward that to the pub
                 # channel, so the bridge subscribes for the respective
                 # message topic.
-                msg = self._sub.recv()
-                self._pub.send(msg)
+                msg = no_intr(recv_frames, self._sub)
+                no_intr(send_frames, self._pub, msg)
+
+                # subscription messages start with `1`, unsubscriptions with `0`
+                if msg[0].bytes[:1] == b'\x01': stats.consumers += 1
+                else                           : stats.consumers -= 1
 
                 self._prof.prof('subscribe', uid=self._uid, msg=msg)
               # log_bulk(self._log, msg, '~~ %s' % self.channel)
 
+            if self._snap in socks:
+
+                # a subscriber requests the cache snapshot for a topic (see
+                # `_snapshot()`): `[id, '', topic]`
+                req  = no_intr(recv_frames, self._snap)
+                pubs = self._cache.snapshot(req[-1].bytes)
+                rep  = [msgpack.packb([len(pub) for pub in pubs])]
+                for pub in pubs:
+                    rep += pub
+
+                no_intr(send_frames, self._snap, req[:2] + rep)
+
 
             if self._pub in socks:
 
                 # if the pub socket signals a message, get the message
                 # and forward it to the sub channel, no questions asked.
-                msg = self._pub.recv()
-                self._sub.send(msg)
+                msg    = no_intr(recv_frames, self._pub)
+                t_in   = time.time()
+                nbytes = sum([len(frame) for frame in msg])
+                stats.received(1, nbytes)
+
+                no_intr(send_frames, self._sub, msg)
+                stats.sent(1, nbytes, latency=time.time() - t_in)
+
+                if self._cache is not None:
+                    try:
+                        self._cache.update(msg)
+                    except Exception:
+                        self._log.exception('cannot cache message')
 
               # self._prof.prof('msg_fwd', uid=self._uid, msg=msg)
               # log_bulk(self._log, msg, '<> %s' % self.channel)
 
+            stats.tick()
+
+        stats.tick(final=True)
+
 
 # ------------------------------------------------------------------------------
 #
@@ -191,13 +487,23 @@ class Publisher(object):
 
     # --------------------------------------------------------------------------
     #
-    def __init__(self, channel, url, log=None, prof=None):
+    def __init__(self, channel, url, log=None, prof=None, cfg=None):
+        '''
+        The optional channel config `cfg` can specify the `codec` to use for
+        message serialization (see `codec.py`).  With the `pool` setting, the
+        publisher leases its socket from a process wide socket pool (see
+        `context.py`), and returns it on `close()`.
+        '''
+
+        if not cfg:
+            cfg = dict()
 
         self._channel  = channel
         self._url      = as_string(url)
         self._log      = log
         self._prof     = prof
         self._lock     = mt.Lock()
+        self._codec    = get_codec(cfg=cfg)
 
         # FIXME: no uid ns
         self._uid      = generate_id('%s.pub.%s' % (self._channel,
@@ -214,11 +520,17 @@ class Publisher(object):
 
         self._log.info('connect pub to %s: %s'  % (self._channel, self._url))
 
-        self._ctx           = zmq.Context()  # rely on GC for destruction
-        self._socket        = self._ctx.socket(zmq.PUB)
-        self._socket.linger = _LINGER_TIMEOUT
-        self._socket.hwm    = _HIGH_WATER_MARK
-        self._socket.connect(self._url)
+        self._lease = None
+        if cfg.get('pool'):
+            self._lease         = lease_socket(zmq.PUB, self._url,
+                                               _LINGER_TIMEOUT,
+                                               _HIGH_WATER_MARK)
+            self._socket        = self._lease.obj
+        else:
+            self._socket        = get_context().socket(zmq.PUB)
+            self._socket.linger = _LINGER_TIMEOUT
+            self._socket.hwm    = _HIGH_WATER_MARK
+            self._socket.connect(select_url(self._url))
 
 
     # --------------------------------------------------------------------------
@@ -247,11 +559,160 @@ class Publisher(object):
       # self._prof.prof('put', uid=self._uid, msg=msg)
       # log_bulk(self._log, msg, '-> %s' % self.channel)
 
-        btopic = as_bytes(topic.replace(' ', '_'))
-        bmsg   = msgpack.packb(msg)
-        data   = btopic + b' ' + bmsg
+        self._publish(topic, [msg], bulk=False)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def put_bulk(self, topic, msgs):
+        '''
+        Publish a list of messages for the given topic as a single publication,
+        i.e., with one send call (and one bridge hop) for all of them.
+        Subscriber callbacks are still invoked once per message, while
+        `Subscriber.get()` returns the list of messages (also if `msgs` holds
+        a single message).
+
+        If `topic` is `None`, `msgs` must be a dict which maps topics to lists
+        of messages, and one publication is sent per topic.
+        '''
+
+        if topic is None:
+            assert(isinstance(msgs, dict)), 'invalid message type'
+            for t, tmsgs in msgs.items():
+                self.put_bulk(t, tmsgs)
+            return
+
+        msgs = as_list(msgs)
+
+        assert(isinstance(topic, str)), 'invalid topic type'
+        assert(all([isinstance(msg, dict) for msg in msgs])), \
+                                                       'invalid message type'
+        if not msgs:
+            return
+
+      # log_bulk(self._log, msgs, '-> %s' % self.channel)
+
+        self._publish(topic, msgs, bulk=True)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _publish(self, topic, msgs, bulk):
+
+        btopic    = as_bytes(topic.replace(' ', '_'))
+        frames    = pack_bulk(msgs, self._codec, bulk=bulk)
+        frames[0] = btopic + b' ' + frames[0]
+
+        no_intr(send_frames, self._socket, frames)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+        '''
+        return the socket to the socket pool (or close it if it is not pooled).
+        The publisher cannot be used anymore afterwards.
+        '''
+
+        if self._lease:
+            release_socket(self._lease)
+            self._lease = None
+        else:
+            self._socket.close()
+
+
+    def __del__(self):
 
-        self._socket.send(data)
+        # return pooled sockets if the publisher is not closed explicitly
+        if getattr(self, '_lease', None):
+            release_socket(self._lease)
+            self._lease = None
+
+
+# ------------------------------------------------------------------------------
+#
+class _TopicIndex(object):
+    '''
+    Index callback entries by topic, following zmq's prefix semantics: an entry
+    registered for topic `t` matches all topics which start with `t` (and the
+    empty topic matches all topics).  Entries are held in a prefix trie, so that
+    a lookup only walks the characters of the message topic and only touches
+    the entries which actually match.  Lookup results are cached per message
+    topic, and are returned in registration order.
+    '''
+
+    _MAX_CACHE = 1024  # number of cached lookups
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self):
+
+        self._lock  = mt.Lock()
+        self._root  = [dict(), list()]   # [children, [[seq, entry], ...]]
+        self._seq   = 0
+        self._cache = dict()             # topic: [entry, ...]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def add(self, topic, entry):
+
+        with self._lock:
+
+            node = self._root
+            for c in topic:
+                node = node[0].setdefault(c, [dict(), list()])
+
+            self._seq += 1
+            node[1].append([self._seq, entry])
+            self._cache = dict()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def remove(self, topic, entry):
+
+        with self._lock:
+
+            node = self._root
+            for c in topic:
+                node = node[0].get(c)
+                if not node:
+                    return
+
+            for item in node[1]:
+                if item[1] is entry:
+                    node[1].remove(item)
+                    break
+
+            self._cache = dict()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def match(self, topic):
+
+        entries = self._cache.get(topic)
+        if entries is not None:
+            return entries
+
+        with self._lock:
+
+            node  = self._root
+            items = list(node[1])
+            for c in topic:
+                node = node[0].get(c)
+                if not node:
+                    break
+                items.extend(node[1])
+
+            entries = [item[1] for item in sorted(items, key=lambda i: i[0])]
+
+            if len(self._cache) >= self._MAX_CACHE:
+                self._cache = dict()
+            self._cache[topic] = entries
+
+        return entries
 
 
 # ------------------------------------------------------------------------------
@@ -259,84 +720,92 @@ class Publisher(object):
 class Subscriber(object):
 
     # instead of creating a new listener thread for each endpoint which then, on
-    # incoming messages, calls a subscriber callback, we only create *one*
-    # listening thread per ZMQ endpoint address and call *all* registered
-    # callbacks in that thread.  We hold those endpoints in a class dict, so
-    # that all class instances share that information
+    # incoming messages, calls a subscriber callback, we only register *one*
+    # socket per ZMQ endpoint address with a process wide poller thread (see
+    # `poller.py`), and call *all* registered callbacks from that thread.  We
+    # hold those endpoints in a class dict, so that all class instances share
+    # that information
     _callbacks = dict()
 
 
     # --------------------------------------------------------------------------
     #
     @staticmethod
-    def _get_nowait(socket, lock, timeout, log, prof):
-
-        # FIXME: add logging
+    def _dispatch(url):
+        '''
+        Called by the poller thread when a message arrives for an endpoint with
+        registered callbacks: deliver the message to all callbacks registered
+        for a matching topic.
+        '''
 
-        if socket.poll(flags=zmq.POLLIN, timeout=timeout):
+        info = Subscriber._callbacks[url]
 
-            raw         = no_intr(socket.recv, flags=zmq.NOBLOCK)
-            topic, data = raw.split(b' ', 1)
-            msg         = msgpack.unpackb(data)
+        # the lock also keeps `subscribe()` from changing callbacks while
+        # a message is delivered (see there)
+        with info['lock']:
 
-            return [as_string(topic), as_string(msg)]
+            try:
+                frames = no_intr(recv_frames, info['socket'], flags=zmq.NOBLOCK)
+            except zmq.Again:
+                return
 
-        return None, None
+            Subscriber._deliver(info, frames, info['topics'].match)
 
 
     # --------------------------------------------------------------------------
     #
     @staticmethod
-    def _listener(url, log, prof):
-
-      # assert(url in Subscriber._callbacks)
+    def _deliver(info, frames, match):
+        '''
+        deliver a publication to the callbacks returned by `match(topic)`
+        '''
 
         try:
-            uid    = Subscriber._callbacks.get(url, {}).get('uid')
-            lock   = Subscriber._callbacks.get(url, {}).get('lock')
-            term   = Subscriber._callbacks.get(url, {}).get('term')
-            socket = Subscriber._callbacks.get(url, {}).get('socket')
-
-            while not term.is_set():
+            topic, msg = _unpack(frames, info['codecs'])
+        except ValueError as e:
+            info['log'].error('drop publication on %s: %s', info['url'], e)
+            return
 
-                # this list is dynamic
-                callbacks  = Subscriber._callbacks[url]['callbacks']
-                topic, msg = Subscriber._get_nowait(socket, lock, 500, log, prof)
+        callbacks = match(topic)
 
-                if topic:
-                    t = as_string(topic)
-                    for m in as_list(msg):
-                        m = as_string(m)
-                        for cb, _lock in callbacks:
-                          # prof.prof('call_cb', uid=uid, msg=cb.__name__)
-                            if _lock:
-                                with _lock:
-                                    cb(t, m)
-                            else:
-                                cb(t, m)
-        except:
-            log.exception('listener died')
+        for m in as_list(msg):
+            for cb, _lock, executor, _, _, held in callbacks:
+                if held is not None:
+                    # waiting for its snapshot (see `subscribe()`)
+                    held.append([topic, m])
+                    continue
+              # prof.prof('call_cb', uid=uid, msg=cb.__name__)
+                executor.submit(cb, [topic, m], _lock)
 
 
     # --------------------------------------------------------------------------
     #
-    def __init__(self, channel, url, topic=None, cb=None, log=None, prof=None):
+    def __init__(self, channel, url, topic=None, cb=None, log=None, prof=None,
+                 cfg=None):
         '''
         If a `topic` is given, the channel will subscribe to that topic
         immediately.
 
-        When a callback `cb` is specified, then the Subscriber c'tor will spawn
-        a separate thread which continues to listen on the channel, and the cb
-        is invoked on any incoming message.  The topic will be the first, the
-        message will be the second argument to the cb.
+        When a callback `cb` is specified, then the Subscriber c'tor will
+        register the channel with the process' poller thread (see
+        `poller.py`), and the cb is invoked on any incoming message.  The topic
+        will be the first, the message will be the second argument to the cb.
+
+        The optional channel config `cfg` can specify the codecs the subscriber
+        decodes besides the safe ones (`codec`, `codecs`, see `codec.py`).
+
+        If the bridge keeps a last-value cache, each subscription first
+        delivers the cached messages of the subscribed topics (see `PubSub`).
         '''
 
         self._channel  = channel
         self._url      = as_string(url)
         self._topic    = as_list(topic)
+        self._pending  = mc.deque()    # snapshot publications for `get()`
         self._cb       = cb
         self._log      = log
         self._prof     = prof
+        self._codecs   = get_decoders(cfg)
         self._uid      = generate_id('%s.sub.%s' % (self._channel,
                                                    '%(counter)04d'), ID_CUSTOM)
         if not self._log:
@@ -352,22 +821,28 @@ class Subscriber(object):
         self._log.info('connect sub to %s: %s'  % (self._channel, self._url))
 
         self._lock     = mt.Lock()
-        self._ctx      = zmq.Context()  # rely on GC for destruction
+        self._ctx      = get_context()
 
-        if url not in Subscriber._callbacks:
+        # the bridge's snapshot socket (if any) is advertised with its address
+        self._url, self._url_snap = split_url(self._url, _SNAP_QUERY)
+
+        if self._url not in Subscriber._callbacks:
 
             s        = self._ctx.socket(zmq.SUB)
             s.linger = _LINGER_TIMEOUT
             s.hwm    = _HIGH_WATER_MARK
-            s.connect(self._url)
-
-            Subscriber._callbacks[url] = {'uid'      : self._uid,
-                                          'socket'   : s,
-                                          'channel'  : channel,
-                                          'lock'     : mt.Lock(),
-                                          'term'     : mt.Event(),
-                                          'thread'   : None,
-                                          'callbacks': list()}
+            s.connect(select_url(self._url))
+
+            Subscriber._callbacks[self._url] = {'uid'      : self._uid,
+                                                'url'      : self._url,
+                                                'socket'   : s,
+                                                'channel'  : channel,
+                                                'lock'     : mt.RLock(),
+                                                'poller'   : None,
+                                                'topics'   : _TopicIndex(),
+                                                'codecs'   : set(self._codecs),
+                                                'log'      : self._log,
+                                                'callbacks': list()}
 
         # only allow `get()` and `get_nowait()`
         self._interactive = True
@@ -396,15 +871,14 @@ class Subscriber(object):
     def _start_listener(self):
 
         # only start if needed
-        if Subscriber._callbacks[self._url]['thread']:
+        info = Subscriber._callbacks[self._url]
+        if info['poller']:
             return
 
-        t = mt.Thread(target=Subscriber._listener,
-                      args=[self._url, self._log, self._prof])
-        t.daemon = True
-        t.start()
-
-        Subscriber._callbacks[self._url]['thread'] = t
+        info['poller'] = get_poller()
+        info['poller'].register(info['socket'],
+                                lambda: Subscriber._dispatch(self._url),
+                                self._log)
 
 
     # --------------------------------------------------------------------------
@@ -412,40 +886,92 @@ class Subscriber(object):
     def _stop_listener(self, force=False):
 
         # only stop listener if no callbacks remain registered (unless forced)
-        if force or not Subscriber._callbacks[self._url]['callbacks']:
-            if  Subscriber._callbacks[self._url]['thread']:
-                Subscriber._callbacks[self._url]['term'  ].set()
-                Subscriber._callbacks[self._url]['thread'].join()
-                Subscriber._callbacks[self._url]['term'  ].unset()
-                Subscriber._callbacks[self._url]['thread'] = None
+        info = Subscriber._callbacks[self._url]
+        if force or not info['callbacks']:
+            if info['poller']:
+                info['poller'].unregister(info['socket'])
+                info['poller'] = None
 
 
     # --------------------------------------------------------------------------
     #
-    def subscribe(self, topic, cb=None, lock=None):
+    def subscribe(self, topic, cb=None, lock=None, executor=None):
 
-        # if we need to serve callbacks, then open a thread to watch the socket
-        # and register the callbacks.  If a thread is already runnning on that
-        # channel, just register the callback.
+        # if we need to serve callbacks, then register the socket with the
+        # poller thread and register the callbacks.  If the socket is already
+        # registered, just register the callback.
         #
-        # Note that once a thread is watching a socket, we cannot allow to use
+        # Note that once the poller is watching a socket, we cannot allow to use
         # `get()` and `get_nowait()` anymore, as those will interfere with the
-        # thread consuming the messages,
+        # poller consuming the messages,
         #
         # The given lock (if any) is used to shield concurrent cb invokations.
+        # The given executor specifies how the callback is invoked (see
+        # `executor.py`, default: in the poller thread).  Slow callbacks can
+        # use a conflating executor (e.g., `{'kind': 'conflate', 'key': 'uid'}`)
+        # to only receive the latest message per key.
+        #
+        # The callback is only invoked for messages whose topic starts with the
+        # given topic (see `_TopicIndex`).
+        #
+        # If the bridge keeps a last-value cache, the cache snapshot for the
+        # topic is requested after subscribing, and is delivered to this
+        # subscriber only: to the given callback, or via `get()` before any
+        # live message.  While the snapshot is requested, live messages for
+        # the callback are held back in its entry (the last element, `None`
+        # once the callback is live), and are delivered after the snapshot.
+        # The socket lock is not held while the snapshot is requested, so that
+        # other callbacks served by the poller thread are not stalled.
+
+        topic = topic.replace(' ', '_')
+        info  = Subscriber._callbacks[self._url]
+        entry = None
 
         if cb:
 
-            self._interactive = False
-            self._start_listener()
-            Subscriber._callbacks[self._url]['callbacks'].append([cb, lock])
+            executor, owned = get_executor(executor, self._log)
+
+            if lock and not executor.support_locks:
+                raise ValueError('%s executor does not support locks'
+                                % executor.name)
+
+            held  = list() if self._url_snap else None
+            entry = [cb, lock, executor, owned, topic, held]
+
+            with info['lock']:
+
+                # the socket decodes the codecs enabled by any of its
+                # subscribers
+                info['codecs'].update(self._codecs)
+
+                self._interactive = False
+                self._start_listener()
+                info['callbacks'].append(entry)
+                info['topics'].add(topic, entry)
 
-        sock  = Subscriber._callbacks[self._url]['socket']
-        topic = topic.replace(' ', '_')
         log_bulk(self._log, topic, '~~ %s' % self.channel)
 
         with self._lock:
-            no_intr(sock.setsockopt, zmq.SUBSCRIBE, as_bytes(topic))
+            no_intr(info['socket'].setsockopt, zmq.SUBSCRIBE, as_bytes(topic))
+
+        if not self._url_snap:
+            return
+
+        pubs = _snapshot(self._url_snap, topic, self._log)
+
+        if not entry:
+            self._pending.extend(pubs)
+            return
+
+        with info['lock']:
+
+            held, entry[5] = entry[5], None
+
+            for frames in pubs:
+                Subscriber._deliver(info, frames, lambda _: [entry])
+
+            for t, m in held:
+                executor.submit(cb, [t, m], lock)
 
 
     # --------------------------------------------------------------------------
@@ -453,14 +979,34 @@ class Subscriber(object):
     def unsubscribe(self, cb):
 
         if self._url in Subscriber._callbacks:
-            for _cb, _lock in Subscriber._callbacks[self._url]['callbacks']:
-                if cb == _cb:
-                    Subscriber._callbacks[self._url]['callbacks'].remove([_cb, _lock])
+            info = Subscriber._callbacks[self._url]
+            for entry in info['callbacks']:
+                if cb == entry[0]:
+                    info['callbacks'].remove(entry)
+                    info['topics'].remove(entry[4], entry)
+                    if entry[3]:
+                        entry[2].stop()
                     break
 
         self._stop_listener()
 
 
+    # --------------------------------------------------------------------------
+    #
+    def cb_stats(self):
+        '''
+        return a list of `[cb, stats]` pairs for all callbacks registered for
+        this channel, where `stats` are the executor metrics of the callback
+        (see `executor.py`).
+        '''
+
+        if self._url not in Subscriber._callbacks:
+            return list()
+
+        return [[entry[0], entry[2].stats]
+                for entry in Subscriber._callbacks[self._url]['callbacks']]
+
+
     # --------------------------------------------------------------------------
     #
     def stop(self):
@@ -468,6 +1014,20 @@ class Subscriber(object):
         self._stop_listener(force=True)
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _recv(self, sock, flags=0):
+        '''
+        return the next publication: from the pending cache snapshot first,
+        then from the socket
+        '''
+
+        if self._pending:
+            return self._pending.popleft()
+
+        return no_intr(recv_frames, sock, flags=flags)
+
+
     # --------------------------------------------------------------------------
     #
     def get(self):
@@ -476,19 +1036,18 @@ class Subscriber(object):
             raise RuntimeError('invalid get(): callbacks are registered')
 
 
-        # FIXME: add timeout to allow for graceful termination
-        #
+        # NOTE: this blocks forever - use `get_nowait()` or `get_bulk()` with
+        #       a timeout to allow for graceful termination
         sock = Subscriber._callbacks[self._url]['socket']
 
         with self._lock:
-            raw = no_intr(sock.recv)
+            frames = self._recv(sock)
 
-        topic, data = raw.split(b' ', 1)
-        msg = msgpack.unpackb(data)
+        topic, msg = _unpack(frames, self._codecs)
 
         log_bulk(self._log, msg, '<- %s' % self.channel)
 
-        return [as_string(topic), as_string(msg)]
+        return [topic, msg]
 
 
     # --------------------------------------------------------------------------
@@ -503,21 +1062,69 @@ class Subscriber(object):
 
         sock = Subscriber._callbacks[self._url]['socket']
 
-        if no_intr(sock.poll, flags=zmq.POLLIN, timeout=timeout):
+        if self._pending or \
+                no_intr(sock.poll, flags=zmq.POLLIN, timeout=timeout):
 
             with self._lock:
-                raw = no_intr(sock.recv, flags=zmq.NOBLOCK)
+                frames = self._recv(sock, flags=zmq.NOBLOCK)
 
-            topic, data = raw.split(b' ', 1)
-            msg = msgpack.unpackb(data)
+            topic, msg = _unpack(frames, self._codecs)
 
             log_bulk(self._log, msg, '<- %s' % self.channel)
 
-            return [as_string(topic), as_string(msg)]
+            return [topic, msg]
 
         else:
             return [None, None]
 
 
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk(self, max_msgs=None, max_bytes=None, timeout=None):
+        '''
+        Wait up to `timeout` ms (`None`: forever) for a publication, and return
+        the messages of all publications which are then queued in the socket,
+        as flat list of `[topic, msg]` pairs (an empty list if nothing arrived
+        in time).  Draining stops once `max_msgs` messages or `max_bytes` bytes
+        are received.  Limits are checked per publication, so the result can
+        exceed them by one publication.
+        '''
+
+        if not self._interactive:
+            raise RuntimeError('invalid get_bulk(): callbacks are registered')
+
+        sock = Subscriber._callbacks[self._url]['socket']
+        ret  = list()
+
+        if not self._pending and \
+                not no_intr(sock.poll, flags=zmq.POLLIN, timeout=timeout):
+            return ret
+
+        n_bytes = 0
+
+        with self._lock:
+
+            while True:
+
+                try:
+                    frames = self._recv(sock, flags=zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+
+                n_bytes    += sum([len(frame) for frame in frames])
+                topic, msgs = _unpack(frames, self._codecs)
+
+                for msg in as_list(msgs):
+                    ret.append([topic, msg])
+
+                if (max_msgs  and len(ret) >= max_msgs) or \
+                   (max_bytes and n_bytes  >= max_bytes):
+                    break
+
+        log_bulk(self._log, ret, '<- %s' % self.channel)
+
+        return ret
+
+
 # ------------------------------------------------------------------------------
 
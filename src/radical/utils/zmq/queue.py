@@ -1,29 +1,55 @@
 
+import os
 import zmq
 import time
+import zlib
+import queue
 import msgpack
 
+import collections   as mc
+
 import threading as mt
 
 from ..atfork  import atfork
 from ..config  import Config
 from ..ids     import generate_id, ID_CUSTOM
 from ..url     import Url
-from ..misc    import get_hostip, is_string, as_string, as_bytes, as_list, noop
+from ..misc    import get_hostip, is_string, as_string, as_bytes, as_list
+from ..misc    import noop
 from ..logger  import Logger
 from ..profile import Profiler
 
 from .bridge   import Bridge
-from .utils    import no_intr, prof_bulk
+from .backlog  import Backlog, DurableBacklog, Lanes, chunk_size
+from .codec    import get_codec, get_decoders
+from .context  import get_context, lease_socket, release_socket
+from .transport import bind_local, local_query, select_url, split_url
+from .executor import get_executor
+from .poller   import get_poller
+from .trace    import Tracer, new_trace, stamp_chunks, T_ENQ, T_DEQ
+from .utils    import no_intr, prof_bulk, send_frames, recv_frames
+from .utils    import pack_bulk, pack_encoded, unpack_bulk
+from .utils    import split_chunks, join_chunks
 
 
 # FIXME: the log bulk method is frequently called and slow
 
 # --------------------------------------------------------------------------
 #
-_LINGER_TIMEOUT    =  250  # ms to linger after close
-_HIGH_WATER_MARK   =    0  # number of messages to buffer before dropping
-_DEFAULT_BULK_SIZE = 1024  # number of messages to put in a bulk
+_LINGER_TIMEOUT     =  250  # ms to linger after close
+_HIGH_WATER_MARK    =    0  # number of messages to buffer before dropping
+_BOUNDED_HWM        =    4  # number of bulks to queue in bounded channels
+_DEFAULT_BULK_SIZE  = 1024  # number of messages to put in a bulk
+_DEFAULT_BULK_BYTES =   16  # MB to put in a bulk (at most)
+_MIN_BULK_BYTES     =   64  # kB to put in a bulk (at least, when adapting)
+_BULK_TIME          =  0.1  # s a consumer should need to process a bulk
+_CONSUMER_TTL       =  100  # bulk times after which idle consumers are dropped
+_POLL_TIMEOUT       =  500  # ms to wait for events before checking termination
+_BATCH_MSGS         = 1024  # number of messages to coalesce in a putter
+_BATCH_BYTES        =    1  # MB to coalesce in a putter
+_BATCH_TIME         =    1  # ms to delay coalesced messages (at most)
+
+_PRIO_QUERY = 'prio'        # put address query key for the priority port
 
 
 # ------------------------------------------------------------------------------
@@ -35,6 +61,35 @@ def _atfork_child():
 atfork(noop, noop, _atfork_child)
 
 
+# ------------------------------------------------------------------------------
+#
+def _get_request(req):
+    '''
+    Getters send a msgpack'ed dict `{'uid': <uid>, 'credit': <n>, 'size': <m>}`
+    to request `n` bulks of up to `m` messages (`size` is optional).  Anything
+    else (like the plain text requests of older getters) is interpreted as
+    a request for a single bulk of default size.  Returns `[credit, size]`,
+    where a size of `0` means default size.
+    '''
+
+    try:
+        req = msgpack.unpackb(req)
+        return [int(req['credit']), int(req.get('size') or 0)]
+    except Exception:
+        return [1, 0]
+
+
+# ------------------------------------------------------------------------------
+#
+def _bounded(cfg):
+    '''
+    A channel is bounded if its config limits the number of messages or bytes
+    the bridge buffers.
+    '''
+
+    return bool(cfg and (cfg.get('max_msgs') or cfg.get('max_bytes')))
+
+
 # ------------------------------------------------------------------------------
 #
 # Communication between components is done via queues.  Queues are
@@ -53,7 +108,8 @@ atfork(noop, noop, _atfork_child)
 #
 # We implement the interface of Queue.Queue:
 #
-#   put(msg)
+#   put(msg, block, timeout)
+#   put_nowait(msg)
 #   get()
 #   get_nowait()
 #
@@ -62,11 +118,74 @@ atfork(noop, noop, _atfork_child)
 #   qsize
 #   empty
 #   full
-#   put(msg, block, timeout)
-#   put_nowait
 #   get(block, timeout)
 #   task_done
 #
+# By default, the bridge buffers any number of messages.  The channel config
+# settings `max_msgs` and `max_bytes` limit the bridge's buffer: once either
+# limit is reached, the bridge stops pulling messages from the putters until
+# consumers drained the buffer below the limits again.  Putters then queue up
+# to a few bulks in their zmq socket (and the OS socket buffers), after which
+# `put()` blocks, and `put_nowait()` (or `put()` with a timeout) raises
+# `queue.Full`.  The limits are thus approximate - they can be exceeded by the
+# size of the bulks in flight.  Putters need to use the same channel config as
+# the bridge to see that backpressure.
+#
+# With the channel config setting `durable`, the bridge appends all incoming
+# messages to a write-ahead log in `<path>/<uid>.wal/` (see `DurableBacklog`),
+# and only holds up to `spill_bytes` of its backlog in memory.  Messages count
+# as delivered once they are sent to a getter.  A bridge which is restarted with
+# the same `uid` and `path` replays all messages which were not delivered
+# before.  The settings `segment_bytes` (size of the log files) and `sync`
+# (sync every write to disk) tune the log.
+#
+# Getters request messages from the bridge by granting it *credits*: for each
+# credit, the bridge will send one bulk of messages to that getter as soon as
+# messages are available.  By default, a getter uses a REQ socket and grants
+# exactly one credit per request, resulting in a strict request / reply
+# round-trip per bulk.  When a getter is configured with `prefetch=N` in its
+# channel config, it uses a DEALER socket instead and, from its first request
+# on, keeps up to N credits granted to the bridge, so that the next bulks are
+# already in flight while the consumer is still processing the current one.
+# The bridge serves both getter types on the same ROUTER socket, so both can be
+# mixed on the same channel.
+#
+# Note that messages pushed to a prefetching getter are lost if that getter
+# terminates before consuming them.
+#
+# Messages can be put with a priority (an integer, default `0`).  The bridge
+# keeps a separate backlog (*lane*) per priority, and always serves bulks from
+# the highest priority lane which holds messages, so that urgent messages
+# overtake the backlog of regular messages.  With the channel config setting
+# `max_skip`, a lane which was passed over that many times in a row is served
+# next, so that lower priority messages are not starved.  Note that bulks which
+# are already prefetched by a getter are not overtaken.
+#
+# Messages with a priority above the default are sent to a separate bridge
+# socket, whose port is part of the put address (`?prio=<port>`).  On bounded
+# channels, that socket is only throttled when the priority lanes alone reach
+# the limits, so that priority messages are not held back while regular
+# messages wait for the buffer to drain (but the buffer can then hold up to
+# twice the limits).  Priority messages sent to a put address without that
+# port (like a local transport address) are throttled with regular messages.
+#
+# Putters can attach a trace to a sample of their bulks, which the bridge stamps
+# with the time the bulk entered and left its backlog, and which getters collect
+# in latency histograms (see `trace.py`).
+#
+# A bulk holds at most `bulk_size` messages (or the number of messages the
+# getter asked for), and at most `bulk_bytes` bytes.  Within that, the bridge
+# adapts the byte size of the bulks to the rate at which each consumer drains
+# them: the bytes sent to a consumer are divided by the time until it asks for
+# more, and bulks are sized such that the consumer can process them in about
+# `bulk_time` seconds.  Fast consumers thus receive large bulks (which reduces
+# the per bulk overhead), while slow consumers receive small bulks (so that
+# messages are not stuck with a slow consumer while others are idle).
+#
+# Getters do not tell the bridge when they go away.  Consumers which hold no
+# credits and sent no request for `consumer_ttl` seconds (default: 100 times
+# `bulk_time`) are forgotten, and are not counted as consumers anymore.
+#
 # Our Queue additionally takes 'name', 'role' and 'address' parameter on the
 # constructor.  'role' can be 'input', 'bridge' or 'output', where 'input' is
 # the end of a queue one can 'put()' messages into, and 'output' the end of the
@@ -88,7 +207,8 @@ class Queue(Bridge):
 
         ie. any number of inputs can 'zmq.push()' to a bridge (which
         'zmq.pull()'s), and any number of outputs can 'zmq.request()'
-        messages from the bridge (which 'zmq.response()'s).
+        messages from the bridge (which routes responses to the requesting
+        output).
 
         The bridge is the entity which 'bind()'s network interfaces, both input
         and output type endpoints 'connect()' to it.  It is the callees
@@ -118,10 +238,23 @@ class Queue(Bridge):
         super(Queue, self).__init__(cfg)
 
         self._bulk_size  = self._cfg.get('bulk_size', 0)
+        self._bulk_bytes = self._cfg.get('bulk_bytes', 0)
+        self._bulk_time  = self._cfg.get('bulk_time', _BULK_TIME)
+        self._ttl        = self._cfg.get('consumer_ttl') \
+                                           or _CONSUMER_TTL * self._bulk_time
+        self._max_msgs   = self._cfg.get('max_msgs',  0)
+        self._max_bytes  = self._cfg.get('max_bytes', 0)
 
         if self._bulk_size <= 0:
             self._bulk_size = _DEFAULT_BULK_SIZE
 
+        if self._bulk_bytes <= 0:
+            self._bulk_bytes = _DEFAULT_BULK_BYTES * 1024 * 1024
+
+        # backpressure metrics: how often and how long putters were throttled
+        self.throttled     = 0
+        self.throttle_time = 0.0
+
 
     # --------------------------------------------------------------------------
     #
@@ -159,6 +292,16 @@ class Queue(Bridge):
     def addr_get(self):
         return self._addr_get
 
+    @property
+    def addrs_in(self):
+        # all addresses, including local transports
+        return self._addrs_put
+
+    @property
+    def addrs_out(self):
+        # all addresses, including local transports
+        return self._addrs_get
+
     def addr(self, spec):
         if spec.lower() == self.type_in : return self.addr_put
         if spec.lower() == self.type_out: return self.addr_get
@@ -173,20 +316,33 @@ class Queue(Bridge):
         self._url        = 'tcp://*:*'
         self._lock       = mt.Lock()
 
-        self._ctx        = zmq.Context()  # rely on GC for destruction
-        self._put         = self._ctx.socket(zmq.PULL)
-        self._put.linger  = _LINGER_TIMEOUT
-        self._put.hwm     = _HIGH_WATER_MARK
-        self._put.bind(self._url)
+        self._ctx        = get_context()
+
+        # regular and priority messages are received on separate sockets, so
+        # that they can be throttled separately (see `_bridge_work()`)
+        self._puts = list()
+        for _ in range(2):
+            sock        = self._ctx.socket(zmq.PULL)
+            sock.linger = _LINGER_TIMEOUT
+            sock.hwm    = _HIGH_WATER_MARK
+            if _bounded(self._cfg):
+                sock.hwm = _BOUNDED_HWM
+            sock.bind(self._url)
+            self._puts.append(sock)
 
-        self._get        = self._ctx.socket(zmq.REP)
+        self._put, self._put_prio = self._puts
+
+        self._get        = self._ctx.socket(zmq.ROUTER)
         self._get.linger = _LINGER_TIMEOUT
         self._get.hwm    = _HIGH_WATER_MARK
+        self._get.setsockopt(zmq.ROUTER_MANDATORY, 1)
         self._get.bind(self._url)
 
         # communicate the bridge ports to the parent process
-        _addr_put = as_string(self._put.getsockopt (zmq.LAST_ENDPOINT))
-        _addr_get = as_string(self._get.getsockopt(zmq.LAST_ENDPOINT))
+        _addr_put  = as_string(self._put.getsockopt (zmq.LAST_ENDPOINT))
+        _addr_get  = as_string(self._get.getsockopt(zmq.LAST_ENDPOINT))
+        _addr_prio = Url(as_string(self._put_prio.getsockopt(
+                                                         zmq.LAST_ENDPOINT)))
 
         # store addresses
         self._addr_put = Url(_addr_put)
@@ -196,105 +352,295 @@ class Queue(Bridge):
         self._addr_put.host = get_hostip()
         self._addr_get.host = get_hostip()
 
-        self._log.info('bridge in  %s: %s'  % (self._uid, self._addr_put))
-        self._log.info('       out %s: %s'  % (self._uid, self._addr_get))
-
-        # start polling senders
-        self._poll_put = zmq.Poller()
-        self._poll_put.register(self._put, zmq.POLLIN)
-
-        # start polling receivers
-        self._poll_get = zmq.Poller()
-        self._poll_get.register(self._get, zmq.POLLIN)
+        # also bind to the local transports (see `transport.py`)
+        local_put = bind_local(self._put, self._uid, self._addr_put.port,
+                               self._log)
+        local_get = bind_local(self._get, self._uid, self._addr_get.port,
+                               self._log)
+        bind_local(self._put_prio, self._uid, _addr_prio.port, self._log)
+
+        # putters find the priority socket via the put address, and endpoints
+        # on this node find the ipc transport via both addresses
+        local = local_query(self._uid)
+        self._addr_put.query = '&'.join(['%s=%d' % (_PRIO_QUERY,
+                                                    _addr_prio.port)] + local)
+        self._addr_get.query = '&'.join(local)
+
+        self._addrs_put = [str(self._addr_put)] + local_put
+        self._addrs_get = [str(self._addr_get)] + local_get
+
+        self._log.info('bridge in  %s: %s'  % (self._uid, self._addrs_put))
+        self._log.info('       out %s: %s'  % (self._uid, self._addrs_get))
+
+        # poll senders and receivers in the same poller, so that the bridge
+        # wakes up on either side without busy polling
+        self._poll = zmq.Poller()
+        self._poll.register(self._put,      zmq.POLLIN)
+        self._poll.register(self._put_prio, zmq.POLLIN)
+        self._poll.register(self._get,      zmq.POLLIN)
+
+        # one backlog per priority lane - durable lanes of a previous run are
+        # recreated to replay their messages
+        prios = list()
+        path  = self._cfg.path or os.getcwd()
+        if self._cfg.get('durable') and os.path.isdir(path):
+            pre = '%s.' % self._uid
+            for fname in os.listdir(path):
+                if fname.startswith(pre) and fname.endswith('.wal'):
+                    try:
+                        prios.append(int(fname[len(pre):-4]))
+                    except ValueError:
+                        pass
+
+        self._buf = Lanes(self._new_backlog,
+                          max_skip=self._cfg.get('max_skip') or 0,
+                          priorities=prios)
 
 
     # --------------------------------------------------------------------------
     #
-    def _bridge_work(self):
-
-        # TODO: *always* pull for messages and buffer them.  Serve requests from
-        #       that buffer.
-
-        try:
-
-            self.nin  = 0
-            self.nout = 0
-            self.last = 0
-
-            buf = list()
-            while not self._term.is_set():
-
-                active = False
-
-                # check for incoming messages, and buffer them
-                ev_put = dict(no_intr(self._poll_put.poll, timeout=0))
-              # self._prof.prof('poll_put', msg=len(ev_put))
-
-                if self._put in ev_put:
-
-                    with self._lock:
-                        data = no_intr(self._put.recv)
-
-                    msgs = msgpack.unpackb(data)
-                  # prof_bulk(self._prof, 'poll_put_recv', msgs)
-
-                    if isinstance(msgs, list): buf += msgs
-                    else                     : buf.append(msgs)
-
-                    if isinstance(msgs, list): self.nin += len(msgs)
-                    else                     : self.nin += 1
-
-                    active = True
-
+    def _new_backlog(self, prio):
+        '''
+        create the backlog for the lane of the given priority
+        '''
 
-                # if we don't have any data in the buffer, there is no point in
-                # checking for receivers
-                if not buf:
-                    pass
-                  # self._prof.prof('poll_get_skip')
+        if not self._cfg.get('durable'):
+            return Backlog()
 
-                else:
+        if prio: fname = '%s.%d.wal' % (self._uid, prio)
+        else   : fname = '%s.wal'    %  self._uid
 
-                    # check if somebody wants our messages
-                    ev_get = dict(no_intr(self._poll_get.poll, timeout=0))
-                  # self._prof.prof('poll_get', msg=len(ev_get))
+        path = os.path.join(self._cfg.path or os.getcwd(), fname)
+        buf  = DurableBacklog(path,
+                              spill_bytes=self._cfg.get('spill_bytes'),
+                              segment_bytes=self._cfg.get('segment_bytes'),
+                              sync=self._cfg.get('sync'))
+        self._log.info('durable bridge: %s (%d msgs to replay)',
+                       path, len(buf))
+        return buf
 
-                    if self._get in ev_get:
 
-                        # send up to `bulk_size` messages from the buffer
-                        # NOTE: this sends partial bulks on buffer underrun
-                        with self._lock:
-                            # the actual req message is ignored - we only care
-                            # about who sent it
-                            req = no_intr(self._get.recv)                 # noqa
+    # --------------------------------------------------------------------------
+    #
+    def _bridge_work(self):
 
-                        bulk   = buf[:self._bulk_size]
-                        data   = msgpack.packb(bulk)
-                        active = True
+        # We *always* pull for messages and buffer them (see `Backlog`), and
+        # serve requests from that buffer.  Both sockets are watched by a single
+        # blocking poll, so any incoming message or request wakes the bridge up
+        # immediately.  The poll timeout only serves to check for termination.
+        #
+        # Messages are never decoded by the bridge: bulks travel as chunks of
+        # individually packed messages (see `utils.pack_bulk()`), and the
+        # bridge splits and merges bulks at message boundaries by slicing those
+        # chunks.  Frames are received and sent without copying, so that large
+        # messages are never copied in the bridge.
+        #
+        # Requests grant credits to the bridge: each credit allows the bridge to
+        # send one bulk to the requesting consumer.  Consumers with credits are
+        # served round-robin, one bulk per consumer per loop iteration, and each
+        # loop iteration receives at most one request and one bulk worth of
+        # messages, so that a busy side cannot starve the other one.
+        #
+        # For each consumer we keep track of the requested bulk size (`size`),
+        # its drain rate (`rate`, bytes/s), and the bytes sent since its last
+        # request (`sent`) and when the first of those was sent (`t_sent`) to
+        # measure that rate.  The time of its last request (`t_req`) is used to
+        # forget consumers which are gone (see above).
+        #
+        # When the buffer reaches the configured limits, the put socket is
+        # removed from the poller until the buffer drained again (backpressure).
+        # The socket for priority messages is handled the same, but only counts
+        # the messages in the priority lanes.
+        #
+        # All traffic is counted in `self._stats` (see `stats.py`).  Each chunk
+        # carries its arrival time (as last element) through the backlog, so
+        # that latencies are measured per chunk, whichever lane or order the
+        # chunk leaves the backlog in.  Chunks replayed from a durable backlog
+        # have no arrival time and are not included in the latency histogram.
 
-                        no_intr(self._get.send, data)
-                      # prof_bulk(self._prof, 'poll_get_send', msgs=bulk, msg=req)
+        try:
 
-                        self.nout += len(bulk)
-                        self.last  = time.time()
+            stats   = self._stats
+            buf     = self._buf
+            credits = dict()         # consumer id: number of granted bulks
+            drain   = dict()         # consumer id: drain info (see above)
+            ready   = mc.deque()     # consumers with credits, round-robin
+            t_full  = dict()         # put socket: start of its throttling
+            t_ttl   = time.time()    # last check for idle consumers
 
-                        # remove sent messages from buffer
-                        del(buf[:self._bulk_size])
+            while not self._term.is_set():
 
-                if not active:
-                  # self._prof.prof('sleep', msg=len(buf))
-                    # let CPU sleep a bit when there is nothing to do
-                    # We don't want to use poll timouts since we use two
-                    # competing polls and don't want the idle channel slow down
-                    # the busy one.
-                    time.sleep(0.1)
+                events = dict(no_intr(self._poll.poll, timeout=_POLL_TIMEOUT))
+
+                # check for incoming messages, and buffer them.  Under load we
+                # pick up everything which is already queued (up to a bulk), so
+                # that outgoing bulks fill up instead of being sent piecemeal.
+                for put in self._puts:
+
+                    if put not in events:
+                        continue
+
+                    n_in  = 0
+                    b_in  = 0
+                    flags = 0
+                    while n_in < self._bulk_size:
+
+                        try:
+                            frames = no_intr(recv_frames, put, flags)
+                        except zmq.Again:
+                            break
+
+                      # prof_bulk(self._prof, 'poll_put_recv', frames)
+
+                        chunks = split_chunks(frames)
+                        stamp_chunks(chunks, T_ENQ)
+
+                        t_in = time.time()
+                        for chunk in chunks:
+                            chunk.append(t_in)
+                            n_in += buf.put(chunk)
+                            b_in += chunk_size(chunk)
+
+                        flags = zmq.NOBLOCK
+
+                    stats.received(n_in, b_in)
+
+                # check if somebody wants our messages.  REQ sockets send
+                # `[id, '', req]`, prefetching DEALER sockets mimic that.
+                if self._get in events:
+
+                    frames       = no_intr(recv_frames, self._get)
+                    cid          = frames[0].bytes
+                    credit, size = _get_request(frames[-1])
+
+                    if cid not in credits:
+                        credits[cid] = 0
+                        ready.append(cid)
+
+                    if cid not in drain:
+                        drain[cid] = {'size'  : 0,
+                                      'rate'  : 0.0,
+                                      'sent'  : 0,
+                                      't_sent': 0.0,
+                                      't_req' : 0.0}
+
+                    info = drain[cid]
+                    info['t_req'] = time.time()
+                    if size:
+                        info['size'] = size
+
+                    # update the drain rate (smoothed over recent bulks)
+                    if info['sent']:
+                        dt = time.time() - info['t_sent']
+                        if dt > 0:
+                            rate = info['sent'] / dt
+                            if info['rate']:
+                                rate = (info['rate'] + rate) / 2
+                            info['rate'] = rate
+                        info['sent'] = 0
+
+                    credits[cid] += credit
+
+                # serve pending credits while we have data
+                # NOTE: this sends partial bulks on buffer underrun
+                for _ in range(len(ready)):
+
+                    if not buf:
+                        break
+
+                    cid    = ready.popleft()
+                    info   = drain[cid]
+                    budget = self._bulk_bytes
+
+                    if info['rate']:
+                        budget = min(budget,
+                                     max(_MIN_BULK_BYTES * 1024,
+                                         info['rate'] * self._bulk_time))
+
+                    chunks = buf.get(info['size'] or self._bulk_size, budget)
+                    stamp_chunks(chunks, T_DEQ)
+                    frames = [cid, b''] + join_chunks(chunks)
+
+                    try:
+                        no_intr(send_frames, self._get, frames)
+
+                    except zmq.ZMQError as e:
+                        if e.errno != zmq.EHOSTUNREACH:
+                            raise
+                        # consumer is gone - forget its credits, and return
+                        # the messages to the buffer for other consumers
+                        self._log.warn('lost consumer %s', cid)
+                        del(credits[cid])
+                        del(drain[cid])
+                        buf.unget(chunks)
+                        continue
+
+                  # prof_bulk(self._prof, 'poll_get_send', msgs=bulk, msg=cid)
+
+                    buf.ack()
+                    credits[cid] -= 1
+                    if credits[cid]: ready.append(cid)
+                    else           : del(credits[cid])
+
+                    nbytes = sum([chunk_size(chunk) for chunk in chunks])
+
+                    if not info['sent']:
+                        info['t_sent'] = time.time()
+                    info['sent'] += nbytes
+
+                    arrivals = [[chunk[3], len(chunk[0][0])]
+                                for chunk in chunks if len(chunk) > 3]
+                    stats.sent(sum([len(chunk[0][0]) for chunk in chunks]),
+                               nbytes, arrivals=arrivals)
+
+                # throttle putters while the buffer is full.  Priority messages
+                # are only throttled once the priority lanes alone are full, so
+                # that they never wait for regular messages to drain.
+                usage = [[self._put,      len(buf), buf.nbytes],
+                         [self._put_prio] + buf.usage(0)]
+
+                for put, n, nbytes in usage:
+
+                    full = bool(
+                            (self._max_msgs  and n      >= self._max_msgs) or
+                            (self._max_bytes and nbytes >= self._max_bytes))
+
+                    if full and put not in t_full:
+                        t_full[put] = time.time()
+                        self.throttled += 1
+                        self._poll.unregister(put)
+                        self._prof.prof('throttle_start', uid=self._uid)
+                        self._log.info('throttle putters (%d msgs, %d bytes)',
+                                       n, nbytes)
+
+                    elif not full and put in t_full:
+                        self.throttle_time += time.time() - t_full.pop(put)
+                        self._poll.register(put, zmq.POLLIN)
+                        self._prof.prof('throttle_stop', uid=self._uid)
+                        self._log.info('release putters (%d msgs, %d bytes)',
+                                       n, nbytes)
+
+                # forget idle consumers (see above)
+                now = time.time()
+                if now - t_ttl > self._ttl / 2:
+                    t_ttl = now
+                    for cid in [cid for cid, info in drain.items()
+                                if  cid not in credits
+                                and now - info['t_req'] > self._ttl]:
+                        self._log.debug('forget idle consumer %s', cid)
+                        del(drain[cid])
+
+                stats.depth     = len(buf)
+                stats.depth_b   = buf.nbytes
+                stats.consumers = len(drain)
+                stats.tick()
 
         except  Exception:
             self._log.exception('bridge failed')
 
-    def stop(self):
-        print('===', self.uid, self.nin, self.nout, self.last)
-        Bridge.stop(self)
+        finally:
+            self._stats.tick(final=True)
+            self._buf.close()
 
 
 # ------------------------------------------------------------------------------
@@ -303,13 +649,54 @@ class Putter(object):
 
     # --------------------------------------------------------------------------
     #
-    def __init__(self, channel, url, log=None, prof=None):
+    def __init__(self, channel, url, log=None, prof=None, cfg=None):
+        '''
+        The optional channel config `cfg` can specify the `codec` to use for
+        message serialization (see `codec.py`), and the buffer limits of the
+        bridge (see `Queue`).
+
+        The putter can also coalesce messages from multiple `put()` calls into
+        one bulk, which is much more efficient when sending many small
+        messages one by one.  Coalescing is enabled by any of the following
+        settings in `cfg`:
+
+          - `batch_msgs` : send when this many messages are pending
+          - `batch_bytes`: send when this many bytes are pending
+          - `batch_time` : send pending messages after this many seconds
+
+        Settings which are not specified default to 1024 messages, 1 MB and
+        1 ms, respectively.  A thread sends pending messages when `batch_time`
+        passed, and `flush()` sends them immediately.  Note that pending
+        messages are lost if the process terminates before they are sent.
+
+        With the `pool` setting, the putter leases its socket from a process
+        wide socket pool (see `context.py`), and returns it on `close()`.
+
+        With the `trace` setting `N`, the putter attaches a trace to every N-th
+        bulk it sends (see `trace.py`).
+
+        If `url` is the address of a sharded channel (see `shard.py`), the
+        putter connects to all shards, and distributes the messages over the
+        shards round-robin, or, with the `shard_by` setting, by a hash of that
+        message entry.  Coalescing cannot be combined with `shard_by`.
+        '''
+
+        if not cfg:
+            cfg = dict()
 
         self._channel  = channel
         self._url      = as_string(url)
         self._log      = log
         self._prof     = prof
         self._lock     = mt.Lock()
+        self._codec    = get_codec(cfg=cfg)
+        self._batching = bool(cfg.get('batch_msgs')  or
+                              cfg.get('batch_bytes') or
+                              cfg.get('batch_time'))
+        self._sample   = int(cfg.get('trace') or 0)
+        self._n_bulks  = 0
+        self._shard_by = cfg.get('shard_by')
+        self._idx      = 0
 
         self._uid      = generate_id('%s.put.%%(counter)04d' % self._channel,
                                      ID_CUSTOM)
@@ -325,11 +712,46 @@ class Putter(object):
 
         self._log.info('connect put to %s: %s'  % (self._channel, self._url))
 
-        self._ctx      = zmq.Context()  # rely on GC for destruction
-        self._q        = self._ctx.socket(zmq.PUSH)
-        self._q.linger = _LINGER_TIMEOUT
-        self._q.hwm    = _HIGH_WATER_MARK
-        self._q.connect(self._url)
+        self._hwm  = _HIGH_WATER_MARK
+        self._pool = bool(cfg.get('pool'))
+        if _bounded(cfg):
+            self._hwm = _BOUNDED_HWM
+
+        if self._shard_by and self._batching and ',' in self._url:
+            raise ValueError('coalescing does not support shard_by')
+
+        # one socket per shard (see `shard.py`).  Sockets for priority messages
+        # are connected on their first use (see `Queue`).
+        self._leases = list()
+        self._qs     = list()
+        self._prios  = list()       # priority sockets of the shards
+        self._urls   = list()       # priority addresses of the shards
+        for url in self._url.split(','):
+
+            url, url_prio = split_url(url, _PRIO_QUERY)
+
+            self._qs.append(self._connect(url))
+            self._prios.append(None)
+            self._urls.append(url_prio)
+
+        self._q = self._qs[0]
+
+        if self._batching:
+
+            self._batch_msgs  = cfg.get('batch_msgs')  or _BATCH_MSGS
+            self._batch_bytes = cfg.get('batch_bytes') or \
+                                _BATCH_BYTES * 1024 * 1024
+            self._batch_time  = cfg.get('batch_time')  or _BATCH_TIME / 1000
+
+            self._batch   = list()       # encoded messages
+            self._nbytes  = 0            # bytes in batch
+            self._t_batch = 0.0          # time of first message in batch
+            self._sending = False        # flusher sends a batch
+            self._stop    = False        # flusher should terminate
+            self._cond    = mt.Condition()
+            self._flusher = mt.Thread(target=self._flush_batches)
+            self._flusher.daemon = True
+            self._flusher.start()
 
 
     # --------------------------------------------------------------------------
@@ -352,105 +774,453 @@ class Putter(object):
 
     # --------------------------------------------------------------------------
     #
-    def put(self, msgs):
+    def put(self, msgs, block=True, timeout=None, priority=0):  # timeout: ms
+        '''
+        Send a message or a list of messages.  If the channel is bounded and the
+        bridge does not accept more messages, a blocking put waits until it
+        does (for at most `timeout` ms if a timeout is given).  `queue.Full` is
+        raised if the messages cannot be sent without blocking (or within the
+        timeout).
+
+        Messages with a higher `priority` are delivered before messages with
+        a lower priority (see `Queue`).  Messages with a non-default priority
+        are sent immediately, even if coalescing is enabled.
+        '''
 
       # from .utils import log_bulk
       # log_bulk(self._log, msgs, '-> %s' % self._channel)
-        data = msgpack.packb(msgs)
 
-        with self._lock:
-            no_intr(self._q.send, data)
+        if self._batching and not priority:
+            return self._put_batch(msgs, block, timeout)
+
+        if self._shard_by and len(self._qs) > 1:
+            return self._put_sharded(msgs, block, timeout, priority)
+
+        # messages are packed individually, so that the bridge can re-bulk them
+        # without decoding
+        frames = pack_bulk(msgs, self._codec, self._trace(), priority)
+
+        if not frames:
+            return
+
+        self._send(frames, block, timeout, priority=priority)
+
       # prof_bulk(self._prof, 'put', msgs)
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _connect(self, url):
+        '''
+        return a PUSH socket connected to the given address
+        '''
+
+        if self._pool:
+            lease = lease_socket(zmq.PUSH, url, _LINGER_TIMEOUT, self._hwm)
+            self._leases.append(lease)
+            return lease.obj
+
+        q        = get_context().socket(zmq.PUSH)
+        q.linger = _LINGER_TIMEOUT
+        q.hwm    = self._hwm
+        q.connect(select_url(url))
+
+        return q
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _trace(self):
+        '''
+        return a new trace for every `trace`-th bulk, `None` otherwise
+        '''
+
+        if not self._sample:
+            return None
+
+        self._n_bulks += 1
+        if self._n_bulks % self._sample:
+            return None
+
+        return new_trace(self._uid)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _put_sharded(self, msgs, block, timeout, priority):
+        '''
+        send each message to the shard selected by its `shard_by` entry
+        '''
+
+        bulks = dict()
+        for msg in as_list(msgs):
+            key = as_bytes(str(msg.get(self._shard_by)))
+            idx = zlib.crc32(key) % len(self._qs)
+            if idx not in bulks:
+                bulks[idx] = list()
+            bulks[idx].append(msg)
+
+        for idx, bulk in bulks.items():
+            self._send(pack_bulk(bulk, self._codec, self._trace(), priority),
+                       block, timeout, idx, priority)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _send(self, frames, block, timeout, idx=None, priority=0):
+        '''
+        Send frames to the shard with the given index, or to the next shard
+        (round-robin).  Messages with a priority above the default are sent to
+        the shard's priority socket, if it has one.
+        '''
+
+        with self._lock:
+
+            if idx is None:
+                idx       = self._idx
+                self._idx = (self._idx + 1) % len(self._qs)
+
+            q = self._qs[idx]
+
+            if priority > 0 and self._urls[idx]:
+                if not self._prios[idx]:
+                    self._prios[idx] = self._connect(self._urls[idx])
+                q = self._prios[idx]
+
+            flags = 0
+            if not block:
+                flags = zmq.NOBLOCK
+
+            elif timeout is not None:
+                if not no_intr(q.poll, flags=zmq.POLLOUT, timeout=timeout):
+                    raise queue.Full('channel %s is full' % self._channel)
+                flags = zmq.NOBLOCK
+
+            try:
+                no_intr(send_frames, q, frames, flags)
+            except zmq.Again as e:
+                raise queue.Full('channel %s is full' % self._channel) from e
+
+
+    # --------------------------------------------------------------------------
+    #
+    def put_nowait(self, msgs, priority=0):
+
+        self.put(msgs, block=False, priority=priority)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+        '''
+        send pending messages, stop the flusher thread (if coalescing is
+        enabled), and return the socket to the socket pool (or close it if it
+        is not pooled).  The putter cannot be used anymore afterwards.
+        '''
+
+        self.flush()
+
+        if self._batching and self._flusher.is_alive():
+            with self._cond:
+                self._stop = True
+                self._cond.notify_all()
+            self._flusher.join()
+
+        if self._leases:
+            for lease in self._leases:
+                release_socket(lease)
+            self._leases = list()
+        else:
+            for q in self._qs + self._prios:
+                if q:
+                    q.close()
+
+
+    def __del__(self):
+
+        # return pooled sockets if the putter is not closed explicitly
+        for lease in getattr(self, '_leases', list()):
+            release_socket(lease)
+        self._leases = list()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _put_batch(self, msgs, block, timeout):
+        '''
+        Add messages to the batch, and send the batch if it is full.  If the
+        batch cannot be sent (`queue.Full`), the given messages are removed
+        from the batch again.  A batch which would be full waits for the
+        previous batch to be sent first, so that batches are sent in order.
+        '''
+
+        encoded = [self._codec.encode(msg) for msg in as_list(msgs)]
+        nbytes  = sum([len(buf) for bufs in encoded for buf in bufs])
+
+        with self._cond:
+
+            if timeout is not None:
+                deadline = time.time() + timeout / 1000
+
+            while self._sending and \
+                    (len(self._batch) + len(encoded) >= self._batch_msgs or
+                     self._nbytes     + nbytes       >= self._batch_bytes):
+
+                if not block:
+                    raise queue.Full('channel %s is full' % self._channel)
+
+                if timeout is None:
+                    self._cond.wait()
+
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise queue.Full('channel %s is full' % self._channel)
+                    self._cond.wait(remaining)
+
+            if not self._batch:
+                self._t_batch = time.time()
+                self._cond.notify_all()
+
+            self._batch  += encoded
+            self._nbytes += nbytes
+
+            if len(self._batch) < self._batch_msgs and \
+               self._nbytes     < self._batch_bytes:
+                return
+
+            batch = self._take_batch()
+
+        try:
+            self._send_batch(batch, block, timeout)
+
+        except queue.Full:
+            # put the messages of earlier puts back in front of the batch
+            with self._cond:
+                keep          = len(batch[0]) - len(encoded)
+                self._batch   = batch[0][:keep] + self._batch
+                self._nbytes += batch[1] - nbytes
+                if self._batch:
+                    self._t_batch = batch[2]
+            raise
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _take_batch(self):
+        '''
+        Take the pending batch for sending (called with `self._cond` held).
+        Only one batch is sent at any time (`self._sending`), see
+        `_send_batch()`.
+        '''
+
+        batch = [self._batch, self._nbytes, self._t_batch, self._trace()]
+
+        self._batch   = list()
+        self._nbytes  = 0
+        self._sending = True
+
+        return batch
+
+
+    def _send_batch(self, batch, block, timeout):
+        '''
+        Send a batch taken by `_take_batch()`.  The batch is sent outside of the
+        lock, so that `put()` calls are not blocked while the bridge does not
+        accept more messages.  Puts which would need to send the next batch
+        meanwhile wait for this one to be sent (see `_put_batch()`).
+        '''
+
+        try:
+            self._send(pack_encoded(batch[0], self._codec.name, batch[3]),
+                       block, timeout)
+
+        finally:
+            with self._cond:
+                self._sending = False
+                self._cond.notify_all()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def flush(self):
+        '''
+        send all pending messages (if coalescing is enabled)
+        '''
+
+        if not self._batching:
+            return
+
+        with self._cond:
+
+            while self._sending:
+                self._cond.wait()
+
+            if not self._batch:
+                return
+
+            batch = self._take_batch()
+
+        self._send_batch(batch, True, None)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _flush_batches(self):
+        '''
+        Thread which sends messages which are pending for `batch_time`, until
+        `close()` is called.
+        '''
+
+        try:
+            while True:
+
+                with self._cond:
+
+                    if self._stop:
+                        break
+
+                    if not self._batch or self._sending:
+                        self._cond.wait()
+                        continue
+
+                    delay = self._t_batch + self._batch_time - time.time()
+                    if delay > 0:
+                        self._cond.wait(delay)
+                        continue
+
+                    batch = self._take_batch()
+
+                self._send_batch(batch, True, None)
+
+        except Exception:
+            self._log.exception('flusher died')
+
+
 # ------------------------------------------------------------------------------
 #
 class Getter(object):
 
     # instead of creating a new listener thread for each endpoint which then, on
-    # incoming messages, calls a getter callback, we only create *one*
-    # listening thread per ZMQ endpoint address and call *all* registered
-    # callbacks in that thread.  We hold those endpoints in a class dict, so
-    # that all class instances share that information
+    # incoming messages, calls a getter callback, we only register *one* socket
+    # per ZMQ endpoint address with a process wide poller thread (see
+    # `poller.py`), and call *all* registered callbacks from that thread.  We
+    # hold those endpoints in a class dict, so that all class instances share
+    # that information
     _callbacks = dict()
 
 
     # --------------------------------------------------------------------------
     #
     @staticmethod
-    def _get_nowait(url, timeout, log, prof):  # timeout in ms
+    def _request(socket, uid, prefetch, size, credit=1):
+        '''
+        grant `credit` bulks of up to `size` messages to the bridge (`0` for
+        the bridge's default size).  DEALER sockets (used when prefetching)
+        need to add the empty delimiter frame which REQ sockets add implicitly.
+        '''
 
-        info = Getter._callbacks[url]
+        req = msgpack.packb({'uid': uid, 'credit': credit, 'size': size})
 
-        with info['lock']:
+        if prefetch: no_intr(send_frames, socket, [b'', req])
+        else       : no_intr(socket.send, req)
 
-            if not info['requested']:
 
-                # send the request *once* per recieval (got lock above)
-                req = 'request %s' % info['uid']
-                no_intr(info['socket'].send, as_bytes(req))
-                info['requested'] = True
-              # prof.prof('requested')
+    # --------------------------------------------------------------------------
+    #
+    @staticmethod
+    def _recv(socket, uid, prefetch, size, tracer, codecs, sizes=None):
+        '''
+        receive a bulk from the bridge and return the decoded messages, and the
+        time the bulk was received if it was traced (`None` otherwise).  When
+        prefetching, the consumed credit is immediately replaced by a new one,
+        so that the bridge keeps `prefetch` bulks in flight.  If a `sizes` list
+        is given, the size of the received bulk (in bytes) is appended to it.
+        A `ValueError` is raised for bulks of codecs which are not in `codecs`
+        (see `codec.py`).
+        '''
 
+        frames = no_intr(recv_frames, socket)
+        t_recv = None
 
-            if no_intr(info['socket'].poll, flags=zmq.POLLIN, timeout=timeout):
+        if sizes is not None:
+            sizes.append(sum([len(frame) for frame in frames]))
 
-                data = no_intr(info['socket'].recv)
-                info['requested'] = False
+        if prefetch:
+            frames = frames[1:]  # strip the delimiter frame
+            Getter._request(socket, uid, prefetch, size)
 
-                msgs = as_string(msgpack.unpackb(data))
-              # prof_bulk(prof, 'recv', msgs)
-                return msgs
+        traces = list()
+        msgs   = unpack_bulk(frames, traces, codecs)
 
-            else:
-                return None
+        if traces:
+            t_recv = time.time()
+            tracer.record(traces, t_recv)
+
+        return msgs, t_recv
 
 
     # --------------------------------------------------------------------------
     #
     @staticmethod
-    def _listener(url, log, prof):
+    def _dispatch(url):
         '''
-        other than the pubsub listener, the queue listener will not deliver
-        an incoming message to all subscribers, but only to exactly *one*
-        subscriber.  We this perform a round-robin over all known callbacks
+        Called by the poller thread when a bulk arrives for an endpoint with
+        registered callbacks.  Other than the pubsub dispatcher, the queue
+        dispatcher will not deliver an incoming message to all subscribers, but
+        only to exactly *one* subscriber.  We thus perform a round-robin over
+        all known callbacks.  Once the bulk is delivered, the next one is
+        requested.
         '''
 
-        assert(url in Getter._callbacks)
-        time.sleep(1)
+        info = Getter._callbacks[url]
+
+        with info['lock']:
+            try:
+                msgs, t_recv = Getter._recv(info['socket'], info['uid'],
+                                            info['prefetch'], info['size'],
+                                            info['tracer'], info['codecs'])
+            except ValueError as e:
+                info['log'].error('drop bulk on %s: %s', url, e)
+                msgs, t_recv = list(), None
+            info['requested'] = bool(info['prefetch'])
 
-        prof.prof('listen_start')
-        try:
-            term = Getter._callbacks.get(url, {}).get('term')
-            idx  = 0  # round-robin cb index
-            while not term.is_set():
+        # this list is dynamic
+        callbacks = info['callbacks']
 
-                # this list is dynamic
-                callbacks = Getter._callbacks[url]['callbacks']
+        for m in as_list(msgs):
 
-                if not callbacks:
-                    time.sleep(0.01)
-                    continue
+            if not callbacks:
+                break
 
-                msg = Getter._get_nowait(url, 500, log, prof)
+            info['idx'] += 1
+            if info['idx'] >= len(callbacks):  # FIXME: lock callbacks
+                info['idx'] = 0
 
-                if msg:
-                    for m in as_list(msg):
+            cb, _lock, executor, _ = callbacks[info['idx']]
+            executor.submit(cb, [m], _lock)
+          # prof_bulk(prof, 'cb', m, msg=cb.__name__)
+
+        if t_recv:
+            info['tracer'].delivered(t_recv)
+
+        Getter._request_once(info)
+
+
+    # --------------------------------------------------------------------------
+    #
+    @staticmethod
+    def _request_once(info):
 
-                        idx += 1
-                        if idx >= len(callbacks):  # FIXME: lock callbacks
-                            idx = 0
+        with info['lock']:
 
-                        cb, _lock = callbacks[idx]
-                        if _lock:
-                            with _lock:
-                                cb(as_string(m))
-                        else:
-                            cb(as_string(m))
-                      # prof_bulk(prof, 'cb', m, msg=cb.__name__)
+            if not info['requested']:
 
-        except:
-            log.exception('listener died')
+                # send the request *once* per recieval (got lock above).  The
+                # first request of a prefetching getter grants all its credits.
+                Getter._request(info['socket'], info['uid'], info['prefetch'],
+                                info['size'], max(1, info['prefetch']))
+                info['requested'] = True
 
 
     # --------------------------------------------------------------------------
@@ -458,15 +1228,18 @@ class Getter(object):
     def _start_listener(self):
 
         # only start if needed
-        if Getter._callbacks[self._url]['thread']:
+        info = Getter._callbacks[self._url]
+        if info['poller']:
             return
 
-        t = mt.Thread(target=Getter._listener,
-                      args=[self._url, self._log, self._prof])
-        t.daemon = True
-        t.start()
+        self._prof.prof('listen_start')
+
+        Getter._request_once(info)
 
-        Getter._callbacks[self._url]['thread'] = t
+        info['poller'] = get_poller()
+        info['poller'].register(info['socket'],
+                                lambda: Getter._dispatch(self._url),
+                                self._log)
 
 
     # --------------------------------------------------------------------------
@@ -474,29 +1247,50 @@ class Getter(object):
     def _stop_listener(self, force=False):
 
         # only stop listener if no callbacks remain registered (unless forced)
-        if force or not Getter._callbacks[self._url]['callbacks']:
-            if  Getter._callbacks[self._url]['thread']:
-                Getter._callbacks[self._url]['term'  ].set()
-                Getter._callbacks[self._url]['thread'].join()
-                Getter._callbacks[self._url]['term'  ].unset()
-                Getter._callbacks[self._url]['thread'] = None
+        info = Getter._callbacks[self._url]
+        if force or not info['callbacks']:
+            if info['poller']:
+                info['poller'].unregister(info['socket'])
+                info['poller'] = None
 
 
     # --------------------------------------------------------------------------
     #
-    def __init__(self, channel, url, cb=None, log=None, prof=None):
+    def __init__(self, channel, url, cb=None, log=None, prof=None, cfg=None):
         '''
-        When a callback `cb` is specified, then the Getter c'tor will spawn
-        a separate thread which continues to listen on the channel, and the
+        When a callback `cb` is specified, then the Getter c'tor will register
+        the channel with the process' poller thread (see `poller.py`), and the
         cb is invoked on any incoming message.  The message will be the only
         argument to the cb.
+
+        The optional channel config `cfg` can specify `prefetch` (int): if set
+        to a value larger than zero, the getter will keep that many bulks
+        requested from the bridge at any time (see class documentation).  It
+        can also specify `bulk_size` (int), the maximum number of messages the
+        getter wants to receive per bulk, and the codecs the getter decodes
+        besides the safe ones (`codec`, `codecs`, see `codec.py`).
+
+        Traces attached to received bulks are collected in latency histograms
+        (see `trace_stats()`), and are recorded as events to the profiler (if
+        it is enabled).
+
+        If `url` is the address of a sharded channel (see `shard.py`), the
+        getter uses one getter per shard, requests messages from all shards,
+        and returns the received bulks round-robin over the shards.  Callbacks
+        are registered with all shards.
         '''
 
+        if not cfg:
+            cfg = dict()
+
         self._channel   = channel
         self._url       = as_string(url)
         self._lock      = mt.Lock()
         self._log       = log
         self._prof      = prof
+        self._prefetch  = int(cfg.get('prefetch')  or 0)
+        self._size      = int(cfg.get('bulk_size') or 0)
+        self._codecs    = get_decoders(cfg)
         self._uid       = generate_id('%s.get.%%(counter)04d' % self._channel,
                                       ID_CUSTOM)
 
@@ -510,31 +1304,79 @@ class Getter(object):
         if 'hb' in self._uid or 'heartbeat' in self._uid:
             self._prof.disable()
 
+        self._tracer    = Tracer(self._uid, self._prof)
+        self._shards    = list()
+
         self._log.info('connect get to %s: %s'  % (self._channel, self._url))
 
+        if ',' in self._url:
+
+            # sharded channel: delegate to one getter per shard
+            for url in self._url.split(','):
+                self._shards.append(Getter(channel, url, log=self._log,
+                                           prof=self._prof, cfg=cfg))
+
+            self._idx   = 0
+            self._owned = dict()       # executors created for callbacks
+            self._poll  = zmq.Poller()
+            for shard in self._shards:
+                self._poll.register(shard._q, zmq.POLLIN)
+
+            if cb:
+                self.subscribe(cb)
+            else:
+                self._interactive = True
+
+            return
+
         self._requested = False          # send/recv sync
-        self._ctx       = zmq.Context()  # rely on GC for destruction
-        self._q         = self._ctx.socket(zmq.REQ)
-        self._q.linger  = _LINGER_TIMEOUT
-        self._q.hwm     = _HIGH_WATER_MARK
-        self._q.connect(self._url)
-
-        if url not in Getter._callbacks:
-
-            Getter._callbacks[url] = {'uid'      : self._uid,
-                                      'socket'   : self._q,
-                                      'channel'  : self._channel,
-                                      'lock'     : mt.Lock(),
-                                      'term'     : mt.Event(),
-                                      'requested': self._requested,
-                                      'thread'   : None,
-                                      'callbacks': list()}
+        self._ctx       = get_context()
+
+        # Callbacks are served from the socket registered for the endpoint, so
+        # a getter with callbacks for an endpoint which is already registered
+        # does not need its own socket.  Credits are only granted on the first
+        # request (see `_request_bulk()`), so that no bulks are pushed to
+        # a socket which is never read.
+        if cb and self._url in Getter._callbacks:
+            self._q = Getter._callbacks[self._url]['socket']
+        else:
+            self._q = self._connect()
+
+        if self._url not in Getter._callbacks:
+
+            Getter._callbacks[self._url] = {'uid'      : self._uid,
+                                            'socket'   : self._q,
+                                            'channel'  : self._channel,
+                                            'lock'     : mt.Lock(),
+                                            'requested': self._requested,
+                                            'prefetch' : self._prefetch,
+                                            'size'     : self._size,
+                                            'tracer'   : self._tracer,
+                                            'codecs'   : set(self._codecs),
+                                            'log'      : self._log,
+                                            'poller'   : None,
+                                            'idx'      : 0,
+                                            'callbacks': list()}
         if cb:
             self.subscribe(cb)
         else:
             self._interactive = True
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _connect(self):
+
+        if self._prefetch: q = self._ctx.socket(zmq.DEALER)
+        else             : q = self._ctx.socket(zmq.REQ)
+
+        q.linger = _LINGER_TIMEOUT
+        q.hwm    = _HIGH_WATER_MARK
+        q.connect(select_url(self._url))
+
+        return q
+
+
     # --------------------------------------------------------------------------
     #
     def __str__(self):
@@ -555,17 +1397,31 @@ class Getter(object):
 
     # --------------------------------------------------------------------------
     #
-    def subscribe(self, cb, lock=None):
+    def subscribe(self, cb, lock=None, executor=None):
+
+        if self._shards:
+            # all shards share the executor (if it is created here)
+            executor, owned = get_executor(executor, self._log)
+            for shard in self._shards:
+                shard.subscribe(cb, lock, executor)
+            if owned:
+                self._owned[cb] = executor
+            self._interactive = False
+            return
 
-        # if we need to serve callbacks, then open a thread to watch the socket
-        # and register the callbacks.  If a thread is already runnning on that
-        # channel, just register the callback.
+        # if we need to serve callbacks, then register the socket with the
+        # poller thread and register the callbacks.  If the socket is already
+        # registered, just register the callback.
         #
-        # Note that once a thread is watching a socket, we cannot allow to use
+        # Note that once the poller is watching a socket, we cannot allow to use
         # `get()` and `get_nowait()` anymore, as those will interfere with the
-        # thread consuming the messages,
+        # poller consuming the messages,
         #
         # The given lock (if any) is used to shield concurrent cb invokations.
+        # The given executor specifies how the callback is invoked (see
+        # `executor.py`, default: in the poller thread).  Messages are
+        # distributed round-robin over all callbacks registered for the channel
+        # in this process.
         #
         # FIXME: clean up lock usage - see self._lock
 
@@ -575,17 +1431,33 @@ class Getter(object):
                                             'socket'   : self._q,
                                             'channel'  : self._channel,
                                             'lock'     : mt.Lock(),
-                                            'term'     : mt.Event(),
                                             'requested': self._requested,
-                                            'thread'   : None,
+                                            'prefetch' : self._prefetch,
+                                            'size'     : self._size,
+                                            'tracer'   : self._tracer,
+                                            'codecs'   : set(self._codecs),
+                                            'log'      : self._log,
+                                            'poller'   : None,
+                                            'idx'      : 0,
                                             'callbacks': list()}
 
-        # we allow only one cb per queue getter process at the moment, until we
-        # have more clarity on the RR behavior of concurrent callbacks.
-        if Getter._callbacks[self._url]['callbacks']:
-            raise RuntimeError('multiple callbacks not supported')
+        # callbacks are served from the registered socket only - drop our own
+        # socket (and with it any credits it granted) if it is not that one
+        info = Getter._callbacks[self._url]
+        if self._q is not info['socket']:
+            self._q.close()
+            self._q = info['socket']
+
+        # the socket decodes the codecs enabled by any of its getters
+        info['codecs'].update(self._codecs)
 
-        Getter._callbacks[self._url]['callbacks'].append([cb, lock])
+        executor, owned = get_executor(executor, self._log)
+
+        if lock and not executor.support_locks:
+            raise ValueError('%s executor does not support locks'
+                            % executor.name)
+
+        info['callbacks'].append([cb, lock, executor, owned])
 
         self._interactive = False
         self._start_listener()
@@ -595,19 +1467,72 @@ class Getter(object):
     #
     def unsubscribe(self, cb):
 
+        if self._shards:
+            for shard in self._shards:
+                shard.unsubscribe(cb)
+            if cb in self._owned:
+                self._owned.pop(cb).stop()
+            return
+
         if self._url in Getter._callbacks:
-            for _cb, _lock in Getter._callbacks[self._url]['callbacks']:
-                if cb == _cb:
-                    Getter._callbacks[self._url]['callbacks'].remove([_cb, _lock])
+            callbacks = Getter._callbacks[self._url]['callbacks']
+            for entry in callbacks:
+                if cb == entry[0]:
+                    callbacks.remove(entry)
+                    if entry[3]:
+                        entry[2].stop()
                     break
 
         self._stop_listener()
 
 
+    # --------------------------------------------------------------------------
+    #
+    def cb_stats(self):
+        '''
+        return a list of `[cb, stats]` pairs for all callbacks registered for
+        this channel, where `stats` are the executor metrics of the callback
+        (see `executor.py`).
+        '''
+
+        if self._shards:
+            return [entry for shard in self._shards
+                          for entry in shard.cb_stats()]
+
+        if self._url not in Getter._callbacks:
+            return list()
+
+        return [[entry[0], entry[2].stats]
+                for entry in Getter._callbacks[self._url]['callbacks']]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def trace_stats(self):
+        '''
+        return the latency histograms of the traced bulks received by this
+        getter (or by the callbacks registered for this channel, see
+        `trace.py`)
+        '''
+
+        if self._shards:
+            return [shard.trace_stats() for shard in self._shards]
+
+        if not self._interactive and self._url in Getter._callbacks:
+            return Getter._callbacks[self._url]['tracer'].as_dict()
+
+        return self._tracer.as_dict()
+
+
     # --------------------------------------------------------------------------
     #
     def stop(self):
 
+        if self._shards:
+            for shard in self._shards:
+                shard.stop()
+            return
+
         self._stop_listener(force=True)
 
 
@@ -618,23 +1543,23 @@ class Getter(object):
         if not self._interactive:
             raise RuntimeError('invalid get(): callbacks are registered')
 
-        if not self._requested:
-            req = 'Request %s' % self._uid
+        if self._shards:
+            return self._get_shards(None)
 
-            with self._lock:
-                no_intr(self._q.send, as_bytes(req))
-                self._requested = True
+        self._request_bulk()
 
-          # self._prof.prof('requested')
+      # self._prof.prof('requested')
 
         with self._lock:
-            data = no_intr(self._q.recv)
-            self._requested = False
+            try:
+                msgs, _ = Getter._recv(self._q, self._uid, self._prefetch,
+                                       self._size, self._tracer, self._codecs)
+            finally:
+                self._requested = bool(self._prefetch)
 
-        msgs = msgpack.unpackb(data)
       # prof_bulk(self._prof, 'get', msgs)
 
-        return as_string(msgs)
+        return msgs
 
 
     # --------------------------------------------------------------------------
@@ -644,31 +1569,146 @@ class Getter(object):
         if not self._interactive:
             raise RuntimeError('invalid get(): callbacks are registered')
 
-        if not self._requested:
-
-            # send the request *once* per recieval (got lock above)
-            req = 'request %s' % self._uid
-
-            with self._lock:  # need to protect self._requested
-                no_intr(self._q.send, as_bytes(req))
-                self._requested = True
+        if self._shards:
+            return self._get_shards(timeout)
 
-          # self._prof.prof('requested')
+        self._request_bulk()
 
+      # self._prof.prof('requested')
 
         if no_intr(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
 
             with self._lock:
-                data = no_intr(self._q.recv)
-                self._requested = False
+                try:
+                    msgs, _ = Getter._recv(self._q, self._uid, self._prefetch,
+                                           self._size, self._tracer,
+                                           self._codecs)
+                finally:
+                    self._requested = bool(self._prefetch)
 
-            msgs = msgpack.unpackb(data)
           # prof_bulk(self._prof, 'get_nowait', msgs)
-            return as_string(msgs)
+            return msgs
 
         else:
             return None
 
 
-# ------------------------------------------------------------------------------
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk(self, max_msgs=None, max_bytes=None, timeout=None):
+        '''
+        Wait up to `timeout` ms (`None`: forever) for messages, and return all
+        messages which are then available as flat list (an empty list if none
+        arrived in time).  Draining stops once `max_msgs` messages or
+        `max_bytes` bytes are received.  Limits are checked per bulk, so the
+        result can exceed them by one bulk.
+
+        Getters without prefetching only have one bulk in flight (of up to
+        `bulk_size` messages, see `__init__()`), getters with prefetching also
+        drain all further bulks which are already received by the socket.
+        '''
+
+        if not self._interactive:
+            raise RuntimeError('invalid get_bulk(): callbacks are registered')
+
+        msgs  = list()
+        sizes = list()
+
+        if self._shards:
+
+            # wait for any shard to have messages, then drain the shards
+            # round-robin
+            for shard in self._shards:
+                shard._request_bulk()
 
+            if no_intr(self._poll.poll, timeout=timeout):
+                for _ in range(len(self._shards)):
+                    shard     = self._shards[self._idx]
+                    self._idx = (self._idx + 1) % len(self._shards)
+                    shard._get_bulk(msgs, sizes, max_msgs, max_bytes, 0)
+
+            return msgs
+
+        self._request_bulk()
+        self._get_bulk(msgs, sizes, max_msgs, max_bytes, timeout)
+
+      # prof_bulk(self._prof, 'get_bulk', msgs)
+
+        return msgs
+
+
+    def _get_bulk(self, msgs, sizes, max_msgs, max_bytes, timeout):
+        '''
+        add the drained messages to `msgs`, and their bulk sizes to `sizes`
+        '''
+
+        def _full():
+            return (max_msgs  and len(msgs)  >= max_msgs) or \
+                   (max_bytes and sum(sizes) >= max_bytes)
+
+        if _full():
+            return
+
+        if not no_intr(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
+            return
+
+        with self._lock:
+
+            while True:
+
+                try:
+                    bulk, _ = Getter._recv(self._q, self._uid, self._prefetch,
+                                           self._size, self._tracer,
+                                           self._codecs, sizes)
+                finally:
+                    self._requested = bool(self._prefetch)
+                msgs.extend(bulk)
+
+                # without prefetching, no further bulk is in flight
+                if not self._prefetch or _full():
+                    break
+
+                if not no_intr(self._q.poll, flags=zmq.POLLIN, timeout=0):
+                    break
+
+
+    def _request_bulk(self):
+        '''
+        send the request *once* per recieval.  The first request of
+        a prefetching getter grants all its credits, which are then renewed on
+        each recv.
+        '''
+
+        with self._lock:
+            if not self._requested:
+                Getter._request(self._q, self._uid, self._prefetch, self._size,
+                                max(1, self._prefetch))
+                self._requested = True
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _get_shards(self, timeout):  # timeout in ms
+        '''
+        Make sure that all shards have messages requested, and return the next
+        bulk, checking the shards round-robin.  Bulks received from the other
+        shards are returned by later calls.
+        '''
+
+        for shard in self._shards:
+            shard._request_bulk()
+
+        events = dict(no_intr(self._poll.poll, timeout=timeout))
+
+        for _ in range(len(self._shards)):
+
+            shard     = self._shards[self._idx]
+            self._idx = (self._idx + 1) % len(self._shards)
+
+            if shard._q in events:
+                return shard.get_nowait(timeout=0)
+
+        return None
+
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,562 @@
+
+import zmq
+import time
+import heapq
+import struct
+import traceback
+
+import threading          as mt
+import concurrent.futures as cf
+
+from ..config  import Config
+from ..ids     import generate_id, ID_CUSTOM
+from ..url     import Url
+from ..misc    import get_hostip, is_string, as_string
+from ..logger  import Logger
+from ..profile import Profiler
+
+from .bridge   import Bridge
+from .codec    import get_codec, get_decoders
+from .context  import get_context
+from .transport import bind_local, local_query, select_url
+from .executor import InlineExecutor, ThreadExecutor
+from .poller   import get_poller
+from .utils    import no_intr, send_frames, recv_frames
+from .utils    import pack_bulk, unpack_bulk
+
+
+# ------------------------------------------------------------------------------
+#
+# A `Server` answers requests sent by any number of `Client` endpoints:
+#
+#     server = ru.zmq.Server('my_service')
+#     server.register('add', lambda a, b: a + b)
+#     server.start()
+#
+#     client = ru.zmq.Client('my_service', server.addr)
+#     assert(client.request('add', [1, 2]) == 3)
+#
+# Clients use a DEALER socket, the server a ROUTER socket, so that replies are
+# routed to the requesting client only, and a client can have any number of
+# requests in flight: `Client.submit()` returns a future for each request, and
+# replies are matched to their requests by request ID, in whatever order they
+# arrive.  Requests and replies are encoded like queue messages (see
+# `utils.pack_bulk()`), with the codec of the sending endpoint:
+#
+#     request: {'id': <int>, 'cmd': <str>, 'args': <list>, 'kwargs': <dict>,
+#               'timeout': <ms>}
+#     reply  : {'id': <int>, 'res': <result>}
+#           or {'id': <int>, 'err': <error message>, 'exc': <traceback>}
+#
+# As for other channels, requests and replies are only decoded if the receiving
+# end accepts their codec (see `codec.get_decoders()`).  The server drops
+# requests it cannot decode.
+#
+# The server thread only receives requests and sends replies: handlers are
+# called by a pool of `workers` threads (server config setting, default 4, and
+# `0` calls the handlers in the server thread), which return their replies to
+# the server thread via a single inproc socket.  Like bridges, servers count
+# requests and replies, and the reply latency (see `stats.py`).
+#
+# Requests can have a timeout (in ms): the client fails the request's future
+# with a `concurrent.futures.TimeoutError` when no reply arrived in time, and
+# ignores a late reply.  The server does not call the handler of a request which
+# waited longer than its timeout for a worker.
+#
+_LINGER_TIMEOUT  =   250  # ms to linger after close
+_HIGH_WATER_MARK =     0  # number of messages to buffer before dropping
+_POLL_TIMEOUT    =   500  # ms to wait for events before checking termination
+_WORKERS         =     4  # number of handler threads
+
+_STAMP = struct.Struct('<d')
+
+
+# ------------------------------------------------------------------------------
+#
+class Server(Bridge):
+
+    def __init__(self, cfg=None, channel=None):
+        '''
+        The server is configured like a bridge (see `Queue`), and additionally
+        accepts the settings `workers` (number of handler threads, see above),
+        `codec` (the codec used to encode replies, see `codec.py`) and `codecs`
+        (further codecs to accept for requests, see `codec.get_decoders()`).
+        '''
+
+        if cfg and not channel and is_string(cfg):
+            channel = cfg
+            cfg     = None
+
+        if   cfg    : cfg = Config(cfg=cfg)
+        elif channel: cfg = Config(cfg={'channel': channel})
+        else: raise RuntimeError('Server needs cfg or channel parameter')
+
+        if not cfg.channel:
+            raise ValueError('no channel name provided for server')
+
+        if not cfg.uid:
+            cfg.uid = generate_id('%s.server.%%(counter)04d' % cfg.channel,
+                                  ID_CUSTOM)
+
+        self._handlers = dict()
+
+        super(Server, self).__init__(cfg)
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def name(self):
+        return self._uid
+
+    @property
+    def uid(self):
+        return self._uid
+
+    @property
+    def addr(self):
+        return self._addr
+
+    @property
+    def addrs(self):
+        # all addresses, including local transports
+        return self._addrs
+
+
+    # --------------------------------------------------------------------------
+    #
+    def register(self, cmd, handler):
+        '''
+        Call `handler(*args, **kwargs)` for requests of the given command, and
+        reply with its return value (or with the exception it raised).
+        '''
+
+        self._handlers[cmd] = handler
+
+
+    def unregister(self, cmd):
+
+        self._handlers.pop(cmd, None)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _bridge_initialize(self):
+
+        self._log.info('start server %s', self._uid)
+
+        self._codec  = get_codec(cfg=self._cfg)
+        self._codecs = get_decoders(self._cfg)
+
+        self._ctx           = get_context()
+        self._router        = self._ctx.socket(zmq.ROUTER)
+        self._router.linger = _LINGER_TIMEOUT
+        self._router.hwm    = _HIGH_WATER_MARK
+        self._router.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self._router.bind('tcp://*:*')
+
+        self._addr      = Url(as_string(
+                                 self._router.getsockopt(zmq.LAST_ENDPOINT)))
+        self._addr.host = get_hostip()
+
+        # clients on this node find the ipc transport via the address
+        local            = bind_local(self._router, self._uid, self._addr.port,
+                                      self._log)
+        self._addr.query = '&'.join(local_query(self._uid))
+        self._addrs      = [str(self._addr)] + local
+
+        # handler threads return their replies via this socket pair, and
+        # serialize their access to the sending end
+        self._replies         = self._ctx.socket(zmq.PULL)
+        self._replies.linger  = _LINGER_TIMEOUT
+        self._replies.hwm     = _HIGH_WATER_MARK
+        self._replies.bind('inproc://%s.replies' % self._uid)
+
+        self._reply_lock      = mt.Lock()
+        self._reply           = self._ctx.socket(zmq.PUSH)
+        self._reply.linger    = _LINGER_TIMEOUT
+        self._reply.hwm       = _HIGH_WATER_MARK
+        self._reply.connect('inproc://%s.replies' % self._uid)
+
+        self._log.info('server %s: %s', self._uid, self._addrs)
+
+        self._poll = zmq.Poller()
+        self._poll.register(self._router,  zmq.POLLIN)
+        self._poll.register(self._replies, zmq.POLLIN)
+
+        workers = self._cfg.get('workers')
+        if workers is None:
+            workers = _WORKERS
+
+        if workers: self._executor = ThreadExecutor({'threads': workers},
+                                                    self._log)
+        else      : self._executor = InlineExecutor({}, self._log)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _bridge_work(self):
+
+        # Requests are decoded here and handed to the executor, replies are
+        # passed through to the requesting client.  Reply frames are preceded
+        # by the time the request was received, to measure the reply latency.
+
+        try:
+
+            stats   = self._stats
+            clients = set()
+
+            while not self._term.is_set():
+
+                events = dict(no_intr(self._poll.poll, timeout=_POLL_TIMEOUT))
+
+                if self._router in events:
+
+                    frames = no_intr(recv_frames, self._router)
+                    t_recv = time.time()
+                    cid    = frames[0].bytes
+
+                    try:
+                        reqs = unpack_bulk(frames[2:], codecs=self._codecs)
+                    except Exception as e:
+                        # malformed frames do not raise `ValueError` only
+                        self._log.error('drop request from %s: %s', cid, e)
+                        reqs = list()
+
+                    if reqs:
+                        stats.received(len(reqs),
+                                       sum([len(f) for f in frames[2:]]))
+
+                        if cid not in clients:
+                            clients.add(cid)
+                            stats.consumers = len(clients)
+
+                    for req in reqs:
+
+                        if not isinstance(req, dict):
+                            self._log.error('drop invalid request from %s: %s',
+                                            cid, type(req).__name__)
+                            continue
+
+                        self._executor.submit(self._handle, [cid, req, t_recv])
+
+                if self._replies in events:
+
+                    frames = no_intr(recv_frames, self._replies)
+                    t_recv = _STAMP.unpack(frames[0].bytes)[0]
+
+                    try:
+                        no_intr(send_frames, self._router, frames[1:])
+
+                    except zmq.ZMQError as e:
+                        if e.errno != zmq.EHOSTUNREACH:
+                            raise
+                        # client is gone - drop the reply
+                        self._log.warn('lost client %s', frames[1].bytes)
+                        clients.discard(frames[1].bytes)
+                        stats.consumers = len(clients)
+                        continue
+
+                    stats.sent(1, sum([len(f) for f in frames[3:]]),
+                               latency=time.time() - t_recv)
+
+                stats.tick()
+
+        except  Exception:
+            self._log.exception('server failed')
+
+        finally:
+            self._stats.tick(final=True)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle(self, cid, req, t_recv):
+        '''
+        call the handler of a request (in a worker thread), and return the
+        reply to the server thread
+        '''
+
+        rid = None
+        cmd = None
+
+        try:
+            rid     = req.get('id')
+            cmd     = req.get('cmd')
+            timeout = req.get('timeout')
+
+            if timeout and time.time() - t_recv > timeout / 1000:
+                self._log.debug('request %s expired (%s)', rid, cmd)
+                return
+
+            handler = self._handlers.get(cmd)
+            if not handler:
+                raise ValueError('unknown command %s' % cmd)
+
+            res    = handler(*(req.get('args') or []),
+                             **(req.get('kwargs') or {}))
+            frames = pack_bulk([{'id': rid, 'res': res}], self._codec)
+
+        except Exception as e:
+            self._log.exception('request %s failed (%s)', rid, cmd)
+            err    = '%s: %s' % (type(e).__name__, e)
+            frames = pack_bulk([{'id' : rid, 'err': err,
+                                 'exc': traceback.format_exc()}], self._codec)
+
+        with self._reply_lock:
+
+            if self._reply.closed:
+                self._log.debug('drop reply %s (%s): stopped', rid, cmd)
+                return
+
+            no_intr(send_frames, self._reply,
+                    [_STAMP.pack(t_recv), cid, b''] + frames)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self, timeout=None):
+
+        super(Server, self).stop(timeout)
+        self._executor.stop()
+
+        # handlers which are still running drop their replies
+        with self._reply_lock:
+            self._reply.close()
+
+
+# ------------------------------------------------------------------------------
+#
+class Client(object):
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, channel, url, log=None, prof=None, cfg=None):
+        '''
+        The optional channel config `cfg` can specify the `codec` to use for
+        request serialization (see `codec.py`), further `codecs` to accept for
+        replies (see `codec.get_decoders()`), and a default `timeout` (in ms)
+        for all requests.
+
+        Replies are received by the process' poller thread (see `poller.py`),
+        which resolves the futures of the respective requests.
+        '''
+
+        if not cfg:
+            cfg = dict()
+
+        self._channel  = channel
+        self._url      = as_string(url)
+        self._log      = log
+        self._prof     = prof
+        self._codec    = get_codec(cfg=cfg)
+        self._codecs   = get_decoders(cfg)
+        self._timeout  = cfg.get('timeout')
+
+        self._uid      = generate_id('%s.client.%%(counter)04d' % self._channel,
+                                     ID_CUSTOM)
+        if not self._log:
+            self._log  = Logger(name=self._uid, ns='radical.utils')
+
+        if not self._prof:
+            self._prof = Profiler(name=self._uid, ns='radical.utils')
+            self._prof.disable()
+
+        self._log.info('connect client to %s: %s', self._channel, self._url)
+
+        self._lock     = mt.Lock()       # protects the socket
+        self._cond     = mt.Condition()  # protects requests and deadlines
+        self._rid      = 0
+        self._pending  = dict()          # request id: future
+        self._expiry   = list()          # heap of [deadline, request id]
+        self._reaper   = None
+        self._closed   = False
+
+        self._sock        = get_context().socket(zmq.DEALER)
+        self._sock.linger = _LINGER_TIMEOUT
+        self._sock.hwm    = _HIGH_WATER_MARK
+        self._sock.connect(select_url(self._url))
+
+        self._poller = get_poller()
+        self._poller.register(self._sock, self._dispatch, self._log)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __str__(self):
+        return 'Client(%s @ %s)'  % (self.channel, self._url)
+
+    @property
+    def name(self):
+        return self._uid
+
+    @property
+    def uid(self):
+        return self._uid
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @property
+    def pending(self):
+        '''
+        number of requests in flight
+        '''
+        return len(self._pending)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def submit(self, cmd, args=None, kwargs=None, timeout=None):  # timeout: ms
+        '''
+        Send a request and return a `concurrent.futures.Future` for its result.
+        The future fails with a `RuntimeError` if the handler raised an
+        exception, and with a `concurrent.futures.TimeoutError` if no reply
+        arrived within `timeout` ms (default: the client's `timeout` setting,
+        `None`: wait forever).
+        '''
+
+        if timeout is None:
+            timeout = self._timeout
+
+        future = cf.Future()
+        future.set_running_or_notify_cancel()   # requests cannot be cancelled
+
+        with self._cond:
+
+            if self._closed:
+                raise RuntimeError('client %s is closed' % self._uid)
+
+            self._rid += 1
+            rid = self._rid
+            self._pending[rid] = future
+
+            if timeout:
+                heapq.heappush(self._expiry, [time.time() + timeout / 1000,
+                                              rid])
+                if not self._reaper:
+                    self._reaper = mt.Thread(target=self._expire)
+                    self._reaper.daemon = True
+                    self._reaper.start()
+                self._cond.notify()
+
+        req    = {'id'     : rid,
+                  'cmd'    : cmd,
+                  'args'   : list(args   or []),
+                  'kwargs' : dict(kwargs or {}),
+                  'timeout': timeout}
+        frames = pack_bulk([req], self._codec)
+
+        with self._lock:
+            no_intr(send_frames, self._sock, [b''] + frames)
+
+        return future
+
+
+    # --------------------------------------------------------------------------
+    #
+    def request(self, cmd, args=None, kwargs=None, timeout=None):  # timeout: ms
+        '''
+        Send a request and wait for its result (see `submit()`).
+        '''
+
+        return self.submit(cmd, args, kwargs, timeout).result()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _dispatch(self):
+        '''
+        Called by the poller thread when a reply arrives: resolve the future of
+        the respective request.  Replies to expired requests are ignored.
+        '''
+
+        with self._lock:
+            try:
+                frames = no_intr(recv_frames, self._sock, flags=zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+        try:
+            reps = unpack_bulk(frames[1:], codecs=self._codecs)
+        except ValueError as e:
+            self._log.error('drop reply on %s: %s', self._url, e)
+            return
+
+        for rep in reps:
+
+            with self._cond:
+                future = self._pending.pop(rep.get('id'), None)
+
+            if not future:
+                self._log.debug('ignore late reply %s', rep.get('id'))
+                continue
+
+            if 'err' in rep:
+                self._log.debug('request %s failed: %s', rep.get('id'),
+                                rep.get('exc'))
+                future.set_exception(RuntimeError(rep['err']))
+            else:
+                future.set_result(rep.get('res'))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _expire(self):
+        '''
+        fail the futures of requests whose timeout passed
+        '''
+
+        while True:
+
+            expired = list()
+
+            with self._cond:
+
+                if self._closed:
+                    break
+
+                now = time.time()
+                while self._expiry and self._expiry[0][0] <= now:
+                    _, rid = heapq.heappop(self._expiry)
+                    future = self._pending.pop(rid, None)
+                    if future:
+                        expired.append([rid, future])
+
+                if not expired:
+                    if self._expiry: self._cond.wait(self._expiry[0][0] - now)
+                    else           : self._cond.wait()
+
+            for rid, future in expired:
+                future.set_exception(cf.TimeoutError('request %d timed out'
+                                                     % rid))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+        '''
+        Stop receiving replies, and fail all pending requests with
+        a `RuntimeError`.  The client cannot be used anymore afterwards.
+        '''
+
+        with self._cond:
+            if self._closed:
+                return
+            self._closed  = True
+            pending       = list(self._pending.values())
+            self._pending = dict()
+            self._cond.notify()
+
+        self._poller.unregister(self._sock)
+
+        for future in pending:
+            future.set_exception(RuntimeError('client %s closed' % self._uid))
+
+        with self._lock:
+            self._sock.close()
+
+
+# ------------------------------------------------------------------------------
+
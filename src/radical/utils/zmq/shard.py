@@ -0,0 +1,377 @@
+
+import multiprocessing as mp
+import threading       as mt
+
+from ..config  import Config
+from ..ids     import generate_id, ID_CUSTOM
+from ..misc    import is_string
+from ..url     import Url
+
+from .bridge   import Bridge
+from .queue    import Queue
+from .stats    import Histogram
+from .transport import unbind_local
+
+
+# ------------------------------------------------------------------------------
+#
+# A single `Queue` bridge is limited by the performance of its bridge thread.
+# A `ShardedQueue` serves one logical channel with `shards` independent `Queue`
+# bridges (*shards*), which run in separate processes (default) or, with the
+# config setting `shard_mode: thread`, as threads of the calling process.  Note
+# that thread shards share the GIL and thus only help if the bridge threads
+# mostly wait for I/O.
+#
+# The addresses of a sharded channel (`addr_put`, `addr_get`) are `Url`s as for
+# `Queue`, which hold the comma separated addresses of all shards.  `Putter`
+# and `Getter` endpoints given such an address connect to all shards:
+#
+#   - putters send their bulks round-robin to the shards.  With the channel
+#     config setting `shard_by` (e.g., `uid`), messages are instead routed by
+#     a hash of that message entry, so that all messages with the same key pass
+#     the same shard and thus remain in order.  Otherwise, messages of the same
+#     putter can overtake each other on different shards.
+#   - getters request messages from all shards, and consume them from the
+#     shards round-robin.
+#
+# The counters of all shards are summed up in the counters of the sharded
+# bridge (see `stats`), and those are reported periodically as for any other
+# bridge (see `stats.py`) - shards do not report on their own.
+#
+# `Bridge.create()` creates a `ShardedQueue` for `queue` configs with more than
+# one shard.
+#
+_SHARDS  =  4   # default number of shards
+_TIMEOUT = 30   # seconds to wait for a shard process to respond
+_STOP    =  3   # seconds to wait for a shard process to stop before killing it
+
+
+# ------------------------------------------------------------------------------
+#
+def _run_shard(cfg, conn):
+    '''
+    run a shard bridge in a child process, controlled via a pipe
+    '''
+
+    bridge = Queue(cfg)
+    bridge.start()
+
+    conn.send([str(bridge.addr_put), str(bridge.addr_get)])
+
+    while True:
+
+        try:
+            cmd = conn.recv()
+        except EOFError:
+            break
+
+        if cmd == 'stats':
+            conn.send(bridge.stats)
+        else:
+            break
+
+    bridge.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+class ShardedQueue(Bridge):
+
+    def __init__(self, cfg=None, channel=None):
+        '''
+        Create a sharded queue channel (see above).  The config is the same as
+        for `Queue`, plus `shards` (number of shards) and `shard_mode`
+        (`process` or `thread`).  All other settings apply to each shard.
+        '''
+
+        if cfg and not channel and is_string(cfg):
+            channel = cfg
+            cfg     = None
+
+        if   cfg    : cfg = Config(cfg=cfg)
+        elif channel: cfg = Config(cfg={'channel': channel})
+        else: raise RuntimeError('ShardedQueue needs cfg or channel parameter')
+
+        if not cfg.channel:
+            raise ValueError('no channel name provided for queue')
+
+        if not cfg.uid:
+            cfg.uid = generate_id('%s.bridge.%%(counter)04d' % cfg.channel,
+                                  ID_CUSTOM)
+
+        super(ShardedQueue, self).__init__(cfg)
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def name(self):
+        return self._uid
+
+    @property
+    def uid(self):
+        return self._uid
+
+    @property
+    def type_in(self):
+        return 'put'
+
+    @property
+    def type_out(self):
+        return 'get'
+
+    @property
+    def addr_in(self):
+        return self._addr_put
+
+    @property
+    def addr_out(self):
+        return self._addr_get
+
+    @property
+    def addr_put(self):
+        return self._addr_put
+
+    @property
+    def addr_get(self):
+        return self._addr_get
+
+    @property
+    def shards(self):
+        return len(self._shards)
+
+    def addr(self, spec):
+        if spec.lower() == self.type_in : return self.addr_put
+        if spec.lower() == self.type_out: return self.addr_get
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _bridge_initialize(self):
+
+        n_shards   = int(self._cfg.get('shards') or _SHARDS)
+        self._mode = self._cfg.get('shard_mode') or 'process'
+
+        if self._mode not in ['process', 'thread']:
+            raise ValueError('invalid shard mode %s' % self._mode)
+
+        self._log.info('start sharded bridge %s (%d %s shards)',
+                       self._uid, n_shards, self._mode)
+
+        self._lock   = mt.RLock()
+        self._shards = list()       # thread mode : Queue instances
+                                    # process mode: [process, pipe] pairs
+        addrs_put    = list()
+        addrs_get    = list()
+
+        try:
+            for idx in range(n_shards):
+
+                cfg        = Config(cfg=self._cfg)
+                cfg.uid    = '%s.%04d' % (self._uid, idx)
+                cfg.kind   = 'queue'
+                cfg.shards = 1
+
+                # the sharded bridge reports the counters of all shards
+                cfg.stats_interval = 0
+
+                if self._mode == 'thread':
+                    bridge = Queue(cfg)
+                    self._shards.append(bridge)
+                    addrs_put.append(str(bridge.addr_put))
+                    addrs_get.append(str(bridge.addr_get))
+
+                else:
+                    conn, child = mp.Pipe()
+                    proc = mp.Process(target=_run_shard, args=[cfg, child],
+                                      name=cfg.uid)
+                    proc.daemon = True
+                    proc.start()
+                    self._shards.append([proc, conn])
+
+                    addr_put, addr_get = self._reply(conn)
+                    addrs_put.append(addr_put)
+                    addrs_get.append(addr_get)
+
+        except Exception:
+            # do not leave the shards started so far behind
+            self._log.exception('failed to start shards for %s', self._uid)
+            self._abort()
+            raise
+
+        self._addr_put = Url(','.join(addrs_put))
+        self._addr_get = Url(','.join(addrs_get))
+
+        self._log.info('bridge in  %s: %s'  % (self._uid, self._addr_put))
+        self._log.info('       out %s: %s'  % (self._uid, self._addr_get))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _reply(self, conn):
+        '''
+        receive the reply of a shard process, but do not wait forever for
+        a shard which died or hangs
+        '''
+
+        if not conn.poll(_TIMEOUT):
+            raise RuntimeError('shard of %s does not respond' % self._uid)
+
+        return conn.recv()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _abort(self):
+        '''
+        Tear down the shards created so far when the sharded bridge fails to
+        start.  Thread shards are not started yet and only release their local
+        transports, shard processes are asked to stop and are killed if they
+        do not.
+        '''
+
+        for shard in self._shards:
+
+            if self._mode == 'thread':
+                unbind_local(shard.uid)
+
+            else:
+                proc, conn = shard
+                try:
+                    conn.send('stop')
+                except Exception:
+                    pass
+                proc.join(_STOP)
+                if proc.is_alive():
+                    proc.terminate()
+                    proc.join(_STOP)
+
+        self._shards = list()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def start(self):
+
+        # process shards are running already
+        if self._mode == 'thread':
+            for bridge in self._shards:
+                bridge.start()
+
+        # collect and report the shard counters in regular intervals
+        self._term     = mt.Event()
+        self._interval = self._cfg.get('stats_interval')
+        if self._interval:
+            self._stats_thread = mt.Thread(target=self._stats_work)
+            self._stats_thread.daemon = True
+            self._stats_thread.start()
+
+        self._log.info('started bridge %s', self._uid)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _stats_work(self):
+
+        try:
+            while not self._term.wait(self._interval):
+                self._collect()
+                self._stats.tick()
+
+        except Exception:
+            self._log.exception('stats collection failed')
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self, timeout=None):
+
+        self._term.set()
+        if self._interval:
+            self._stats_thread.join(timeout)
+            self._collect()
+            self._stats.tick(final=True)
+
+        for shard in self._shards:
+
+            if self._mode == 'thread':
+                shard.stop(timeout)
+
+            else:
+                proc, conn = shard
+                with self._lock:
+                    try:
+                        conn.send('stop')
+                    except Exception:
+                        pass
+                proc.join(timeout)
+
+        self._prof.prof('term', uid=self._uid)
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def alive(self):
+
+        if self._mode == 'thread':
+            return all([bridge.alive for bridge in self._shards])
+
+        return all([proc.is_alive() for proc, _ in self._shards])
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _collect(self):
+        '''
+        Fetch the counters of all shards, and sum them up in the counters of
+        this bridge.  Return the list of shard counters.
+        '''
+
+        shards = list()
+
+        with self._lock:
+
+            for shard in self._shards:
+
+                if self._mode == 'thread':
+                    shards.append(shard.stats)
+
+                else:
+                    _, conn = shard
+                    conn.send('stats')
+                    shards.append(self._reply(conn))
+
+            stats = self._stats
+            for key in ['msgs_in', 'bytes_in', 'msgs_out', 'bytes_out',
+                        'depth', 'depth_b', 'consumers']:
+                setattr(stats, key, sum([shard[key] for shard in shards]))
+
+            latency = Histogram()
+            for shard in shards:
+                latency.merge(shard['latency'])
+            stats.latency = latency
+
+        return shards
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def stats(self):
+        '''
+        Return the counters of all shards summed up (see `Bridge.stats`), and
+        the complete counters of each shard as list in `shards`.
+        '''
+
+        with self._lock:
+            shards = self._collect()
+            ret    = self._stats.as_dict()
+
+        ret['shards'] = shards
+
+        return ret
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,249 @@
+
+import os
+import time
+import json
+
+
+# ------------------------------------------------------------------------------
+#
+# Bridges maintain a set of cheap counters (see `BridgeStats`): messages and
+# bytes received and sent, the current backlog depth, the number of connected
+# consumers, and a histogram of the forwarding latency (the time messages spend
+# in the bridge).  The counters are always available via the bridge's `stats`
+# property.  With the bridge config setting `stats_interval` (seconds), the
+# bridge also reports them periodically:
+#
+#   - as JSON line appended to the file `stats_file` (default:
+#     `<path>/<uid>.stats`), and
+#   - if `stats_url` is set, as message with topic `stats` published to the
+#     pubsub bridge at that address.
+#
+# Latencies are binned into buckets which grow by powers of two, starting at
+# `_MIN_LATENCY` microseconds, so that recording a latency is O(1).
+#
+_MIN_LATENCY = 16   # us: upper bound of the first latency bucket
+_N_BUCKETS   = 24   # number of latency buckets (last one is open ended)
+
+
+# ------------------------------------------------------------------------------
+#
+class Histogram(object):
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self):
+
+        self._buckets = [0] * _N_BUCKETS
+        self._count   = 0
+        self._sum     = 0.0
+        self._max     = 0.0
+
+
+    # --------------------------------------------------------------------------
+    #
+    def add(self, value, count=1):
+        '''
+        record `count` samples of the given value (seconds)
+        '''
+
+        idx = int(value * 1e6 / _MIN_LATENCY).bit_length()
+        if idx >= _N_BUCKETS:
+            idx = _N_BUCKETS - 1
+
+        self._buckets[idx] += count
+        self._count        += count
+        self._sum          += value * count
+
+        if value > self._max:
+            self._max = value
+
+
+    # --------------------------------------------------------------------------
+    #
+    def merge(self, other):
+        '''
+        add the samples of another histogram, given as dict (see `as_dict()`)
+        '''
+
+        for bound, count in other['buckets'].items():
+            if bound == 'inf':
+                idx = _N_BUCKETS - 1
+            else:
+                idx = (int(bound) // _MIN_LATENCY).bit_length() - 1
+            self._buckets[idx] += count
+
+        self._count += other['count']
+        self._sum   += other['avg'] * other['count']
+
+        if other['max'] > self._max:
+            self._max = other['max']
+
+
+    # --------------------------------------------------------------------------
+    #
+    def as_dict(self):
+        '''
+        Return the histogram as dict.  `buckets` maps the upper bound of each
+        non-empty bucket (in microseconds, `inf` for the last one) to the number
+        of samples in that bucket.
+        '''
+
+        buckets = dict()
+        for idx, count in enumerate(self._buckets):
+            if count:
+                if idx == _N_BUCKETS - 1: bound = 'inf'
+                else                    : bound = str(_MIN_LATENCY << idx)
+                buckets[bound] = count
+
+        avg = self._sum / self._count if self._count else 0.0
+
+        return {'count'  : self._count,
+                'avg'    : avg,
+                'max'    : self._max,
+                'buckets': buckets}
+
+
+# ------------------------------------------------------------------------------
+#
+class BridgeStats(object):
+    '''
+    Counters maintained by a bridge thread.  The counters are only updated by
+    the bridge thread, and read without locking by other threads.
+    '''
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, uid, cfg, log):
+
+        self._uid       = uid
+        self._log       = log
+        self._interval  = cfg.get('stats_interval') or 0
+        self._url       = cfg.get('stats_url')
+        self._fname     = cfg.get('stats_file')
+        self._pub       = None
+
+        if self._interval and not self._fname:
+            self._fname = os.path.join(cfg.get('path') or os.getcwd(),
+                                       '%s.stats' % uid)
+
+        self.msgs_in    = 0
+        self.bytes_in   = 0
+        self.msgs_out   = 0
+        self.bytes_out  = 0
+        self.depth      = 0          # messages in the backlog
+        self.depth_b    = 0          # bytes    in the backlog
+        self.consumers  = 0
+        self.latency    = Histogram()
+
+        self._t_start   = time.time()
+        self._t_last    = self._t_start
+        self._last      = [0, 0]      # msgs_in, msgs_out at last report
+
+
+    # --------------------------------------------------------------------------
+    #
+    def received(self, n, nbytes):
+        '''
+        count `n` incoming messages
+        '''
+
+        self.msgs_in  += n
+        self.bytes_in += nbytes
+
+
+    # --------------------------------------------------------------------------
+    #
+    def sent(self, n, nbytes, latency=None, arrivals=None):
+        '''
+        Count `n` outgoing messages.  Their latency is either given for all of
+        them, or derived from `arrivals`, a list of `[time, n_msgs]` pairs which
+        give the arrival time of the messages which left the bridge's backlog.
+        '''
+
+        self.msgs_out  += n
+        self.bytes_out += nbytes
+
+        if latency is not None:
+            self.latency.add(latency, n)
+
+        elif arrivals:
+            now = time.time()
+            for t_arrival, k in arrivals:
+                self.latency.add(now - t_arrival, k)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def as_dict(self):
+
+        now = time.time()
+        dt  = now - self._t_last
+
+        if dt > 0:
+            rate_in  = (self.msgs_in  - self._last[0]) / dt
+            rate_out = (self.msgs_out - self._last[1]) / dt
+        else:
+            rate_in  = 0.0
+            rate_out = 0.0
+
+        return {'uid'      : self._uid,
+                'time'     : now,
+                'uptime'   : now - self._t_start,
+                'msgs_in'  : self.msgs_in,
+                'bytes_in' : self.bytes_in,
+                'msgs_out' : self.msgs_out,
+                'bytes_out': self.bytes_out,
+                'rate_in'  : rate_in,
+                'rate_out' : rate_out,
+                'depth'    : self.depth,
+                'depth_b'  : self.depth_b,
+                'consumers': self.consumers,
+                'latency'  : self.latency.as_dict()}
+
+
+    # --------------------------------------------------------------------------
+    #
+    def tick(self, final=False):
+        '''
+        called regularly by the bridge thread: report the counters if the
+        reporting interval passed (or if the bridge terminates)
+        '''
+
+        if not self._interval:
+            return
+
+        if not final and time.time() - self._t_last < self._interval:
+            return
+
+        self.report(final)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def report(self, final=False):
+
+        stats = self.as_dict()
+
+        self._t_last = stats['time']
+        self._last   = [self.msgs_in, self.msgs_out]
+
+        try:
+            if self._fname:
+                with open(self._fname, 'a') as fout:
+                    fout.write(json.dumps(stats) + '\n')
+
+            if self._url:
+                if not self._pub:
+                    from .pubsub import Publisher
+                    self._pub = Publisher('stats', self._url, log=self._log)
+                self._pub.put('stats', stats)
+
+        except Exception:
+            self._log.exception('stats report failed')
+
+        if final and self._pub:
+            self._pub.close()
+
+
+# ------------------------------------------------------------------------------
+
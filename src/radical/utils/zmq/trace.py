@@ -0,0 +1,159 @@
+
+import time
+
+from .stats import Histogram
+from .utils import chunk_trace
+
+
+# ------------------------------------------------------------------------------
+#
+# Bulks sent through a `Queue` can carry a *trace*: a small list which travels
+# in the chunk headers (see `utils.py`), and which records when the bulk passed
+# each stage of the channel:
+#
+#   [t_put, t_enq, t_deq, hops, src]
+#
+#   - `t_put`: the putter sent the bulk
+#   - `t_enq`: the bridge received the bulk (and added it to its backlog)
+#   - `t_deq`: the bridge sent the bulk to a getter
+#   - `hops` : number of bridges the bulk passed
+#   - `src`  : uid of the putter
+#
+# Putters add a trace to one in `trace` bulks, where `trace` is a setting in
+# the putter's channel config (default: no tracing), so that the tracing
+# overhead is bounded.  Getters collect the traces they receive in latency
+# histograms (see `Getter.trace_stats()`), and, if their profiler is enabled,
+# record the stages as profiler events.  Note that the latencies are computed
+# from the clocks of different processes, and may thus be skewed if those
+# processes run on different nodes.
+#
+T_PUT = 0
+T_ENQ = 1
+T_DEQ = 2
+HOPS  = 3
+SRC   = 4
+
+
+# ------------------------------------------------------------------------------
+#
+def new_trace(src):
+
+    return [time.time(), 0.0, 0.0, 0, src]
+
+
+# ------------------------------------------------------------------------------
+#
+def stamp_chunks(chunks, idx):
+    '''
+    Set the timestamp `idx` (`T_ENQ` or `T_DEQ`) in the traces of all traced
+    chunks of a bulk.  On enqueue, the hop count is incremented.  The trace is
+    copied, as it can be shared with other chunks split from the same chunk.
+    '''
+
+    now = None
+
+    for chunk in chunks:
+
+        hdr = chunk[0]
+        if not chunk_trace(hdr):
+            continue
+
+        if now is None:
+            now = time.time()
+
+        trace      = list(hdr[3])
+        trace[idx] = now
+
+        if idx == T_ENQ:
+            trace[HOPS] += 1
+
+        chunk[0] = hdr[:3] + [trace] + hdr[4:]
+
+
+# ------------------------------------------------------------------------------
+#
+class Tracer(object):
+    '''
+    Collect the traces received by a getter in latency histograms:
+
+      - `put`    : putter to bridge
+      - `bridge` : time in the bridge backlog
+      - `get`    : bridge to getter
+      - `total`  : putter to getter
+      - `deliver`: time to hand the bulk to the getter's callbacks
+    '''
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, uid, prof):
+
+        self._uid     = uid
+        self._prof    = prof
+        self._n       = 0
+        self._hists   = {'put'    : Histogram(),
+                         'bridge' : Histogram(),
+                         'get'    : Histogram(),
+                         'total'  : Histogram(),
+                         'deliver': Histogram()}
+
+
+    # --------------------------------------------------------------------------
+    #
+    def record(self, traces, t_recv=None):
+        '''
+        Record the traces of a received bulk.  A bulk can hold chunks of several
+        traced bulks, and all chunks of a traced bulk carry the same trace,
+        which is recorded only once.
+        '''
+
+        if t_recv is None:
+            t_recv = time.time()
+
+        last = None
+        for trace in traces:
+
+            t_put, t_enq, t_deq, hops, src = trace
+
+            if last == [t_put, src]:
+                continue
+            last = [t_put, src]
+
+            self._n += 1
+            self._hists['total'].add(t_recv - t_put)
+
+            if t_enq:
+                self._hists['put']   .add(t_enq  - t_put)
+                self._hists['bridge'].add(t_deq  - t_enq)
+                self._hists['get']   .add(t_recv - t_deq)
+
+            if self._prof.enabled:
+                msg = 'hops=%d' % hops
+                self._prof.prof('trace_put',  uid=src, msg=msg, ts=t_put)
+                self._prof.prof('trace_enq',  uid=src, msg=msg, ts=t_enq)
+                self._prof.prof('trace_deq',  uid=src, msg=msg, ts=t_deq)
+                self._prof.prof('trace_recv', uid=src, msg=msg, ts=t_recv)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def delivered(self, t_recv):
+        '''
+        record the delivery of a traced bulk received at `t_recv`
+        '''
+
+        self._hists['deliver'].add(time.time() - t_recv)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def as_dict(self):
+
+        ret = {'traces': self._n}
+        for name, hist in self._hists.items():
+            ret[name] = hist.as_dict()
+
+        return ret
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,215 @@
+
+import os
+import zmq
+import tempfile
+
+from ..atfork  import atfork
+from ..url     import Url
+from ..misc    import get_hostip, noop
+
+
+# ------------------------------------------------------------------------------
+#
+# Bridges bind their sockets to `tcp://*:*` and advertise the TCP addresses.
+# Additionally, each bridge socket is bound to an `inproc://` address (usable
+# by endpoints in the same process) and to an `ipc://` address (usable by
+# endpoints on the same node).  The ipc path is derived from a bridge specific
+# prefix (which contains the bridge uid) and the TCP port of the socket, and
+# the prefix is advertised in the query of the TCP addresses of the bridge, as
+# in `tcp://host:port/?ipc=<prefix>` (see `local_query()`).  All addresses are
+# also listed by the bridge (see for example `Queue.addrs_in` and
+# `Queue.addrs_out`).  Endpoints connect to:
+#
+#   - the inproc address, if given the TCP address of a bridge which runs in
+#     the same process,
+#   - the ipc address,    if given the TCP address of a bridge which runs on
+#     the same node and whose ipc socket file exists,
+#   - the given address   otherwise.
+#
+# The ipc path is never derived from the TCP port alone, as a socket file left
+# behind by a bridge which was killed (or by an earlier bridge on the same port)
+# cannot be told apart from the socket of a live bridge.  Bridges remove their
+# local transports when they are stopped.  Setting the environment variable
+# `RADICAL_ZMQ_LOCAL` to `False` disables the local transports for both bridges
+# and endpoints.
+#
+# Some bridges run auxiliary sockets next to their main sockets (like the
+# socket for priority messages of a `Queue`, or the cache snapshot socket of
+# a `PubSub`), whose ports are advertised in the query of the main TCP address,
+# as in `tcp://host:port/?prio=<port>` (see `split_url()`).
+#
+_ENABLED = os.environ.get('RADICAL_ZMQ_LOCAL', 'True').lower() \
+                                                 not in ['0', 'false', 'no']
+_IPC_DIR = os.path.join(tempfile.gettempdir(), 'radical.zmq.%d' % os.getuid())
+_inproc  = dict()   # tcp port: inproc address of bridges in this process
+_bound   = dict()   # bridge uid: [tcp ports, ipc paths] of local transports
+
+_IPC_QUERY = 'ipc'  # address query key for the ipc path prefix
+
+
+# ------------------------------------------------------------------------------
+#
+def _ipc_path(prefix, port):
+
+    return '%s.%d.ipc' % (prefix, port)
+
+
+def _is_local(host):
+
+    return host in ['localhost', '127.0.0.1', get_hostip()]
+
+
+def _query(u):
+
+    if not u.query:
+        return dict()
+
+    return dict([item.split('=', 1) for item in u.query.split('&')
+                                     if '=' in item])
+
+
+# ------------------------------------------------------------------------------
+#
+def bind_local(sock, uid, port, log):
+    '''
+    Bind a bridge socket which is bound to the given TCP port to the local
+    transports (see above), and return the list of the resulting addresses.
+    '''
+
+    if not _ENABLED:
+        return list()
+
+    addrs  = list()
+    bound  = _bound.setdefault(uid, [list(), list()])
+    inproc = 'inproc://%s.%d' % (uid, port)
+
+    sock.bind(inproc)
+    _inproc[port] = inproc
+    bound[0].append(port)
+    addrs.append(inproc)
+
+    if zmq.has('ipc'):
+        path = _ipc_path(os.path.join(_IPC_DIR, uid), port)
+        ipc  = 'ipc://%s' % path
+        try:
+            os.makedirs(_IPC_DIR, exist_ok=True)
+            sock.bind(ipc)
+            bound[1].append(path)
+            addrs.append(ipc)
+
+        except Exception as e:
+            log.warn('cannot bind %s: %s', ipc, e)
+
+    return addrs
+
+
+# ------------------------------------------------------------------------------
+#
+def local_query(uid):
+    '''
+    Return the query items (a list of `key=value` strings) which advertise the
+    ipc transport of the given bridge in its TCP addresses (see above).  The
+    list is empty if the bridge could not bind any ipc address.
+    '''
+
+    if uid not in _bound or not _bound[uid][1]:
+        return list()
+
+    return ['%s=%s' % (_IPC_QUERY, os.path.join(_IPC_DIR, uid))]
+
+
+# ------------------------------------------------------------------------------
+#
+def unbind_local(uid):
+    '''
+    Withdraw the local transports of the given bridge: endpoints created later
+    do not select its inproc addresses anymore, and its ipc socket files are
+    removed.
+    '''
+
+    ports, paths = _bound.pop(uid, [list(), list()])
+
+    for port in ports:
+        _inproc.pop(port, None)
+
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+# ------------------------------------------------------------------------------
+#
+def select_url(url):
+    '''
+    For the given bridge address, return the address of the fastest transport
+    this process can use to reach the bridge (see above).
+    '''
+
+    u = Url(url)
+
+    if u.schema != 'tcp':
+        return url
+
+    # the query is only meant for endpoints, not for zmq
+    tcp = 'tcp://%s:%d' % (u.host, u.port)
+
+    if not _ENABLED or not _is_local(u.host):
+        return tcp
+
+    if u.port in _inproc:
+        return _inproc[u.port]
+
+    prefix = _query(u).get(_IPC_QUERY)
+    if prefix and zmq.has('ipc'):
+        path = _ipc_path(prefix, u.port)
+        if os.path.exists(path):
+            return 'ipc://%s' % path
+
+    return tcp
+
+
+# ------------------------------------------------------------------------------
+#
+def split_url(url, key):
+    '''
+    Split a bridge address into the address of the main socket, and the
+    address of the auxiliary socket `key` advertised with it (see above).  The
+    latter is `None` if the address advertises no such socket (like local
+    transport addresses).  Both addresses keep advertising the ipc transport
+    of the bridge (if any).
+    '''
+
+    u = Url(url)
+
+    if u.schema != 'tcp' or not u.query:
+        return url, None
+
+    query = _query(u)
+    ipc   = ''
+    if _IPC_QUERY in query:
+        ipc = '/?%s=%s' % (_IPC_QUERY, query[_IPC_QUERY])
+
+    base = 'tcp://%s:%d%s' % (u.host, u.port, ipc)
+
+    if key not in query:
+        return base, None
+
+    return base, 'tcp://%s:%s%s' % (u.host, query[key], ipc)
+
+
+# ------------------------------------------------------------------------------
+#
+def _atfork_child():
+
+    # bridge threads do not survive a fork (but their socket files do)
+    _inproc.clear()
+    _bound.clear()
+
+
+atfork(noop, noop, _atfork_child)
+
+
+# ------------------------------------------------------------------------------
+
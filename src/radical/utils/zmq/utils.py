@@ -2,11 +2,14 @@
 import os
 import zmq
 import errno
+import struct
 import msgpack
 
 from ..url  import Url
 from ..misc import as_list
 
+from .codec import get_codec, get_decoders
+
 
 # --------------------------------------------------------------------------
 #
@@ -41,6 +44,289 @@ def no_intr(f, *args, **kwargs):
             raise          # some other error condition, raise it
 
 
+# ------------------------------------------------------------------------------
+#
+_ZERO_COPY_SIZE = 64 * 1024  # frames larger than this are never copied
+
+
+# ------------------------------------------------------------------------------
+#
+# pyzmq's `send_multipart()` and `recv_multipart()` come with a significant
+# per-call overhead (mostly from querying `RCVMORE` via `getsockopt()`), which
+# dominates the cost of small messages.  These are leaner versions which check
+# the `more` flag on the received frames instead.  Frames are received without
+# copying, and large frames are also sent without copying.
+#
+_SNDMORE = int(zmq.SNDMORE)
+
+
+def send_frames(socket, frames, flags=0):
+
+    for frame in frames[:-1]:
+        socket.send(frame, flags | _SNDMORE,
+                    copy=len(frame) < _ZERO_COPY_SIZE)
+
+    socket.send(frames[-1], flags, copy=len(frames[-1]) < _ZERO_COPY_SIZE)
+
+
+def recv_frames(socket, flags=0):
+
+    frame  = socket.recv(flags, copy=False)
+    frames = [frame]
+
+    while frame.more:
+        frame = socket.recv(flags, copy=False)
+        frames.append(frame)
+
+    return frames
+
+
+# ------------------------------------------------------------------------------
+#
+# Bulks of messages are sent over the zmq channels as a list of *chunks*.  Each
+# chunk is a zmq frame which starts with a header (a 4 byte header length,
+# followed by the packed header), followed by the concatenation of the
+# individually encoded messages.  The header is a list `[lens, codec, nbufs]`,
+# where `lens` are the sizes of the encoded messages, `codec` is the name of the
+# codec used to encode them (see `codec.py`), and `nbufs` is described below.
+# That allows the bridge to split and merge bulks at message boundaries without
+# ever decoding the messages, while the framing overhead is paid per chunk, not
+# per message.
+#
+# Messages larger than `_ZERO_COPY_SIZE`, and messages with out-of-band buffers,
+# are sent as a chunk of their own, where the chunk frame only holds the header,
+# and the message payload and buffers are sent as the `nbufs` separate frames
+# following the header, so that large messages are never copied into a combined
+# frame.  `nbufs` is `0` for all other chunks.
+#
+# The header of traced bulks has the bulk's trace as fourth element (see
+# `trace.py`).  Traced chunks are never merged with other chunks.  The header
+# of bulks with a non-default priority has the priority as fifth element (and
+# `None` as fourth element if the bulk is not traced, see `Queue`).  The header
+# of publications sent as bulk has `True` as sixth element (see `PubSub`).
+#
+_HEADER = struct.Struct('<I')
+
+
+def _chunk_header(lens, codec, nbufs, trace=None, priority=0, bulk=False):
+
+    if   bulk    : hdr = msgpack.packb([lens, codec, nbufs, trace, priority,
+                                        True])
+    elif priority: hdr = msgpack.packb([lens, codec, nbufs, trace, priority])
+    elif trace   : hdr = msgpack.packb([lens, codec, nbufs, trace])
+    else         : hdr = msgpack.packb([lens, codec, nbufs])
+    return _HEADER.pack(len(hdr)) + hdr
+
+
+def chunk_header(frame):
+    '''
+    return the header of the chunk which starts with the given frame
+    '''
+
+    view = memoryview(frame)
+    size = _HEADER.size + _HEADER.unpack_from(view)[0]
+
+    return msgpack.unpackb(view[_HEADER.size:size])
+
+
+def chunk_trace(hdr):
+    '''
+    return the trace of a chunk with the given header (or `None`)
+    '''
+
+    if len(hdr) > 3:
+        return hdr[3]
+
+
+def chunk_priority(hdr):
+    '''
+    return the priority of a chunk with the given header
+    '''
+
+    if len(hdr) > 4:
+        return hdr[4]
+
+    return 0
+
+
+def chunk_bulk(hdr):
+    '''
+    return `True` if the chunk with the given header belongs to a bulk
+    publication
+    '''
+
+    return len(hdr) > 5 and bool(hdr[5])
+
+
+# ------------------------------------------------------------------------------
+#
+def pack_bulk(msgs, codec=None, trace=None, priority=0, bulk=False):
+    '''
+    pack a list of messages into a list of zmq frames (see above), using the
+    given codec instance (default: msgpack), and attach the given trace,
+    priority and bulk flag (if any) to all chunks
+    '''
+
+    if not codec:
+        codec = get_codec()
+
+    return pack_encoded([codec.encode(msg) for msg in as_list(msgs)],
+                        codec.name, trace, priority, bulk)
+
+
+def pack_encoded(encoded, name, trace=None, priority=0, bulk=False):
+    '''
+    pack a list of messages which are already encoded (i.e., a list of buffer
+    lists as returned by `Codec.encode()`) by the codec of the given name into
+    a list of zmq frames.
+    '''
+
+    frames = list()
+    lens   = list()
+    data   = list()
+
+    for bufs in encoded:
+
+        if len(bufs) > 1 or len(bufs[0]) > _ZERO_COPY_SIZE:
+            if data:
+                frames.append(b''.join([_chunk_header(lens, name, 0, trace,
+                                                      priority, bulk)]
+                                       + data))
+                lens = list()
+                data = list()
+            frames.append(_chunk_header([len(bufs[0])], name, len(bufs),
+                                        trace, priority, bulk))
+            frames.extend(bufs)
+
+        else:
+            lens.append(len(bufs[0]))
+            data.append(bufs[0])
+
+    if data:
+        frames.append(b''.join([_chunk_header(lens, name, 0, trace, priority,
+                                              bulk)] + data))
+
+    return frames
+
+
+# ------------------------------------------------------------------------------
+#
+def split_chunks(frames):
+    '''
+    Parse a list of frames created by `pack_bulk()` or `join_chunks()` into
+    a list of chunks `[hdr, payload, frames]`: `hdr` is the chunk header (see
+    above), `payload` is a buffer holding the encoded messages (or the main
+    payload of a single message with out-of-band buffers), and `frames` is the
+    list of original frames which made up that chunk.  No message is decoded or
+    copied.
+    '''
+
+    chunks = list()
+    idx    = 0
+
+    while idx < len(frames):
+
+        view  = memoryview(frames[idx])
+        size  = _HEADER.size + _HEADER.unpack_from(view)[0]
+        hdr   = msgpack.unpackb(view[_HEADER.size:size])
+        nbufs = hdr[2]
+
+        if nbufs:
+            chunks.append([hdr, frames[idx + 1], frames[idx:idx + 1 + nbufs]])
+            idx += 1 + nbufs
+
+        else:
+            chunks.append([hdr, view[size:], frames[idx:idx + 1]])
+            idx += 1
+
+    return chunks
+
+
+# ------------------------------------------------------------------------------
+#
+def join_chunks(chunks):
+    '''
+    Convert a list of chunks as returned by `split_chunks()` back into a list of
+    frames, merging consecutive inline chunks of the same codec into one.  The
+    `frames` element of a chunk can be `None` if the chunk was created by
+    splitting another one (which only happens for inline chunks).
+    '''
+
+    frames = list()
+    run    = list()
+
+    def _flush():
+        if len(run) == 1 and run[0][2]:
+            frames.extend(run[0][2])
+        elif run:
+            lens = [size for c in run for size in c[0][0]]
+            frames.append(b''.join([_chunk_header(lens, run[0][0][1], 0)]
+                                   + [c[1] for c in run]))
+        del(run[:])
+
+    for chunk in chunks:
+
+        hdr = chunk[0]
+
+        if chunk_trace(hdr):
+            # traced chunk: the trace may have changed, so repack the header
+            _flush()
+            if hdr[2]:
+                frames.append(_chunk_header(*hdr))
+                frames.extend(chunk[2][1:])
+            else:
+                frames.append(b''.join([_chunk_header(*hdr), chunk[1]]))
+
+        elif hdr[2]:
+            _flush()
+            frames.extend(chunk[2])
+
+        else:
+            if run and run[0][0][1] != hdr[1]:
+                _flush()
+            run.append(chunk)
+
+    _flush()
+
+    return frames
+
+
+# ------------------------------------------------------------------------------
+#
+def unpack_bulk(frames, traces=None, codecs=None):
+    '''
+    unpack a list of zmq frames created by `pack_bulk()` or `join_chunks()` into
+    a flat list of messages.  If a `traces` list is given, the traces found in
+    the chunk headers are appended to it.
+
+    Only chunks of the given `codecs` (names, default: the safe codecs, see
+    `codec.get_decoders()`) are decoded: a `ValueError` is raised if any chunk
+    uses another codec, before any message is decoded.
+    '''
+
+    if codecs is None:
+        codecs = get_decoders()
+
+    msgs   = list()
+    chunks = split_chunks(frames)
+
+    for hdr, _, _ in chunks:
+        if hdr[1] not in codecs:
+            raise ValueError('codec %s is not enabled' % hdr[1])
+
+    for hdr, payload, parts in chunks:
+
+        if traces is not None and chunk_trace(hdr):
+            traces.append(hdr[3])
+
+        codec = get_codec(hdr[1])
+
+        if hdr[2]: msgs.append(codec.decode(payload, parts[2:]))
+        else     : msgs.extend(codec.decode_all(payload, hdr[0]))
+
+    return msgs
+
+
 # ------------------------------------------------------------------------------
 #
 def get_uids(msgs):
@@ -0,0 +1,34 @@
+
+__author__    = 'Radical.Utils Development Team'
+__copyright__ = 'Copyright 2019, RADICAL@Rutgers'
+__license__   = 'MIT'
+
+
+import os
+import shutil
+import tempfile
+
+
+# ------------------------------------------------------------------------------
+#
+# Loggers and profilers which are not given a path (like those of zmq endpoints)
+# write to the default log and profile directories, which is the working
+# directory unless set otherwise.  Point those defaults to a temporary directory
+# for the test session - this needs to happen before the first logger is
+# created, as the default config is only read once.
+#
+_tmp = tempfile.mkdtemp(prefix='radical.utils.test.')
+
+for _key in ['LOG_DIR', 'PROFILE_DIR', 'REPORT_DIR']:
+    os.environ.setdefault('RADICAL_DEFAULT_%s' % _key, _tmp)
+
+
+# ------------------------------------------------------------------------------
+#
+def pytest_unconfigure(config):
+
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+
+# ------------------------------------------------------------------------------
+
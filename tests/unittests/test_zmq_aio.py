@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+__author__    = 'Radical.Utils Development Team'
+__copyright__ = 'Copyright 2021, RADICAL@Rutgers'
+__license__   = 'MIT'
+
+
+import time
+import asyncio
+
+import radical.utils as ru
+
+
+# ------------------------------------------------------------------------------
+#
+def _run(coro):
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_aio_queue():
+    '''
+    exchange messages between async and blocking queue endpoints
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_aio_queue',
+                         'channel'  : 'test_aio_queue',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put_url = str(b.addr_put)
+    get_url = str(b.addr_get)
+
+    async def work():
+
+        put = ru.zmq.AsyncPutter(cfg['channel'], put_url)
+        get = ru.zmq.AsyncGetter(cfg['channel'], get_url)
+
+        # async putters feed blocking getters and vice versa
+        sync_put = ru.zmq.Putter(cfg['channel'], put_url)
+        sync_get = ru.zmq.Getter(cfg['channel'], get_url)
+
+        await put.put({'idx': 0})
+        assert(sync_get.get_nowait(timeout=1000) == [{'idx': 0}])
+
+        sync_put.put({'idx': 1})
+        assert(await get.get_nowait(timeout=1000) == [{'idx': 1}])
+
+        # iterate over messages with a prefetching getter
+        pre = ru.zmq.AsyncGetter(cfg['channel'], get_url,
+                                 cfg={'prefetch': 2})
+
+        await put.put([{'idx': i} for i in range(10)])
+
+        msgs = list()
+        async for msg in pre:
+            msgs.append(msg)
+            if len(msgs) == 10:
+                break
+
+        assert(msgs == [{'idx': i} for i in range(10)])
+        assert(await pre.get_nowait(timeout=100) is None)
+
+        put.stop()
+        get.stop()
+        pre.stop()
+
+    _run(work())
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_aio_pubsub():
+    '''
+    publish and subscribe from coroutines, many subscribers in one loop
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_aio_pubsub',
+                         'channel'  : 'test_aio_pubsub',
+                         'kind'     : 'pubsub',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.PubSub(cfg)
+    b.start()
+
+    pub_url = str(b.addr_pub)
+    sub_url = str(b.addr_sub)
+
+    async def consume(sub, n):
+        msgs = list()
+        async for topic, msg in sub:
+            msgs.append([topic, msg['idx']])
+            if len(msgs) == n:
+                return msgs
+
+    async def work():
+
+        pub  = ru.zmq.AsyncPublisher(cfg['channel'], pub_url)
+        subs = [ru.zmq.AsyncSubscriber(cfg['channel'], sub_url, topic='topic')
+                for _ in range(10)]
+
+        other = ru.zmq.AsyncSubscriber(cfg['channel'], sub_url, topic='other')
+
+        await asyncio.sleep(0.2)   # let subscriptions propagate
+
+        tasks = [asyncio.ensure_future(consume(sub, 5)) for sub in subs]
+
+        for i in range(5):
+            await pub.put('topic', {'idx': i})
+
+        for res in await asyncio.gather(*tasks):
+            assert(res == [['topic', i] for i in range(5)])
+
+        # bulks are delivered per message
+        tasks = [asyncio.ensure_future(consume(sub, 5)) for sub in subs]
+
+        await pub.put_bulk('topic', [{'idx': i} for i in range(5, 10)])
+
+        for res in await asyncio.gather(*tasks):
+            assert(res == [['topic', i] for i in range(5, 10)])
+
+        assert(await other.get_nowait(timeout=100) == [None, None])
+
+    start = time.time()
+    _run(work())
+    assert(time.time() - start < 10)
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+# run tests if called directly
+if __name__ == '__main__':
+
+    test_zmq_aio_queue()
+    test_zmq_aio_pubsub()
+
+
+# ------------------------------------------------------------------------------
+
@@ -5,10 +5,13 @@ __copyright__ = 'Copyright 2019, RADICAL@Rutgers'
 __license__   = 'MIT'
 
 
+import zmq
 import time
-import threading     as mt
+import pytest
+import threading       as mt
+import multiprocessing as mp
 
-import radical.utils as ru
+import radical.utils   as ru
 
 
 # ------------------------------------------------------------------------------
@@ -104,11 +107,549 @@ def test_zmq_pubsub():
            data['D']['A'] + data['D']['B'] == 2 * (c_a + c_b))
 
 
+# ------------------------------------------------------------------------------
+#
+def test_zmq_pubsub_codec():
+    '''
+    publish with a non-default codec - subscribers need to enable unsafe codecs
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_pubsub_codec',
+                         'channel'  : 'test_codec',
+                         'kind'     : 'pubsub',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.PubSub(cfg)
+    b.start()
+
+    pub = ru.zmq.Publisher(channel=cfg['channel'], url=str(b.addr_pub),
+                           cfg={'codec': 'pickle'})
+    sub = ru.zmq.Subscriber(channel=cfg['channel'], url=str(b.addr_sub))
+    sub.subscribe('topic')
+    time.sleep(0.1)
+
+    msg = {'data': set([1, 2]), 'blob': b'x' * (1024 * 1024)}
+    pub.put('topic', msg)
+
+    with pytest.raises(ValueError):
+        sub.get_nowait(timeout=1000)
+
+    sub = ru.zmq.Subscriber(channel=cfg['channel'], url=str(b.addr_sub),
+                            cfg={'codecs': ['pickle']})
+    pub.put('topic', msg)
+
+    assert(sub.get_nowait(timeout=1000) == ['topic', msg])
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_pubsub_poller():
+    '''
+    callbacks on many channels are served without a thread per channel
+    '''
+
+    bridges = list()
+    for i in range(10):
+        cfg = ru.Config(cfg={'uid'      : 'test_poller_%d' % i,
+                             'channel'  : 'test_poller_%d' % i,
+                             'kind'     : 'pubsub',
+                             'log_level': 'error',
+                             'path'     : '/tmp/',
+                             'sid'      : 'test_sid',
+                            })
+        b = ru.zmq.PubSub(cfg)
+        b.start()
+        bridges.append(b)
+
+    # one extra subscriber so that the poller thread exists
+    ru.zmq.Subscriber(channel='test_poller_0', url=str(bridges[0].addr_sub),
+                      topic='topic', cb=lambda t, m: None)
+
+    n_threads = mt.active_count()
+    data      = list()
+    subs      = list()
+
+    def cb(topic, msg):
+        data.append(msg['idx'])
+
+    for b in bridges:
+        subs.append(ru.zmq.Subscriber(channel=b.channel, url=str(b.addr_sub),
+                                      topic='topic', cb=cb))
+
+    assert(mt.active_count() == n_threads)
+    time.sleep(0.1)
+
+    for idx, b in enumerate(bridges):
+        pub = ru.zmq.Publisher(channel=b.channel, url=str(b.addr_pub))
+        time.sleep(0.1)
+        pub.put('topic', {'idx': idx})
+
+    start = time.time()
+    while len(data) < len(bridges) and time.time() - start < 5:
+        time.sleep(0.1)
+
+    assert(sorted(data) == list(range(len(bridges))))
+
+    for sub in subs:
+        sub.unsubscribe(cb)
+
+    for b in bridges:
+        b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_pubsub_topics():
+    '''
+    callbacks only receive messages for matching topics (prefix match)
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_pubsub_topics',
+                         'channel'  : 'test_topics',
+                         'kind'     : 'pubsub',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.PubSub(cfg)
+    b.start()
+
+    data = {'state': list(), 'control': list(), 'st': list(), 'all': list()}
+
+    def cb(name):
+        return lambda topic, msg: data[name].append(topic)
+
+    cbs = {name: cb(name) for name in data}
+
+    sub = ru.zmq.Subscriber(channel=cfg['channel'], url=str(b.addr_sub))
+    sub.subscribe('state',   cbs['state'])
+    sub.subscribe('control', cbs['control'])
+    sub.subscribe('st',      cbs['st'])
+    sub.subscribe('',        cbs['all'])
+
+    pub = ru.zmq.Publisher(channel=cfg['channel'], url=str(b.addr_pub))
+    time.sleep(0.1)
+
+    for topic in ['state', 'control', 'log', 'stop', 'state_x']:
+        pub.put(topic, {'topic': topic})
+
+    time.sleep(0.5)
+
+    assert(data['state']   == ['state', 'state_x'])
+    assert(data['control'] == ['control'])
+    assert(data['st']      == ['state', 'stop', 'state_x'])
+    assert(data['all']     == ['state', 'control', 'log', 'stop', 'state_x'])
+
+    # unsubscribed callbacks are not called anymore
+    sub.unsubscribe(cbs['st'])
+    pub.put('stop', {'topic': 'stop'})
+    time.sleep(0.5)
+
+    assert(data['st']      == ['state', 'stop', 'state_x'])
+    assert(data['all'][-1] == 'stop')
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_pubsub_stats():
+    '''
+    pubsub bridges count messages, and can publish their counters
+    '''
+
+    cfg_stats = ru.Config(cfg={'uid'      : 'test_pubsub_stats_out',
+                               'channel'  : 'test_stats_out',
+                               'kind'     : 'pubsub',
+                               'log_level': 'error',
+                               'path'     : '/tmp/',
+                               'sid'      : 'test_sid',
+                              })
+    b_stats = ru.zmq.PubSub(cfg_stats)
+    b_stats.start()
+
+    reports = list()
+    sub_stats = ru.zmq.Subscriber(channel=cfg_stats['channel'],
+                                  url=str(b_stats.addr_sub))
+    sub_stats.subscribe('stats', lambda topic, msg: reports.append(msg))
+
+    cfg = ru.Config(cfg={'uid'           : 'test_pubsub_stats',
+                         'channel'       : 'test_stats',
+                         'kind'          : 'pubsub',
+                         'log_level'     : 'error',
+                         'path'          : '/tmp/',
+                         'sid'           : 'test_sid',
+                         'stats_interval': 0.1,
+                         'stats_url'     : str(b_stats.addr_pub),
+                        })
+
+    b = ru.zmq.PubSub(cfg)
+    b.start()
+
+    sub = ru.zmq.Subscriber(channel=cfg['channel'], url=str(b.addr_sub))
+    sub.subscribe('foo')
+    sub.subscribe('bar')
+
+    pub = ru.zmq.Publisher(channel=cfg['channel'], url=str(b.addr_pub))
+    time.sleep(0.1)
+
+    for idx in range(5):
+        pub.put('foo', {'idx': idx})
+
+    time.sleep(0.5)
+
+    stats = b.stats
+    assert(stats['msgs_in']   == 5)
+    assert(stats['msgs_out']  == 5)
+    assert(stats['bytes_out'] == stats['bytes_in'])
+    assert(stats['consumers'] == 2)
+    assert(stats['latency']['count'] == 5)
+
+    # an idle bridge reports after its poll timeout (0.5s)
+    time.sleep(1.0)
+
+    assert(reports)
+    assert(reports[-1]['uid']     == cfg['uid'])
+    assert(reports[-1]['msgs_in'] == 5)
+
+    b.stop()
+    b_stats.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_pubsub_cache():
+    '''
+    late subscribers receive the last value per topic and uid
+    '''
+
+    cfg = ru.Config(cfg={'uid'       : 'test_pubsub_cache',
+                         'channel'   : 'test_cache',
+                         'kind'      : 'pubsub',
+                         'log_level' : 'error',
+                         'path'      : '/tmp/',
+                         'sid'       : 'test_sid',
+                         'cache'     : True,
+                         'cache_msgs': 3,
+                        })
+
+    b = ru.zmq.PubSub(cfg)
+    b.start()
+
+    # the bridge only forwards messages once somebody subscribed
+    sub_1 = ru.zmq.Subscriber(channel=cfg['channel'], url=str(b.addr_sub))
+    sub_1.subscribe('state')
+
+    pub = ru.zmq.Publisher(channel=cfg['channel'], url=str(b.addr_pub))
+    time.sleep(0.1)
+
+    for state in ['NEW', 'RUNNING', 'DONE']:
+        for idx in range(3):
+            pub.put('state', {'uid': 'task.%d' % idx, 'state': state})
+
+    pub.put('state_x', {'uid': 'task.0', 'state': 'NEW'})
+    time.sleep(0.2)
+
+    # the early subscriber got all live messages (the snapshot on its own
+    # subscription was empty)
+    assert(len(sub_1.get_bulk(timeout=500)) == 10)
+
+    # late subscriber (in a separate process, as subscribers in the same
+    # process share a socket, and thus their subscriptions)
+    def work_sub(q):
+
+        data = list()
+
+        def cb(topic, msg):
+            data.append([topic, msg['uid'], msg['state']])
+
+        sub_2 = ru.zmq.Subscriber(channel=cfg['channel'], url=str(b.addr_sub))
+        sub_2.subscribe('state', cb)
+        time.sleep(0.5)
+        q.put(sorted(data))
+
+        # live traffic follows the snapshot
+        time.sleep(0.5)
+        q.put(data[-1])
+
+    q    = mp.Queue()
+    proc = mp.Process(target=work_sub, args=[q])
+    proc.start()
+
+    # only 3 messages are cached - `task.0` was evicted from `state`
+    assert(q.get(timeout=5) == [['state',   'task.1', 'DONE'],
+                                ['state',   'task.2', 'DONE'],
+                                ['state_x', 'task.0', 'NEW' ]])
+
+    # the snapshot was not replayed to the existing subscriber
+    assert(sub_1.get_nowait(timeout=200) == [None, None])
+
+    pub.put('state', {'uid': 'task.3', 'state': 'NEW'})
+    assert(q.get(timeout=5) == ['state', 'task.3', 'NEW'])
+    assert(sub_1.get_nowait(timeout=1000)[1]['uid'] == 'task.3')
+
+    proc.join()
+
+    # an interactive subscriber receives the snapshot of a new subscription
+    # before live messages
+    sub_1.subscribe('state_x')
+    pub.put('state_x', {'uid': 'task.4', 'state': 'NEW'})
+    assert(sub_1.get_nowait(timeout=1000)[1]['uid'] == 'task.0')
+    assert(sub_1.get_nowait(timeout=1000)[1]['uid'] == 'task.4')
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_pubsub_cache_slow():
+    '''
+    a slow snapshot does not stall the callbacks of other subscribers, and
+    live messages are held back until the snapshot is delivered
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_pubsub_cache_slow',
+                         'channel'  : 'test_cache_slow',
+                         'kind'     : 'pubsub',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.PubSub(cfg)
+    b.start()
+
+    data_1 = list()
+    data_2 = list()
+
+    # both subscribers share a socket, and thus a poller thread and lock
+    url   = ru.Url(str(b.addr_sub))
+    url_1 = 'tcp://%s:%d' % (url.host, url.port)
+
+    sub_1 = ru.zmq.Subscriber(channel=cfg['channel'], url=url_1)
+    sub_1.subscribe('state', lambda t, m: data_1.append(m['idx']))
+
+    pub = ru.zmq.Publisher(channel=cfg['channel'], url=str(b.addr_pub))
+    time.sleep(0.2)
+
+    # advertise a snapshot socket which never replies
+    dead  = zmq.Context.instance().socket(zmq.ROUTER)
+    port  = dead.bind_to_random_port('tcp://127.0.0.1')
+    url_2 = '%s/?snap=%d' % (url_1, port)
+
+    sub_2 = ru.zmq.Subscriber(channel=cfg['channel'], url=url_2)
+    thr   = mt.Thread(target=sub_2.subscribe,
+                      args=['state', lambda t, m: data_2.append(m['idx'])])
+    thr.start()
+    time.sleep(0.2)
+
+    pub.put('state', {'idx': 1})
+    time.sleep(0.5)
+
+    assert(data_1 == [1])
+    assert(data_2 == [])
+
+    thr.join()
+    assert(data_2 == [1])
+
+    pub.put('state', {'idx': 2})
+    time.sleep(0.5)
+
+    assert(data_1 == [1, 2])
+    assert(data_2 == [1, 2])
+
+    dead.close()
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_pubsub_conflate():
+    '''
+    slow conflating subscribers only see the latest message per uid
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_pubsub_conflate',
+                         'channel'  : 'test_conflate',
+                         'kind'     : 'pubsub',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.PubSub(cfg)
+    b.start()
+
+    data = list()
+
+    def cb(topic, msg):
+        data.append([msg['uid'], msg['idx']])
+        time.sleep(0.05)
+
+    executor = ru.zmq.ConflatingExecutor({'key': 'uid'})
+
+    sub = ru.zmq.Subscriber(channel=cfg['channel'], url=str(b.addr_sub))
+    sub.subscribe('state', cb, executor=executor)
+
+    pub = ru.zmq.Publisher(channel=cfg['channel'], url=str(b.addr_pub))
+    time.sleep(0.5)
+
+    for idx in range(50):
+        for uid in ['task.0', 'task.1', 'task.2']:
+            pub.put('state', {'uid': uid, 'idx': idx})
+
+    time.sleep(1.0)
+
+    # every uid ends with its latest message, intermediate ones are skipped
+    for uid in ['task.0', 'task.1', 'task.2']:
+        idxs = [d[1] for d in data if d[0] == uid]
+        assert(idxs[-1] == 49)
+        assert(idxs     == sorted(idxs))
+
+    stats = executor.stats
+    assert(stats['calls']             == len(data))
+    assert(stats['calls'] + stats['conflated'] == 150)
+    assert(len(data) < 150)
+
+    sub.unsubscribe(cb)
+    executor.stop()
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_pubsub_bulk():
+    '''
+    bulks are published with one send per topic, and delivered per message
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_pubsub_bulk',
+                         'channel'  : 'test_bulk',
+                         'kind'     : 'pubsub',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.PubSub(cfg)
+    b.start()
+
+    data = list()
+
+    def cb(topic, msg):
+        data.append([topic, msg['idx']])
+
+    sub = ru.zmq.Subscriber(channel=cfg['channel'], url=str(b.addr_sub))
+    sub.subscribe('state', cb)
+
+    pub = ru.zmq.Publisher(channel=cfg['channel'], url=str(b.addr_pub))
+    time.sleep(0.5)
+
+    pub.put_bulk('state', [{'idx': idx} for idx in range(1000)])
+    pub.put_bulk(None, {'state_a': [{'idx': idx} for idx in range(10)],
+                        'state_b': [{'idx': idx} for idx in range(20)],
+                        'other'  : [{'idx': idx} for idx in range(30)]})
+    pub.put_bulk('state', [])
+
+    with pytest.raises(AssertionError):
+        pub.put_bulk('state', ['foo'])
+
+    start = time.time()
+    while len(data) < 1030 and time.time() - start < 5:
+        time.sleep(0.1)
+
+    assert(len(data) == 1030)
+    assert([d[1] for d in data if d[0] == 'state']   == list(range(1000)))
+    assert([d[1] for d in data if d[0] == 'state_a'] == list(range(10)))
+    assert([d[1] for d in data if d[0] == 'state_b'] == list(range(20)))
+
+    # one publication per subscribed topic passed the bridge (`other` is
+    # filtered by the publisher)
+    stats = b.stats
+    assert(stats['msgs_in'] == 3)
+
+    sub.unsubscribe(cb)
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_pubsub_get_bulk():
+    '''
+    get_bulk drains all queued publications as flat list of messages
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_pubsub_get_bulk',
+                         'channel'  : 'test_get_bulk',
+                         'kind'     : 'pubsub',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.PubSub(cfg)
+    b.start()
+
+    sub = ru.zmq.Subscriber(channel=cfg['channel'], url=str(b.addr_sub))
+    sub.subscribe('state')
+
+    pub = ru.zmq.Publisher(channel=cfg['channel'], url=str(b.addr_pub))
+    time.sleep(0.5)
+
+    assert(sub.get_bulk(timeout=100) == [])
+
+    for idx in range(20):
+        pub.put('state', {'idx': idx})
+    pub.put_bulk('state_x', [{'idx': idx} for idx in range(20, 50)])
+    time.sleep(0.5)
+
+    msgs = sub.get_bulk(timeout=1000)
+    assert([m[1]['idx'] for m in msgs] == list(range(50)))
+    assert(set([m[0] for m in msgs]) == {'state', 'state_x'})
+
+    # limits are checked per publication
+    pub.put_bulk('state', [{'idx': idx} for idx in range(3)])
+    for idx in range(3, 10):
+        pub.put('state', {'idx': idx})
+    time.sleep(0.5)
+
+    assert(len(sub.get_bulk(max_msgs=2, timeout=1000))  == 3)
+    assert(len(sub.get_bulk(max_bytes=1, timeout=1000)) == 1)
+    assert(len(sub.get_bulk(timeout=1000))              == 6)
+
+    # `get()` returns the messages of bulks as list, also for a single one
+    pub.put_bulk('state', [{'idx': 0}])
+    pub.put_bulk('state', [{'idx': 1}, {'idx': 2}])
+    pub.put('state', {'idx': 3})
+    time.sleep(0.5)
+
+    assert(sub.get_nowait(timeout=1000) == ['state', [{'idx': 0}]])
+    assert(sub.get_nowait(timeout=1000) == ['state', [{'idx': 1}, {'idx': 2}]])
+    assert(sub.get_nowait(timeout=1000) == ['state', {'idx': 3}])
+
+    b.stop()
+
+
 # ------------------------------------------------------------------------------
 # run tests if called directly
 if __name__ == '__main__':
 
     test_zmq_pubsub()
+    test_zmq_pubsub_codec()
+    test_zmq_pubsub_poller()
+    test_zmq_pubsub_topics()
+    test_zmq_pubsub_stats()
+    test_zmq_pubsub_cache()
+    test_zmq_pubsub_cache_slow()
+    test_zmq_pubsub_conflate()
+    test_zmq_pubsub_bulk()
+    test_zmq_pubsub_get_bulk()
 
 
 # ------------------------------------------------------------------------------
@@ -5,10 +5,17 @@ __copyright__ = 'Copyright 2019, RADICAL@Rutgers'
 __license__   = 'MIT'
 
 
+import os
+import gc
 import time
-import threading     as mt
+import queue
+import pytest
+import shutil
+import weakref
+import threading       as mt
+import multiprocessing as mp
 
-import radical.utils as ru
+import radical.utils   as ru
 
 
 # ------------------------------------------------------------------------------
@@ -315,12 +322,1310 @@ def test_zmq_queue_cb():
     assert(data['get']['A'].count('A') + data['get']['B'].count('B') == c_a + c_b)
 
 
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_latency():
+    '''
+    messages which arrive at an idle bridge should be forwarded immediately, and
+    not wait for the bridge to wake up from any idle sleep.
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_latency',
+                         'channel'  : 'test_latency',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put))
+    get = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+
+    # warm up the connections
+    put.put({'t': time.time()})
+    assert(get.get_nowait(timeout=1000))
+
+    lat = list()
+    for _ in range(10):
+        time.sleep(0.2)
+        put.put({'t': time.time()})
+        for msg in get.get():
+            lat.append(time.time() - msg['t'])
+
+    b.stop()
+
+    assert(len(lat) == 10)
+    assert(sorted(lat)[5] < 0.05), lat
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_prefetch():
+    '''
+    mix a prefetching getter with a request / reply getter on the same channel,
+    and ensure that all messages are received exactly once, in order.
+    '''
+
+    n   = 1000
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_prefetch',
+                         'channel'  : 'test_prefetch',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                         'bulk_size': 10,
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put   = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put))
+    get_1 = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get),
+                          cfg={'prefetch': 4})
+    get_2 = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+
+    for idx in range(n):
+        put.put({'idx': idx})
+
+    data = {1: list(),
+            2: list()}
+
+    def work_get(getter, uid):
+        while True:
+            msgs = getter.get_nowait(timeout=500)
+            if not msgs:
+                break
+            data[uid] += [msg['idx'] for msg in msgs]
+
+    t_1 = mt.Thread(target=work_get, args=[get_1, 1])
+    t_2 = mt.Thread(target=work_get, args=[get_2, 2])
+
+    t_1.start()
+    t_2.start()
+
+    t_1.join()
+    t_2.join()
+
+    b.stop()
+
+    assert(data[1])
+    assert(data[2])
+    assert(data[1] == sorted(data[1]))
+    assert(data[2] == sorted(data[2]))
+    assert(sorted(data[1] + data[2]) == list(range(n)))
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_prefetch_cb():
+    '''
+    prefetching getters with callbacks on the same endpoint share one socket -
+    ensure that no bulks are granted to (and lost on) a second socket
+    '''
+
+    n   = 200
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_prefetch_cb',
+                         'channel'  : 'test_prefetch_cb',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    lock = mt.Lock()
+    data = {1: list(),
+            2: list()}
+
+    def get_msg(uid):
+        def cb(msg):
+            with lock:
+                data[uid].append(msg['idx'])
+        return cb
+
+    gcfg  = {'prefetch': 4, 'bulk_size': 5}
+    get_1 = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get),
+                          cb=get_msg(1), cfg=gcfg)
+    get_2 = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get),
+                          cb=get_msg(2), cfg=gcfg)
+
+    put = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put))
+    for idx in range(n):
+        put.put({'idx': idx})
+
+    start = time.time()
+    while len(data[1]) + len(data[2]) < n and time.time() - start < 5:
+        time.sleep(0.1)
+
+    assert(data[1])
+    assert(data[2])
+    assert(sorted(data[1] + data[2]) == list(range(n)))
+    assert(b.stats['consumers'] == 1)
+
+    get_1.stop()
+    get_2.stop()
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_frames():
+    '''
+    the bridge splits and merges bulks without decoding messages - ensure that
+    mixed small and large messages survive that in order and intact
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_frames',
+                         'channel'  : 'test_frames',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                         'bulk_size': 3,
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put))
+    get = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+
+    big   = 'x' * (1024 * 1024)
+    msgs  = [{'idx': idx, 'data': big if idx % 4 == 0 else 'y'}
+             for idx in range(20)]
+
+    put.put(msgs[:7])
+    put.put(msgs[7])
+    put.put(msgs[8:])
+
+    time.sleep(0.1)
+
+    recv = list()
+    while len(recv) < len(msgs):
+        bulk = get.get_nowait(timeout=1000)
+        assert(bulk)
+        assert(len(bulk) <= 3)
+        recv += bulk
+
+    b.stop()
+
+    assert(recv == msgs)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_codecs():
+    '''
+    send messages with the different codecs over the same channel - the getter
+    needs to enable unsafe codecs only
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_codecs',
+                         'channel'  : 'test_codecs',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    url  = str(b.addr_put)
+    get  = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get),
+                         cfg={'codecs': ['pickle']})
+    big  = 'x' * (1024 * 1024)
+    data = {'msgpack': [{'a': 1}, {'b': big}],
+            'zlib'   : [{'a': 1}, {'b': big}],
+            'pickle' : [{'a': {1, 2}}, ('b', big.encode())],
+            'raw'    : [b'a', big.encode()]}
+
+    for codec, msgs in data.items():
+        put = ru.zmq.Putter(channel=cfg['channel'], url=url,
+                            cfg={'codec': codec})
+        put.put(msgs)
+        time.sleep(0.1)
+
+    recv = list()
+    while len(recv) < 8:
+        bulk = get.get_nowait(timeout=1000)
+        assert(bulk)
+        recv += bulk
+
+    assert(recv == data['msgpack'] + data['zlib'] + data['pickle'] + data['raw'])
+
+    # pickled messages are rejected unless enabled
+    safe = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+
+    ru.zmq.Putter(channel=cfg['channel'], url=url,
+                  cfg={'codec': 'pickle'}).put({'a': 1})
+    with pytest.raises(ValueError):
+        safe.get_nowait(timeout=1000)
+
+    ru.zmq.Putter(channel=cfg['channel'], url=url).put({'a': 2})
+    assert(safe.get_nowait(timeout=1000) == [{'a': 2}])
+
+    b.stop()
+
+    with pytest.raises(ValueError):
+        ru.zmq.Putter(channel=cfg['channel'], url=url, cfg={'codec': 'foo'})
+
+    with pytest.raises(ValueError):
+        ru.zmq.Getter(channel=cfg['channel'], url=url, cfg={'codecs': ['foo']})
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_strict():
+    '''
+    by default, bytes are received as str - in strict mode they stay bytes
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_strict',
+                         'channel'  : 'test_strict',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    url    = str(b.addr_put)
+    get    = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+    put    = ru.zmq.Putter(channel=cfg['channel'], url=url)
+    strict = ru.zmq.Putter(channel=cfg['channel'], url=url,
+                           cfg={'strict': True})
+    msg    = {'key': b'val', 'list': [b'foo', 'bar']}
+
+    put.put(msg)
+    assert(get.get_nowait(timeout=1000) == [{'key' : 'val',
+                                             'list': ['foo', 'bar']}])
+
+    strict.put(msg)
+    assert(get.get_nowait(timeout=1000) == [msg])
+
+    with pytest.raises(TypeError):
+        strict.put({'key': ('tuple', 'value')})
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_bounded():
+    '''
+    putters of a bounded channel are throttled once the bridge buffer is full
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_bounded',
+                         'channel'  : 'test_bounded',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                         'max_msgs' : 10,
+                         'max_bytes': 1024 * 1024,
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put  = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put), cfg=cfg)
+    get  = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+    bulk = ['x' * 1024 * 100] * 10
+
+    # fill the bridge and the socket buffers
+    n_put = 0
+    for _ in range(1000):
+        try:
+            put.put_nowait(bulk)
+            n_put += len(bulk)
+        except queue.Full:
+            if b.throttled:
+                break
+            time.sleep(0.1)
+
+    assert(b.throttled == 1)
+
+    # the zmq io thread may still flush some bulks, but timed puts fail soon
+    with pytest.raises(queue.Full):
+        for _ in range(1000):
+            put.put(bulk, timeout=100)
+            n_put += len(bulk)
+
+    # priority messages are not held back by the full buffer
+    put.put({'prio': 1}, timeout=1000, priority=1)
+    assert(get.get_nowait(timeout=1000) == [{'prio': 1}])
+    assert(b.throttled == 1)
+
+    # drain the channel - putters get released
+    n_get = 0
+    while n_get < n_put:
+        n_get += len(get.get_nowait(timeout=1000))
+
+    put.put(bulk, timeout=1000)
+    assert(len(get.get_nowait(timeout=1000)) == len(bulk))
+    assert(b.throttle_time > 0)
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_backlog():
+    '''
+    split and reassemble bulks in the bridge backlog
+    '''
+
+    from radical.utils.zmq.backlog import Backlog
+    from radical.utils.zmq.utils   import pack_bulk, unpack_bulk
+    from radical.utils.zmq.utils   import split_chunks, join_chunks
+
+    big  = 'x' * 1024 * 1024
+    msgs = [{'idx': i} for i in range(25)] + [big] + \
+           [{'idx': i} for i in range(25, 50)]
+    buf  = Backlog()
+
+    for i in range(0, len(msgs), 10):
+        for chunk in split_chunks(pack_bulk(msgs[i:i + 10])):
+            buf.put(chunk)
+
+    assert(len(buf) == 51)
+    assert(buf.nbytes > len(big))
+
+    recv = list()
+    for size in [3, 7, 1, 20]:
+        recv += unpack_bulk(join_chunks(buf.get(size)))
+        assert(len(recv) + len(buf) == 51)
+
+    # return some messages, then drain the backlog
+    chunks = buf.get(5)
+    buf.unget(chunks)
+    while len(buf):
+        recv += unpack_bulk(join_chunks(buf.get(4)))
+
+    assert(recv == msgs)
+    assert(buf.nbytes == 0)
+    assert(not buf.get(10))
+
+    # limit bulks by size
+    for chunk in split_chunks(pack_bulk(msgs)):
+        buf.put(chunk)
+
+    # small messages are packed into 6 bytes each
+    bulk = unpack_bulk(join_chunks(buf.get(100, max_bytes=50)))
+    assert(bulk == msgs[:8])
+
+    bulk = unpack_bulk(join_chunks(buf.get(100, max_bytes=1)))
+    assert(bulk == msgs[8:9])
+
+    bulk = unpack_bulk(join_chunks(buf.get(100, max_bytes=1000)))
+    assert(bulk == msgs[9:25])
+
+    bulk = unpack_bulk(join_chunks(buf.get(100, max_bytes=1000)))
+    assert(bulk == [big])
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_wal():
+    '''
+    spill a durable backlog to disk, and replay undelivered messages
+    '''
+
+    from radical.utils.zmq.backlog import DurableBacklog
+    from radical.utils.zmq.utils   import pack_bulk, unpack_bulk
+    from radical.utils.zmq.utils   import split_chunks, join_chunks
+
+    path = '/tmp/test_queue_wal.%d.wal' % os.getpid()
+    msgs = [{'idx': i, 'data': 'x' * 100} for i in range(1000)]
+    buf  = DurableBacklog(path, spill_bytes=10 * 1024, segment_bytes=20 * 1024)
+
+    try:
+        for i in range(0, len(msgs), 10):
+            for chunk in split_chunks(pack_bulk(msgs[i:i + 10])):
+                buf.put(chunk)
+
+        # most messages are only on disk
+        assert(len(buf) == 1000)
+        assert(buf.nchunks < 20)
+        assert(len(os.listdir(path)) > 2)
+
+        recv = list()
+        for _ in range(5):
+            recv += unpack_bulk(join_chunks(buf.get(33)))
+            buf.ack()
+
+        # undelivered chunks are reloaded from disk
+        buf.unget(buf.get(20))
+        assert(len(buf) == 835)
+
+        # restart on the log after a partial write
+        buf.close()
+        last = sorted(os.listdir(path))[-2]
+        with open(os.path.join(path, last), 'ab') as fout:
+            fout.write(b'\x01\x00\x00')
+
+        buf = DurableBacklog(path, spill_bytes=10 * 1024,
+                             segment_bytes=20 * 1024)
+        assert(len(buf) == 835)
+
+        while len(buf):
+            recv += unpack_bulk(join_chunks(buf.get(100)))
+            buf.ack()
+
+        assert(recv == msgs)
+        assert(len(os.listdir(path)) == 2)
+
+    finally:
+        buf.close()
+        shutil.rmtree(path)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_durable():
+    '''
+    restart a durable bridge - it delivers the remaining messages
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_durable.%d' % os.getpid(),
+                         'channel'  : 'test_durable',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                         'bulk_size': 10,
+                         'durable'  : True,
+                        })
+
+    msgs = [{'idx': i} for i in range(100)]
+    recv = list()
+
+    try:
+        b = ru.zmq.Queue(cfg)
+        b.start()
+
+        put = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put))
+        get = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+
+        put.put(msgs)
+        for _ in range(3):
+            recv += get.get()
+
+        b.stop()
+        while b.alive:
+            time.sleep(0.1)
+
+        b = ru.zmq.Queue(cfg)
+        b.start()
+
+        get = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+        while len(recv) < len(msgs):
+            recv += get.get()
+
+        b.stop()
+        assert(recv == msgs)
+
+    finally:
+        shutil.rmtree('/tmp/%s.wal' % cfg.uid)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_bulks():
+    '''
+    getters can limit the bulk size, and slow getters receive smaller bulks
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_bulks',
+                         'channel'  : 'test_bulks',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                         'bulk_time': 0.01,
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put   = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put))
+    get_1 = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get),
+                          cfg={'bulk_size': 5})
+    get_2 = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+
+    put.put([{'idx': i} for i in range(100)])
+    time.sleep(0.1)
+    assert(len(get_1.get()) == 5)
+
+    put.put(['x' * 10 * 1024] * 2000)
+    time.sleep(0.1)
+
+    sizes = list()
+    for _ in range(5):
+        sizes.append(len(get_2.get()))
+        time.sleep(0.1)
+
+    assert(sizes[0] == 1024)
+    assert(sizes[-1] < 200)
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_batch():
+    '''
+    coalesce messages from individual puts
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_batch',
+                         'channel'  : 'test_batch',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put),
+                        cfg={'batch_msgs': 10, 'batch_time': 0.5})
+    get = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+
+    for i in range(25):
+        put.put({'idx': i})
+
+    # two full batches are sent right away, the rest after `batch_time`
+    time.sleep(0.1)
+    assert(len(get.get_nowait(timeout=100)) == 20)
+    assert(get.get_nowait(timeout=100) is None)
+    assert(len(get.get_nowait(timeout=1000)) == 5)
+
+    put.put({'idx': 25})
+    put.flush()
+    assert(get.get_nowait(timeout=100) == [{'idx': 25}])
+
+    # closing sends pending messages and stops the flusher thread, which then
+    # does not keep the putter alive anymore
+    put.put({'idx': 26})
+    flusher = put._flusher
+    ref     = weakref.ref(put)
+    put.close()
+    del(put)
+    gc.collect()
+
+    assert(not flusher.is_alive())
+    assert(ref() is None)
+    assert(get.get_nowait(timeout=100) == [{'idx': 26}])
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_batch_full():
+    '''
+    puts are not blocked while a batch waits for a full channel
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_batch_full',
+                         'channel'  : 'test_batch_full',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                         'max_msgs' : 10,
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put  = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put), cfg=cfg)
+    get  = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+    bulk = ['x' * 1024 * 100] * 10
+
+    # fill the bridge
+    n_put = 0
+    while not b.throttled:
+        try:
+            put.put_nowait(bulk)
+            n_put += len(bulk)
+        except queue.Full:
+            time.sleep(0.1)
+
+    # a batching putter blocks while sending a full batch
+    bcfg  = ru.Config(cfg={'max_msgs': 10, 'batch_msgs': 2, 'batch_time': 60})
+    batch = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put),
+                          cfg=bcfg)
+    n_batch = [0]
+    stop    = mt.Event()
+
+    def work_put():
+        while not stop.is_set() and n_batch[0] < 1000:
+            batch.put(bulk[0])
+            n_batch[0] += 1
+
+    thr = mt.Thread(target=work_put)
+    thr.daemon = True
+    thr.start()
+
+    n = -1
+    while n != n_batch[0]:
+        n = n_batch[0]
+        time.sleep(0.5)
+    assert(n < 1000)
+
+    # ... but other puts which do not fill the next batch are not blocked
+    thr_2 = mt.Thread(target=batch.put_nowait, args=[{'idx': 0}])
+    thr_2.daemon = True
+    thr_2.start()
+    thr_2.join(timeout=1.0)
+    assert(not thr_2.is_alive())
+
+    # drain the channel - all messages arrive
+    stop.set()
+    n_get = 0
+    while thr.is_alive():
+        n_get += len(get.get_nowait(timeout=100) or [])
+
+    batch.flush()
+    n_put += n_batch[0] + 1
+
+    while n_get < n_put:
+        msgs = get.get_nowait(timeout=1000)
+        assert(msgs)
+        n_get += len(msgs)
+
+    assert(n_get == n_put)
+
+    batch.close()
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_executor():
+    '''
+    round-robin over several callbacks, handled by different executors
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_executor',
+                         'channel'  : 'test_executor',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    data = {'inline': list(),
+            'thread': list()}
+    lock = mt.Lock()
+
+    def cb_inline(msg):
+        data['inline'].append(msg)
+
+    def cb_thread(msg):
+        time.sleep(0.001)
+        with lock:
+            data['thread'].append(msg)
+
+    get = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+    get.subscribe(cb_inline)
+    get.subscribe(cb_thread, executor={'kind'    : 'thread',
+                                       'threads' : 4,
+                                       'order_by': 'uid'})
+
+    with pytest.raises(ValueError):
+        get.subscribe(cb_thread, executor='foo')
+
+    with pytest.raises(ValueError):
+        get.subscribe(cb_thread, lock=lock, executor='process')
+
+    put = ru.zmq.Putter(channel=cfg['channel'], url=str(b.addr_put))
+    put.put([{'uid': 'task.%d' % (i % 4), 'idx': i} for i in range(100)])
+
+    start = time.time()
+    while len(data['inline']) + len(data['thread']) < 100:
+        assert(time.time() - start < 5)
+        time.sleep(0.1)
+
+    # messages are split evenly, and messages for the same uid stay in order
+    assert(len(data['inline']) == 50)
+    assert(len(data['thread']) == 50)
+
+    for uid in ['task.0', 'task.2']:
+        idxs = [m['idx'] for m in data['thread'] if m['uid'] == uid]
+        assert(len(idxs) == 25)
+        assert(idxs == sorted(idxs))
+
+    stats = dict(get.cb_stats())
+    assert(stats[cb_inline]['calls'] == 50)
+    assert(stats[cb_thread]['calls'] == 50)
+    assert(stats[cb_thread]['depth'] ==  0)
+    assert(stats[cb_thread]['peak']  >=  1)
+
+    get.unsubscribe(cb_inline)
+    get.unsubscribe(cb_thread)
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_pool():
+    '''
+    endpoints share one zmq context, and putters can reuse pooled sockets
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_pool',
+                         'channel'  : 'test_pool',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    url = str(b.addr_put)
+    get = ru.zmq.Getter(channel=cfg['channel'], url=str(b.addr_get))
+    p_1 = ru.zmq.Putter(channel=cfg['channel'], url=url, cfg={'pool': True})
+    p_2 = ru.zmq.Putter(channel=cfg['channel'], url=url, cfg={'pool': True})
+
+    assert(p_1._q.context is get._q.context)
+    assert(p_1._q.context is b._put.context)
+
+    # leased sockets are exclusive, and are reused once released
+    assert(p_1._q is not p_2._q)
+
+    sock = p_1._q
+    p_1.put({'idx': 1})
+    p_1.close()
+
+    p_3 = ru.zmq.Putter(channel=cfg['channel'], url=url, cfg={'pool': True})
+    assert(p_3._q is sock)
+
+    p_3.put({'idx': 2})
+    time.sleep(0.1)
+    assert(get.get_nowait(timeout=1000) == [{'idx': 1}, {'idx': 2}])
+
+    p_2.close()
+    p_3.close()
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_transports():
+    '''
+    bridges bind local transports, and endpoints pick the fastest one
+    '''
+
+    from radical.utils.zmq.transport import select_url
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_transports',
+                         'channel'  : 'test_transports',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put_url = str(b.addr_put)
+    schemas = [ru.Url(addr).schema for addr in b.addrs_in]
+    assert(schemas == ['tcp', 'inproc', 'ipc'])
+    assert(b.addrs_in[0] == put_url)
+
+    # the ipc address is advertised, and is specific to the bridge
+    ipc_url = b.addrs_in[2]
+    assert(cfg['uid'] in ipc_url)
+
+    # same process: inproc
+    assert(select_url(put_url) == b.addrs_in[1])
+
+    # remote hosts: tcp (without the query, which is not meant for zmq)
+    tcp_url = 'tcp://%s:%d' % (ru.Url(put_url).host, ru.Url(put_url).port)
+    remote  = ru.Url(put_url)
+    remote.host = '10.255.255.1'
+    assert(select_url(str(remote)) == 'tcp://10.255.255.1:%d' % remote.port)
+
+    # other processes on the same node find the ipc transport via the tcp
+    # address, and otherwise use the address they are given
+    def work_put():
+        assert(select_url(put_url) == ipc_url)
+        assert(select_url(ipc_url) == ipc_url)
+        assert(select_url(tcp_url) == tcp_url)
+        ru.zmq.Putter(cfg['channel'], put_url).put({'src': 'put'})
+        ru.zmq.Putter(cfg['channel'], ipc_url).put({'src': 'ipc'})
+        ru.zmq.Putter(cfg['channel'], tcp_url).put({'src': 'tcp'})
+        time.sleep(0.5)
+
+    proc = mp.Process(target=work_put)
+    proc.start()
+    proc.join()
+    assert(proc.exitcode == 0)
+
+    get  = ru.zmq.Getter(cfg['channel'], str(b.addr_get))
+    msgs = list()
+    while len(msgs) < 3:
+        bulk = get.get_nowait(timeout=1000)
+        assert(bulk)
+        msgs += bulk
+    assert(sorted([msg['src'] for msg in msgs]) == ['ipc', 'put', 'tcp'])
+
+    # a stopped bridge withdraws its local transports
+    b.stop()
+    assert(select_url(put_url) == tcp_url)
+    assert(not os.path.exists(ipc_url[len('ipc://'):]))
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_stats():
+    '''
+    bridges count messages, and report their counters periodically
+    '''
+
+    import json
+
+    fname = '/tmp/test_queue_stats.stats'
+    if os.path.exists(fname):
+        os.unlink(fname)
+
+    cfg = ru.Config(cfg={'uid'           : 'test_queue_stats',
+                         'channel'       : 'test_stats',
+                         'kind'          : 'queue',
+                         'log_level'     : 'error',
+                         'path'          : '/tmp/',
+                         'sid'           : 'test_sid',
+                         'stats_interval': 0.1,
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put = ru.zmq.Putter(cfg['channel'], str(b.addr_put))
+    get = ru.zmq.Getter(cfg['channel'], str(b.addr_get))
+
+    put.put([{'idx': idx} for idx in range(10)])
+    time.sleep(0.1)
+
+    stats = b.stats
+    assert(stats['msgs_in']  == 10)
+    assert(stats['msgs_out'] ==  0)
+    assert(stats['depth']    == 10)
+    assert(stats['bytes_in'] == stats['depth_b'])
+
+    assert(len(get.get_nowait(timeout=1000)) == 10)
+    time.sleep(0.1)
+
+    stats = b.stats
+    assert(stats['msgs_out']  == 10)
+    assert(stats['bytes_out'] == stats['bytes_in'])
+    assert(stats['depth']     ==  0)
+    assert(stats['consumers'] ==  1)
+    assert(stats['latency']['count'] == 10)
+    assert(sum(stats['latency']['buckets'].values()) == 10)
+
+    # latencies are measured per message, also if a message of a higher
+    # priority overtakes older messages
+    put.put([{'idx': idx} for idx in range(10)])
+    time.sleep(1.0)
+    put.put([{'idx': 10}], priority=1)
+    time.sleep(0.1)
+
+    assert(get.get_nowait(timeout=1000) == [{'idx': 10}])
+    time.sleep(0.1)
+
+    stats = b.stats
+    assert(stats['latency']['count'] == 11)
+    assert(stats['latency']['max']   <  1.0)
+
+    time.sleep(0.5)
+    b.stop()
+    time.sleep(0.6)
+
+    with open(fname) as fin:
+        reports = [json.loads(line) for line in fin]
+
+    assert(len(reports) > 1)
+    assert(reports[-1]['uid']      == cfg['uid'])
+    assert(reports[-1]['msgs_out'] == 11)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_consumers():
+    '''
+    getters which are gone are not counted as consumers anymore
+    '''
+
+    cfg = ru.Config(cfg={'uid'         : 'test_queue_consumers',
+                         'channel'     : 'test_consumers',
+                         'kind'        : 'queue',
+                         'log_level'   : 'error',
+                         'path'        : '/tmp/',
+                         'sid'         : 'test_sid',
+                         'consumer_ttl': 0.5,
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put = ru.zmq.Putter(cfg['channel'], str(b.addr_put))
+    put.put([{'idx': idx} for idx in range(20)])
+
+    def work_get(q):
+        get = ru.zmq.Getter(cfg['channel'], str(b.addr_get),
+                            cfg={'bulk_size': 1})
+        q.put(get.get_nowait(timeout=1000))
+
+    q = mp.Queue()
+    for _ in range(20):
+        proc = mp.Process(target=work_get, args=[q])
+        proc.start()
+        proc.join()
+
+    assert(sorted([q.get(timeout=1)[0]['idx'] for _ in range(20)])
+           == list(range(20)))
+
+    # a live getter which keeps requesting is still counted, those which are
+    # gone are forgotten
+    get = ru.zmq.Getter(cfg['channel'], str(b.addr_get))
+    for _ in range(6):
+        get.get_nowait(timeout=200)
+
+    assert(b.stats['consumers'] == 1)
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_trace():
+    '''
+    putters trace a sample of their bulks, getters collect the latencies
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_trace',
+                         'channel'  : 'test_trace',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put = ru.zmq.Putter(cfg['channel'], str(b.addr_put), cfg={'trace': 2})
+    get = ru.zmq.Getter(cfg['channel'], str(b.addr_get))
+
+    # traced bulks are not merged with other bulks by the bridge
+    for idx in range(4):
+        put.put([{'idx': idx}, {'idx': idx, 'data': 'x' * (1024 * 1024)}])
+
+    time.sleep(0.1)
+
+    msgs = list()
+    while len(msgs) < 8:
+        msgs += get.get_nowait(timeout=1000)
+
+    assert([m['idx'] for m in msgs] == [0, 0, 1, 1, 2, 2, 3, 3])
+
+    stats = get.trace_stats()
+    assert(stats['traces']          == 2)
+    assert(stats['total']['count']  == stats['traces'])
+    assert(stats['bridge']['count'] == stats['traces'])
+    assert(stats['total']['avg']    >= stats['bridge']['avg'])
+
+    # the chunk header carries the trace
+    traces = list()
+    frames = ru.zmq.utils.pack_bulk([{'a': 1}], trace=[1.0, 2.0, 3.0, 1, 'x'])
+    assert(ru.zmq.utils.unpack_bulk(frames, traces) == [{'a': 1}])
+    assert(traces == [[1.0, 2.0, 3.0, 1, 'x']])
+
+    b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_sharded():
+    '''
+    sharded channels spread messages over shards, and keep per key order
+    '''
+
+    import json
+
+    for mode in ['thread', 'process']:
+
+        cfg = ru.Config(cfg={'uid'           : 'test_queue_sharded_%s' % mode,
+                             'channel'       : 'test_sharded',
+                             'kind'          : 'queue',
+                             'log_level'     : 'error',
+                             'path'          : '/tmp/',
+                             'sid'           : 'test_sid',
+                             'shards'        : 3,
+                             'shard_mode'    : mode,
+                             'stats_interval': 0.1,
+                            })
+
+        fname = '/tmp/%s.stats' % cfg['uid']
+        if os.path.exists(fname):
+            os.unlink(fname)
+
+        b = ru.zmq.Bridge.create(cfg)
+        assert(isinstance(b, ru.zmq.ShardedQueue))
+        assert(b.shards == 3)
+        assert(isinstance(b.addr_put, ru.Url))
+        assert(len(str(b.addr_put).split(',')) == 3)
+        assert(str(ru.Url(b.addr_get)) == str(b.addr_get))
+        b.start()
+
+        # round-robin: one bulk per shard
+        put = ru.zmq.Putter(cfg['channel'], b.addr_put)
+        for idx in range(3):
+            put.put([{'uid': 'task.%d' % idx, 'idx': idx}])
+
+        # hashed: all messages of an entity pass the same shard
+        hput = ru.zmq.Putter(cfg['channel'], b.addr_put,
+                             cfg={'shard_by': 'uid'})
+        hput.put([{'uid': 'task.%d' % (idx % 4), 'idx': idx}
+                  for idx in range(3, 43)])
+
+        start = time.time()
+        while b.stats['msgs_in'] < 43 and time.time() - start < 5:
+            time.sleep(0.1)
+
+        stats = b.stats
+        assert(stats['msgs_in'] == 43)
+        assert(len(stats['shards']) == 3)
+        assert(all([shard['msgs_in'] for shard in stats['shards']]))
+
+        get  = ru.zmq.Getter(cfg['channel'], b.addr_get)
+        msgs = list()
+        start = time.time()
+        while len(msgs) < 43 and time.time() - start < 10:
+            msgs += get.get_nowait(timeout=1000) or []
+
+        assert(sorted([m['idx'] for m in msgs]) == list(range(43)))
+
+        # the first (round-robin) messages can overtake each other
+        for uid in ['task.0', 'task.1', 'task.2', 'task.3']:
+            idxs = [m['idx'] for m in msgs if m['uid'] == uid and m['idx'] > 2]
+            assert(idxs == sorted(idxs))
+
+        assert(get.get_nowait(timeout=100) is None)
+
+        # the counters of all shards are summed up and reported
+        stats = b.stats
+        assert(stats['msgs_out']  == 43)
+        assert(stats['consumers'] ==  3)
+        assert(stats['latency']['count'] == 43)
+
+        b.stop()
+
+        with open(fname) as fin:
+            reports = [json.loads(line) for line in fin]
+
+        assert(reports[-1]['uid']      == cfg['uid'])
+        assert(reports[-1]['msgs_out'] == 43)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_sharded_fail():
+    '''
+    shards which were started are stopped if a later shard fails to start
+    '''
+
+    cfg = ru.Config(cfg={'uid'       : 'test_queue_sharded_fail',
+                         'channel'   : 'test_sharded_fail',
+                         'kind'      : 'queue',
+                         'log_level' : 'error',
+                         'path'      : '/tmp/',
+                         'sid'       : 'test_sid',
+                         'shards'    : 3,
+                        })
+
+    replies = list()
+
+    class FailingQueue(ru.zmq.ShardedQueue):
+
+        def _reply(self, conn):
+            if len(replies) == 2:
+                raise RuntimeError('shard failed')
+            replies.append(super(FailingQueue, self)._reply(conn))
+            return replies[-1]
+
+    with pytest.raises(RuntimeError):
+        FailingQueue(cfg)
+
+    assert(len(replies) == 2)
+    assert(not [proc for proc in mp.active_children()
+                     if proc.name.startswith(cfg['uid'])])
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_priority():
+    '''
+    messages with higher priority overtake the backlog, without starving it
+    '''
+
+    for max_skip in [0, 2]:
+
+        cfg = ru.Config(cfg={'uid'      : 'test_queue_priority_%d' % max_skip,
+                             'channel'  : 'test_priority',
+                             'kind'     : 'queue',
+                             'log_level': 'error',
+                             'path'     : '/tmp/',
+                             'sid'      : 'test_sid',
+                             'max_skip' : max_skip,
+                            })
+
+        b = ru.zmq.Queue(cfg)
+        b.start()
+
+        put = ru.zmq.Putter(cfg['channel'], str(b.addr_put))
+        get = ru.zmq.Getter(cfg['channel'], str(b.addr_get),
+                            cfg={'bulk_size': 10})
+
+        put.put([{'lane': 0, 'idx': idx} for idx in range(50)])
+        put.put([{'lane': 1, 'idx': idx} for idx in range(30)], priority=1)
+        put.put([{'lane': 9, 'idx': idx} for idx in range(10)], priority=9)
+        time.sleep(0.2)
+
+        lanes = list()
+        msgs  = list()
+        while len(msgs) < 90:
+            bulk   = get.get_nowait(timeout=1000)
+            msgs  += bulk
+            lanes.append(bulk[0]['lane'])
+
+        for lane in [0, 1, 9]:
+            idxs = [m['idx'] for m in msgs if m['lane'] == lane]
+            assert(idxs == list(range(len(idxs))))
+
+        if not max_skip:
+            assert(lanes == [9, 1, 1, 1, 0, 0, 0, 0, 0])
+        else:
+            # lane 0 is served after being passed over twice
+            assert(lanes == [9, 1, 0, 1, 1, 0, 0, 0, 0])
+
+        b.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_queue_get_bulk():
+    '''
+    get_bulk drains all bulks which already arrived, within the given limits
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_queue_get_bulk',
+                         'channel'  : 'test_get_bulk',
+                         'kind'     : 'queue',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    b = ru.zmq.Queue(cfg)
+    b.start()
+
+    put = ru.zmq.Putter(cfg['channel'], str(b.addr_put))
+
+    # without prefetching, only one bulk is in flight
+    get = ru.zmq.Getter(cfg['channel'], str(b.addr_get),
+                        cfg={'bulk_size': 10})
+
+    put.put([{'idx': idx} for idx in range(30)])
+    time.sleep(0.5)
+
+    for _ in range(3):
+        assert(len(get.get_bulk(timeout=1000)) == 10)
+
+    # prefetched bulks are drained at once
+    get = ru.zmq.Getter(cfg['channel'], str(b.addr_get),
+                        cfg={'bulk_size': 10, 'prefetch': 4})
+
+    put.put([{'idx': idx} for idx in range(100)])
+    time.sleep(0.5)
+
+    # limits are checked per bulk
+    msgs = get.get_bulk(max_msgs=5, timeout=1000)
+    assert(0 < len(msgs) <= 10)
+
+    bulk = get.get_bulk(max_bytes=1, timeout=1000)
+    assert(0 < len(bulk) <= 10)
+    msgs += bulk
+
+    # how many bulks are drained at once depends on how many arrived
+    bulk = get.get_bulk(timeout=1000)
+    assert(0 < len(bulk) <= 100 - len(msgs))
+    msgs += bulk
+
+    start = time.time()
+    while len(msgs) < 100 and time.time() - start < 10:
+        msgs += get.get_bulk(timeout=1000)
+
+    assert([m['idx'] for m in msgs] == list(range(100)))
+    assert(get.get_bulk(timeout=100) == [])
+
+    get.subscribe(lambda msg: None)
+    with pytest.raises(RuntimeError):
+        get.get_bulk()
+
+    get.stop()
+    b.stop()
+
+
 # ------------------------------------------------------------------------------
 # run tests if called directly
 if __name__ == '__main__':
 
     test_zmq_queue()
     test_zmq_queue_cb()
+    test_zmq_queue_latency()
+    test_zmq_queue_prefetch()
+    test_zmq_queue_prefetch_cb()
+    test_zmq_queue_frames()
+    test_zmq_queue_codecs()
+    test_zmq_queue_strict()
+    test_zmq_queue_bounded()
+    test_zmq_queue_backlog()
+    test_zmq_queue_wal()
+    test_zmq_queue_durable()
+    test_zmq_queue_bulks()
+    test_zmq_queue_batch()
+    test_zmq_queue_batch_full()
+    test_zmq_queue_executor()
+    test_zmq_queue_pool()
+    test_zmq_queue_transports()
+    test_zmq_queue_stats()
+    test_zmq_queue_consumers()
+    test_zmq_queue_trace()
+    test_zmq_queue_sharded()
+    test_zmq_queue_sharded_fail()
+    test_zmq_queue_priority()
+    test_zmq_queue_get_bulk()
 
 
 # ------------------------------------------------------------------------------
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+__author__    = 'Radical.Utils Development Team'
+__copyright__ = 'Copyright 2019, RADICAL@Rutgers'
+__license__   = 'MIT'
+
+
+import zmq
+import time
+import pytest
+import threading          as mt
+import concurrent.futures as cf
+
+import radical.utils   as ru
+
+from radical.utils.zmq.context   import get_context
+from radical.utils.zmq.transport import select_url
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_rpc():
+    '''
+    clients get the results (or errors) of the handlers they call
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_rpc',
+                         'channel'  : 'test_rpc',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                        })
+
+    def fail(msg):
+        raise ValueError(msg)
+
+    server = ru.zmq.Server(cfg)
+    server.register('add',  lambda a, b=0: a + b)
+    server.register('echo', lambda *args, **kwargs: [args, kwargs])
+    server.register('fail', fail)
+    server.start()
+
+    assert(server.addr.schema == 'tcp')
+    assert(str(server.addr) in server.addrs)
+
+    client = ru.zmq.Client(cfg['channel'], str(server.addr))
+
+    assert(client.request('add', [1, 2])              == 3)
+    assert(client.request('add', [1], {'b': 4})       == 5)
+    assert(client.request('echo', ['a'], {'b': None}) == [['a'], {'b': None}])
+
+    with pytest.raises(RuntimeError) as e:
+        client.request('fail', ['oops'])
+    assert('ValueError: oops' in str(e.value))
+
+    with pytest.raises(RuntimeError):
+        client.request('foo')
+
+    # many requests in flight, from several threads, and several clients
+    results = dict()
+
+    def work(idx):
+        c       = ru.zmq.Client(cfg['channel'], str(server.addr))
+        futures = [c.submit('add', [idx, i]) for i in range(100)]
+        results[idx] = [f.result() for f in futures]
+        assert(c.pending == 0)
+        c.close()
+
+    threads = [mt.Thread(target=work, args=[idx]) for idx in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    for idx in range(4):
+        assert(results[idx] == [idx + i for i in range(100)])
+
+    # replies are counted after they are sent
+    time.sleep(0.1)
+
+    stats = server.stats
+    assert(stats['msgs_in']   == 405)
+    assert(stats['msgs_out']  == 405)
+    assert(stats['consumers'] == 5)
+
+    # requests the server cannot decode are dropped, and do not harm it
+    codec = ru.zmq.codec.get_codec('pickle')
+    sock  = get_context().socket(zmq.DEALER)
+    sock.linger = 0
+    sock.connect(select_url(str(server.addr)))
+    sock.send_multipart([b'', b'garbage'])
+    sock.send_multipart([b''] + ru.zmq.utils.pack_bulk([{'id' : 1,
+                                                         'cmd': 'add'}], codec))
+    assert(not sock.poll(timeout=200))
+    sock.close()
+
+    assert(client.request('add', [1, 2]) == 3)
+
+    client.close()
+    with pytest.raises(RuntimeError):
+        client.submit('add', [1, 2])
+
+    server.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_rpc_timeout():
+    '''
+    slow requests time out, and concurrent requests are handled concurrently
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_rpc_timeout',
+                         'channel'  : 'test_rpc_timeout',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                         'workers'  : 4,
+                        })
+
+    def sleep(t):
+        time.sleep(t)
+        return t
+
+    server = ru.zmq.Server(cfg)
+    server.register('sleep', sleep)
+    server.start()
+
+    client = ru.zmq.Client(cfg['channel'], str(server.addr),
+                           cfg={'timeout': 2000})
+
+    # the late reply is ignored
+    start = time.time()
+    with pytest.raises(cf.TimeoutError):
+        client.request('sleep', [0.5], timeout=100)
+    assert(time.time() - start < 0.4)
+    assert(client.pending == 0)
+
+    time.sleep(0.5)
+    assert(client.request('sleep', [0.0]) == 0.0)
+
+    # four workers handle four slow requests at once
+    start   = time.time()
+    futures = [client.submit('sleep', [0.3]) for _ in range(4)]
+    assert([f.result() for f in futures] == [0.3] * 4)
+    assert(time.time() - start < 1.0)
+
+    client.close()
+    server.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_zmq_rpc_invalid():
+    '''
+    invalid requests do not kill a server which calls handlers in its thread
+    '''
+
+    cfg = ru.Config(cfg={'uid'      : 'test_rpc_invalid',
+                         'channel'  : 'test_rpc_invalid',
+                         'log_level': 'error',
+                         'path'     : '/tmp/',
+                         'sid'      : 'test_sid',
+                         'workers'  : 0,
+                        })
+
+    server = ru.zmq.Server(cfg)
+    server.register('add', lambda a, b=0: a + b)
+    server.start()
+
+    # a request which is no dict is dropped, one with invalid fields fails
+    sock = get_context().socket(zmq.DEALER)
+    sock.linger = 0
+    sock.connect(select_url(str(server.addr)))
+    sock.send_multipart([b''] + ru.zmq.utils.pack_bulk([[1, 2]]))
+    assert(not sock.poll(timeout=200))
+
+    sock.send_multipart([b''] + ru.zmq.utils.pack_bulk(
+                                     [{'id': 1, 'cmd': 'add', 'timeout': 'x'}]))
+    assert(sock.poll(timeout=1000))
+    rep = ru.zmq.utils.unpack_bulk(sock.recv_multipart()[1:])
+    assert(rep[0]['id'] == 1)
+    assert('TypeError' in rep[0]['err'])
+    sock.close()
+
+    client = ru.zmq.Client(cfg['channel'], str(server.addr))
+    assert(client.request('add', [1, 2], timeout=1000) == 3)
+    assert(server.alive)
+
+    client.close()
+    server.stop()
+
+
+# ------------------------------------------------------------------------------
+# run tests if called directly
+if __name__ == '__main__':
+
+    test_zmq_rpc()
+    test_zmq_rpc_timeout()
+    test_zmq_rpc_invalid()
+
+
+# ------------------------------------------------------------------------------
+